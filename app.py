@@ -1,24 +1,44 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_from_directory, make_response
+from flask import Flask, Request, render_template, request, jsonify, redirect, url_for, session, send_file, make_response, Response, abort
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Epilogue, Field, File, Data
 from datetime import datetime, timezone, timedelta
 import os
 import configparser
 import uuid
-import requests
+import httpx
+import asyncio
+import http.cookiejar
 import json
 import re
+import base64
+import io
+import random
+import queue
+import time
+import hashlib
+import shutil
+import socket
+import functools
 import threading
+import multiprocessing
+import click
+import sqlite3
 from threading import Lock
+from collections import deque, OrderedDict, Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, BrokenExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.exc import IntegrityError
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///homework_system.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True, 'pool_recycle': 300}
 
 # 读取配置文件
 config = configparser.ConfigParser()
@@ -29,6 +49,55 @@ ENABLE_IMAGE_UPLOAD = config.getboolean('settings', 'enable_image_upload', fallb
 MAX_IMAGES_PER_HOMEWORK = config.getint('settings', 'max_images_per_homework', fallback=5)
 ALLOWED_EXTENSIONS = set(config.get('settings', 'allowed_image_formats', fallback='jpg,jpeg,png,gif').split(','))
 MAX_IMAGE_SIZE_MB = config.getint('settings', 'max_image_size_mb', fallback=10)
+IMAGE_MAX_EDGE = config.getint('settings', 'image_max_edge', fallback=1920)  # 0为不缩小
+IMAGE_JPEG_QUALITY = config.getint('settings', 'image_jpeg_quality', fallback=85)
+IMAGE_PROCESS_WORKERS = config.getint('settings', 'image_process_workers', fallback=2)
+IMAGE_DERIVATIVE_CACHE_MB = config.getint('settings', 'image_derivative_cache_mb', fallback=512)
+UPLOAD_CACHE_MAX_AGE = config.getint('settings', 'upload_cache_max_age', fallback=31536000)  # 秒
+UPLOAD_SEND_MODE = config.get('settings', 'upload_send_mode', fallback='direct').strip().lower()  # direct/x-accel-redirect/x-sendfile
+UPLOAD_ACCEL_PREFIX = config.get('settings', 'upload_accel_prefix', fallback='/protected-uploads/')
+UPLOAD_MIGRATE_BATCH_SIZE = config.getint('settings', 'upload_migrate_batch_size', fallback=200)
+UPLOAD_MIGRATE_INTERVAL_SECONDS = config.getfloat('settings', 'upload_migrate_interval_seconds', fallback=1)
+CLEANUP_GRACE_MINUTES = config.getint('settings', 'cleanup_grace_minutes', fallback=30)  # 无图片提交创建后保留的时间
+CLEANUP_BATCH_SIZE = config.getint('settings', 'cleanup_batch_size', fallback=500)  # 定时清理每批处理的提交数
+
+# 图片存储配置
+STORAGE_BACKEND = config.get('storage', 'backend', fallback='local').strip().lower()  # local: 本地磁盘 / s3: S3兼容对象存储
+S3_ENDPOINT_URL = config.get('storage', 's3_endpoint_url', fallback='')  # 留空为AWS S3，MinIO等填写服务地址
+S3_REGION = config.get('storage', 's3_region', fallback='')
+S3_BUCKET = config.get('storage', 's3_bucket', fallback='')
+S3_PREFIX = config.get('storage', 's3_prefix', fallback='uploads/')
+S3_ACCESS_KEY = config.get('storage', 's3_access_key', fallback='')  # 留空时使用AWS环境变量或默认凭证
+S3_SECRET_KEY = config.get('storage', 's3_secret_key', fallback='')
+S3_PATH_STYLE = config.getboolean('storage', 's3_path_style', fallback=True)
+S3_PRESIGN_EXPIRES = config.getint('storage', 's3_presign_expires', fallback=3600)  # 秒
+
+# 是否在本进程启动定时任务和后台线程（测试、离线脚本设为0）
+BACKGROUND_SERVICES_ENABLED = os.environ.get('BACKGROUND_SERVICES', '1') != '0'
+
+# 数据库配置：环境变量优先于配置文件，便于多台服务器/多个进程共用同一份配置
+DATABASE_URI = os.environ.get('DATABASE_URL') or config.get('database', 'uri', fallback='').strip() or 'sqlite:///homework_system.db'
+if DATABASE_URI.startswith('postgres://'):
+    DATABASE_URI = 'postgresql://' + DATABASE_URI[len('postgres://'):]
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or config.getint('database', 'pool_size', fallback=10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or config.getint('database', 'max_overflow', fallback=40))
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS') or config.getint('database', 'statement_timeout_ms', fallback=30000))  # 0为不限制（仅PostgreSQL）
+DB_POOL_RECYCLE_SECONDS = config.getint('database', 'pool_recycle_seconds', fallback=1800)  # 仅服务器数据库
+
+# SQLite专用设置
+SQLITE_BUSY_TIMEOUT_MS = config.getint('database', 'sqlite_busy_timeout_ms', fallback=15000)  # 等待其他连接释放写锁的时间
+SQLITE_SYNCHRONOUS = config.get('database', 'sqlite_synchronous', fallback='NORMAL').strip().upper()  # OFF/NORMAL/FULL
+SQLITE_CACHE_SIZE_MB = config.getint('database', 'sqlite_cache_size_mb', fallback=64)  # 每个连接的页缓存
+SQLITE_MMAP_SIZE_MB = config.getint('database', 'sqlite_mmap_size_mb', fallback=256)  # 0为不使用内存映射
+
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+engine_options = {'pool_size': DB_POOL_SIZE, 'max_overflow': DB_MAX_OVERFLOW}
+if make_url(DATABASE_URI).get_backend_name() != 'sqlite':
+    # 服务器数据库：取出连接前检测是否断开，定期重建连接，避免使用被服务端或防火墙关闭的连接
+    engine_options.update({'pool_pre_ping': True, 'pool_recycle': DB_POOL_RECYCLE_SECONDS})
+if make_url(DATABASE_URI).get_backend_name() == 'postgresql' and DB_STATEMENT_TIMEOUT_MS > 0:
+    engine_options['connect_args'] = {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
 
 # AI复核配置
 ENABLE_AI_REVIEW = config.getboolean('ai_review', 'enable_ai_review', fallback=False)
@@ -37,29 +106,313 @@ AI_MODEL = config.get('ai_review', 'ai_model', fallback='gpt-4.1-mini')
 HOMEWORK_BASE_URL = config.get('ai_review', 'homework_base_url', fallback='https://tmptest.qinyining.cn')
 AI_REVIEW_ACTION = config.get('ai_review', 'ai_review_action', fallback='mark_abnormal')
 AI_REVIEW_MAX_RETRIES = config.getint('ai_review', 'ai_review_max_retries', fallback=3)
+AI_REVIEW_WORKERS = config.getint('ai_review', 'ai_review_workers', fallback=4)
+AI_MAX_CONCURRENT_REQUESTS = config.getint('ai_review', 'ai_max_concurrent_requests', fallback=100)
+AI_REVIEW_BATCH_SIZE = config.getint('ai_review', 'ai_review_batch_size', fallback=1)
+AI_REVIEW_BATCH_WAIT_SECONDS = config.getfloat('ai_review', 'ai_review_batch_wait_seconds', fallback=3)
+AI_IMAGE_MODE = config.get('ai_review', 'ai_image_mode', fallback='url')  # url: 图片URL / inline: 内联base64
+AI_INLINE_MAX_EDGE = config.getint('ai_review', 'ai_inline_max_edge', fallback=1024)
+AI_INLINE_QUALITY = config.getint('ai_review', 'ai_inline_quality', fallback=80)
+AI_VERDICT_CACHE_SIZE = config.getint('ai_review', 'ai_verdict_cache_size', fallback=1000)
+AI_VERDICT_CACHE_TTL_HOURS = config.getfloat('ai_review', 'ai_verdict_cache_ttl_hours', fallback=24)
+AI_HTTP_POOL_SIZE = config.getint('ai_review', 'ai_http_pool_size', fallback=AI_MAX_CONCURRENT_REQUESTS)
+AI_CONNECT_TIMEOUT = config.getfloat('ai_review', 'ai_connect_timeout', fallback=5)
+AI_FIRST_BYTE_TIMEOUT = config.getfloat('ai_review', 'ai_first_byte_timeout', fallback=30)
+AI_TOTAL_TIMEOUT = config.getfloat('ai_review', 'ai_total_timeout', fallback=60)
+AI_RETRY_BACKOFF_SECONDS = config.getfloat('ai_review', 'ai_retry_backoff_seconds', fallback=1)
+AI_RETRY_BACKOFF_MAX_SECONDS = config.getfloat('ai_review', 'ai_retry_backoff_max_seconds', fallback=30)
+AI_BREAKER_FAILURE_THRESHOLD = config.getint('ai_review', 'ai_breaker_failure_threshold', fallback=5)
+AI_BREAKER_OPEN_SECONDS = config.getfloat('ai_review', 'ai_breaker_open_seconds', fallback=30)
+AI_BREAKER_MAX_OPEN_SECONDS = config.getfloat('ai_review', 'ai_breaker_max_open_seconds', fallback=300)
+AI_LATENCY_TARGET_SECONDS = config.getfloat('ai_review', 'ai_latency_target_seconds', fallback=15)
+AI_COOKIE_MAX_AGE_MINUTES = config.getfloat('ai_review', 'ai_cookie_max_age_minutes', fallback=720)
+AI_COOKIE_REFRESH_BEFORE_MINUTES = config.getfloat('ai_review', 'ai_cookie_refresh_before_minutes', fallback=30)
 
 # AI API认证信息
 AI_LOGIN_URL = 'https://qin.qinyining.cn/api/user/login?turnstile='
 AI_USERNAME = 'private'
 AI_PASSWORD = 'password'
 
-# 全局cookie存储
-ai_session_cookie = None
+# 全局cookie存储：记录获取时间和过期时间，临近过期时后台刷新
+ai_session_cookie = {'value': None, 'obtained_at': 0.0, 'expires_at': 0.0, 'generation': 0}
 ai_cookie_lock = Lock()
+ai_cookie_refresh = {'running': False, 'done': None}  # 同一时间只进行一次登录，其他线程等待其结果
+
+# AI请求事件循环：所有AI请求（登录和审核）以协程形式在同一个后台线程的事件循环中执行，
+# 共享一个keep-alive连接池（最多 AI_HTTP_POOL_SIZE 个连接），同时进行的审核数量不受线程数限制
+ai_loop = {'loop': None, 'client': None}
+ai_loop_lock = Lock()
+
+# AI服务熔断器：连续失败达到阈值后熔断（open），冷却后放行一个探测请求（half_open），成功则恢复（closed）
+ai_breaker = {
+    'state': 'closed',
+    'failures': 0,
+    'opened_at': 0.0,
+    'open_seconds': AI_BREAKER_OPEN_SECONDS,
+    'probing': False,
+    'trips': 0
+}
+ai_breaker_lock = Lock()
+
+# AI请求自适应并发：延迟低于目标时逐步放宽上限（最多 AI_MAX_CONCURRENT_REQUESTS），超过目标或失败时减半
+ai_concurrency = {'limit': float(AI_MAX_CONCURRENT_REQUESTS), 'in_flight': 0, 'latency': None}
+ai_concurrency_cond = threading.Condition()
+
+# 学生端看板缓存：数据版本号保存在数据库中（data_version 表），随相关数据变更在同一事务中递增，
+# 各进程的缓存按（日期, 版本号）失效
+student_board_cache = {}
+
+# 服务器推送（SSE）：事件写入数据库（app_event 表），每个进程的转发线程读取所有进程发布的新事件，
+# 再推送给连接在本进程上的订阅者
+event_subscribers = []
+event_lock = Lock()
+event_outbox = queue.Queue()  # 本进程发布、尚未写入数据库的事件
+event_relay_wakeup = threading.Event()
+EVENT_QUEUE_SIZE = 1000
+EVENT_HEARTBEAT_SECONDS = 15
+EVENT_POLL_SECONDS = 1  # 有订阅者时检查其他进程发布的新事件的间隔
+EVENT_REORDER_WINDOW = 100  # 并发提交的事件编号可能乱序可见，每次向前多检查这么多个编号
+EVENT_RETENTION_MINUTES = 60
+
+# AI审核队列：任务持久化在数据库中，由固定数量的工作线程领取并交给AI事件循环，请求结束后由结果线程写回
+ai_review_wakeup = threading.Event()
+file_deletion_wakeup = threading.Event()
+ai_review_wait_times = deque(maxlen=200)  # 最近任务的排队等待时间（秒）
+ai_review_results = queue.Queue()  # 已结束的AI请求：(已领取任务, 写回函数, future)
+ai_single_reviews = queue.Queue()  # 批量结果不可用、需逐个审核的已领取任务：(任务ID, 提交ID)
+AI_REVIEW_POLL_SECONDS = 5
+
+# AI判定缓存：按（提示词哈希, 排序后的图片感知哈希）缓存判定结果，LRU + TTL淘汰
+ai_verdict_cache = OrderedDict()
+ai_verdict_cache_lock = Lock()
+ai_verdict_cache_stats = {'hits': 0, 'misses': 0}
 
 # 图片上传目录
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# 上传的原始文件暂存目录，处理结果保存成功后删除
+UPLOAD_RAW_FOLDER = os.path.join(UPLOAD_FOLDER, 'raw')
+if not os.path.exists(UPLOAD_RAW_FOLDER):
+    os.makedirs(UPLOAD_RAW_FOLDER)
+
+# 图片缩略图/中图目录：首次访问时生成，总大小超过 IMAGE_DERIVATIVE_CACHE_MB 时淘汰最久未访问的文件
+UPLOAD_DERIVED_FOLDER = os.path.join(UPLOAD_FOLDER, 'derived')
+if not os.path.exists(UPLOAD_DERIVED_FOLDER):
+    os.makedirs(UPLOAD_DERIVED_FOLDER)
+IMAGE_DERIVATIVE_SIZES = {'thumb': (320, 75), 'medium': (1024, 80)}  # 尺寸名: (最长边, JPEG质量)
+image_derivative_state = {'bytes': None}  # 缓存目录当前总大小，首次使用时统计
+image_derivative_lock = Lock()
+
+# 图片按文件名哈希分两级子目录保存（uploads/ab/cd/<文件名>），避免单个目录中文件过多
+SHARD_DIR_PATTERN = re.compile(r'^[0-9a-f]{2}$')
+
+def image_storage_path(filename):
+    """图片在分片目录中的保存路径"""
+    shard = hashlib.md5(filename.encode('utf-8')).hexdigest()
+    return os.path.join(UPLOAD_FOLDER, shard[:2], shard[2:4], filename)
+
+def image_legacy_path(filename):
+    """旧版平铺在uploads目录下的保存路径"""
+    return os.path.join(UPLOAD_FOLDER, filename)
+
+def resolve_image_path(filename):
+    """查找图片文件的实际路径，迁移完成前旧路径仍然有效；文件不存在时返回None"""
+    for path in (image_storage_path(filename), image_legacy_path(filename)):
+        if os.path.exists(path):
+            return path
+    return None
+
+def iter_stored_images():
+    """遍历已保存的全部图片文件（包括尚未迁移的旧路径），返回(文件名, 路径)"""
+    for entry in list(os.scandir(UPLOAD_FOLDER)):
+        if entry.is_file() and not entry.name.endswith('.tmp'):
+            yield entry.name, entry.path
+        elif entry.is_dir() and SHARD_DIR_PATTERN.match(entry.name):
+            for shard in os.scandir(entry.path):
+                if not shard.is_dir():
+                    continue
+                for file_entry in os.scandir(shard.path):
+                    if file_entry.is_file() and not file_entry.name.endswith('.tmp'):
+                        yield file_entry.name, file_entry.path
+
+class LocalImageStorage:
+    """本地磁盘图片存储（uploads目录），由Flask或前置Web服务器直接发送文件"""
+    shared = False
+    
+    def staging_path(self, filename):
+        """后台处理输出文件的路径，本地存储直接输出到最终位置"""
+        return image_storage_path(filename)
+    
+    def store(self, filename, path, keep_local=False):
+        """保存处理完成的文件"""
+        target_path = image_storage_path(filename)
+        if path != target_path:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.replace(path, target_path)
+    
+    def exists(self, filename):
+        return resolve_image_path(filename) is not None
+    
+    def open(self, filename):
+        """打开图片文件读取，不存在时抛出FileNotFoundError"""
+        path = resolve_image_path(filename)
+        if path is None:
+            raise FileNotFoundError(filename)
+        return open(path, 'rb')
+    
+    def delete(self, filename):
+        for path in (image_storage_path(filename), image_legacy_path(filename)):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def presigned_url(self, filename):
+        """本地存储没有直接访问地址，由 /uploads 路由发送"""
+        return None
+
+class S3ImageStorage:
+    """S3兼容对象存储（AWS S3、MinIO等），多台应用服务器共享同一份图片
+    
+    浏览器和AI服务通过预签名URL直接从对象存储下载图片，不经过应用服务器
+    """
+    shared = True
+    
+    def __init__(self):
+        import boto3
+        from botocore.config import Config
+        
+        self.client = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL or None,
+            region_name=S3_REGION or None,
+            aws_access_key_id=S3_ACCESS_KEY or None,
+            aws_secret_access_key=S3_SECRET_KEY or None,
+            config=Config(
+                signature_version='s3v4',
+                s3={'addressing_style': 'path' if S3_PATH_STYLE else 'auto'},
+                retries={'max_attempts': 3, 'mode': 'standard'}
+            )
+        )
+        self.bucket = S3_BUCKET
+    
+    def key(self, filename):
+        return f"{S3_PREFIX}{filename}"
+    
+    def staging_path(self, filename):
+        """后台处理输出到本地暂存文件，处理完成后再上传"""
+        return os.path.join(UPLOAD_RAW_FOLDER, filename)
+    
+    def store(self, filename, path, keep_local=False):
+        """上传处理完成的文件，文件名即内容哈希，可以设置长期不可变缓存"""
+        self.client.upload_file(path, self.bucket, self.key(filename), ExtraArgs={
+            'ContentType': 'image/jpeg',
+            'CacheControl': f'public, max-age={UPLOAD_CACHE_MAX_AGE}, immutable'
+        })
+        if not keep_local:
+            os.remove(path)
+    
+    def exists(self, filename):
+        from botocore.exceptions import ClientError
+        
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(filename))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+    
+    def open(self, filename):
+        """下载图片到内存，不存在时抛出FileNotFoundError"""
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(filename))
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(filename)
+        return io.BytesIO(response['Body'].read())
+    
+    def delete(self, filename):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(filename))
+    
+    def presigned_url(self, filename):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self.key(filename)},
+            ExpiresIn=S3_PRESIGN_EXPIRES
+        )
+
+def create_image_storage():
+    """按配置创建图片存储"""
+    if STORAGE_BACKEND == 's3':
+        print(f"[系统] 图片存储: S3兼容对象存储 {S3_ENDPOINT_URL or 'AWS'} / {S3_BUCKET}")
+        return S3ImageStorage()
+    return LocalImageStorage()
+
+image_storage = create_image_storage()
+
+# AI审核内联图片的缩小版缓存目录
+AI_IMAGE_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ai_image_cache')
+if AI_IMAGE_MODE == 'inline' and not os.path.exists(AI_IMAGE_CACHE_FOLDER):
+    os.makedirs(AI_IMAGE_CACHE_FOLDER)
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGE_SIZE_MB * 1024 * 1024
 
+# 边接收边检查大小的接口，不受 MAX_CONTENT_LENGTH 限制
+STREAMING_UPLOAD_ENDPOINTS = {'upload_image_stream'}
+
+class HomeworkRequest(Request):
+    """流式上传接口的请求体大小由接口在读取时检查（multipart的边界和字段头不计入图片大小）"""
+    @property
+    def max_content_length(self):
+        if self.endpoint in STREAMING_UPLOAD_ENDPOINTS:
+            return None
+        return super().max_content_length
+
+app.request_class = HomeworkRequest
+
 db = SQLAlchemy(app)
 
 # 设置中国时区 UTC+8
 CHINA_TZ = timezone(timedelta(hours=8))
 
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """新建SQLite连接时设置：WAL模式下读写互不阻塞，写锁被占用时等待而不是立即报 database is locked"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.execute('PRAGMA journal_mode = WAL')
+    cursor.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA cache_size = {-SQLITE_CACHE_SIZE_MB * 1024}')  # 负数表示KB
+    cursor.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE_MB * 1024 * 1024}')
+    cursor.execute('PRAGMA temp_store = MEMORY')
+    cursor.close()
+
+# 后台线程（AI审核、图片处理回调、文件删除、定时任务）的数据库写入经由同一把锁依次执行，
+# 同一时刻最多一个后台写入与请求争抢SQLite写锁；需要同时持有 image_file_lock 时先获取 image_file_lock
+db_write_lock = threading.RLock()
+
+def commit_background_write():
+    """后台线程提交当前会话的写入"""
+    with db_write_lock:
+        db.session.commit()
+
+class ChinaDateTime(TypeDecorator):
+    """以北京时间（不带时区）保存的时间列
+    
+    写入和查询条件中带时区的时间先换算为北京时间再去掉时区，各种数据库中保存和比较的都是同一个值，
+    不依赖SQLite按字符串保存、PostgreSQL按会话时区换算等数据库各自的行为
+    """
+    impl = db.DateTime
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(CHINA_TZ).replace(tzinfo=None)
+        return value
+
 def get_china_time():
     """获取中国时间（UTC+8）"""
     return datetime.now(CHINA_TZ)
@@ -68,13 +421,131 @@ def allowed_file(filename):
     """检查文件扩展名是否允许"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def bump_data_version():
+    """标记当前事务修改了提交、图片、作业或学生数据（在提交前调用），提交时在同一事务中递增数据版本号，
+    使所有进程的学生端看板缓存失效
+    """
+    db.session.info['bump_data_version'] = True
+
+def publish_event(event_type, data):
+    """发布增量事件（submission / homework / refresh，在数据提交后调用），由转发线程写入数据库后推送给所有进程的SSE订阅者"""
+    event_outbox.put((event_type, json.dumps(data, ensure_ascii=False)))
+    event_relay_wakeup.set()
+
+def dispatch_event(event_id, event_type, data):
+    """把事件推送给本进程的所有SSE订阅者"""
+    message = f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+    with event_lock:
+        for q in list(event_subscribers):
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # 客户端消费过慢，断开该订阅，由前端重连后全量刷新
+                event_subscribers.remove(q)
+
+def compute_dhash(image):
+    """计算图片的差值感知哈希（dHash），返回16位十六进制字符串"""
+    from PIL import Image
+    
+    small = image.convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return f'{value:016x}'
+
+def detect_image_format(header):
+    """根据文件头识别图片格式，无法识别时返回None"""
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return 'webp'
+    if header.startswith(b'BM'):
+        return 'bmp'
+    return None
+
+def verify_image_file(path):
+    """用Pillow解析图片文件头并检查文件结构（不解码像素），不是可识别的完整图片时返回False"""
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+
+def process_uploaded_image(raw_path, output_path, max_edge, quality):
+    """在图片处理进程中执行：按EXIF方向旋转、缩小并重新编码为JPEG，返回感知哈希
+    
+    客户端已按要求压缩的JPEG（尺寸不超限、无需旋转）原样保存，不再重新编码。
+    原始文件保留，由结果线程在处理结果保存成功后删除
+    """
+    from PIL import Image, ImageOps
+    
+    # Image.open 只读取文件头，此时尚未解码像素
+    with Image.open(raw_path) as image:
+        compliant = (
+            image.format == 'JPEG'
+            and image.mode in ('RGB', 'L')
+            and image.getexif().get(0x0112, 1) == 1
+            and (not max_edge or max(image.size) <= max_edge)
+        )
+        if compliant:
+            # 计算感知哈希只需要极小的缩略图，按1/8比例解码即可
+            image.draft('L', (9, 8))
+            phash = compute_dhash(image)
+    temp_path = f"{output_path}.tmp"
+    if compliant:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        try:
+            # 原始文件和输出文件在同一文件系统上，硬链接不需要复制数据
+            os.link(raw_path, temp_path)
+        except OSError:
+            shutil.copyfile(raw_path, temp_path)
+        os.replace(temp_path, output_path)
+        return phash
+    
+    with Image.open(raw_path) as image:
+        if max_edge:
+            # JPEG解码时直接按比例缩小，减少大图的解码开销
+            image.draft(image.mode, (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        if max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        image.save(temp_path, 'JPEG', quality=quality)
+        phash = compute_dhash(image)
+    os.replace(temp_path, output_path)
+    return phash
+
+def create_image_process_pool():
+    """创建图片处理进程池；不支持fork的平台（Windows）退回线程池"""
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return ThreadPoolExecutor(max_workers=IMAGE_PROCESS_WORKERS, thread_name_prefix='image-process')
+    pool = ProcessPoolExecutor(max_workers=IMAGE_PROCESS_WORKERS, mp_context=multiprocessing.get_context('fork'))
+    pool.submit(os.getpid)  # 立即启动工作进程
+    return pool
+
+# 图片处理进程池：上传请求只保存原始文件，旋转、缩小和重新编码在后台进程中完成
+# 需在启动定时任务、AI审核等后台线程之前创建，保证fork出的工作进程状态干净
+image_process_pool = create_image_process_pool()
+
 # 数据库模型
 class Admin(db.Model):
     """管理员表"""
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password = db.Column(db.String(200), nullable=False)
-    created_at = db.Column(db.DateTime, default=get_china_time)
+    created_at = db.Column(ChinaDateTime, default=get_china_time)
 
 class Teacher(db.Model):
     """教师表"""
@@ -83,14 +554,14 @@ class Teacher(db.Model):
     password = db.Column(db.String(200), nullable=False)
     subject = db.Column(db.String(50), nullable=False)  # 学科
     enable_ai_review = db.Column(db.Boolean, default=True)  # 是否启用AI复审
-    created_at = db.Column(db.DateTime, default=get_china_time)
+    created_at = db.Column(ChinaDateTime, default=get_china_time)
 
 class Student(db.Model):
     """学生表"""
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
     student_id = db.Column(db.String(50), unique=True, nullable=False)
-    created_at = db.Column(db.DateTime, default=get_china_time)
+    created_at = db.Column(ChinaDateTime, default=get_china_time)
 
 class Homework(db.Model):
     """作业布置表"""
@@ -100,33 +571,444 @@ class Homework(db.Model):
     title = db.Column(db.String(200), nullable=False)  # 作业标题
     ai_prompt = db.Column(db.Text)  # 自定义AI检测prompt
     max_images = db.Column(db.Integer, default=5)  # 允许上传的最大图片数量
-    created_at = db.Column(db.DateTime, default=get_china_time)
+    created_at = db.Column(ChinaDateTime, default=get_china_time, index=True)  # 学生端按日期查询当天作业
+    # 提交统计（随提交增删和审核状态变化在同一事务内更新，定时校正）
+    submitted_count = db.Column(db.Integer, default=0)
+    approved_count = db.Column(db.Integer, default=0)
+    rejected_count = db.Column(db.Integer, default=0)
+    error_count = db.Column(db.Integer, default=0)
     teacher = db.relationship('Teacher', backref='homeworks')
+    
+    __table_args__ = (
+        db.Index('ix_homework_teacher_created', 'teacher_id', 'created_at'),  # 教师端作业列表、按日期统计
+    )
 
 class HomeworkSubmission(db.Model):
     """作业提交记录表"""
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
     homework_id = db.Column(db.Integer, db.ForeignKey('homework.id'), nullable=False)
-    submitted_at = db.Column(db.DateTime, default=get_china_time)
+    submitted_at = db.Column(ChinaDateTime, default=get_china_time)
     ai_review_status = db.Column(db.String(20), default='pending')  # pending, reviewing, approved, rejected, error
     ai_review_result = db.Column(db.Text)  # AI审核的详细结果
-    ai_reviewed_at = db.Column(db.DateTime)  # AI审核时间
+    ai_reviewed_at = db.Column(ChinaDateTime)  # AI审核时间
+    image_count = db.Column(db.Integer, default=0)  # 图片数量（随图片增删在同一事务内更新，定时校正）
     student = db.relationship('Student', backref='submissions')
     homework = db.relationship('Homework', backref='submissions')
+    
+    __table_args__ = (
+        # 每个学生每个作业只有一条提交记录，同时用于按学生查询
+        db.Index('uq_submission_student_homework', 'student_id', 'homework_id', unique=True),
+        db.Index('ix_submission_homework_status', 'homework_id', 'ai_review_status'),  # 按作业统计、筛选
+        db.Index('ix_submission_status_submitted', 'ai_review_status', 'submitted_at'),  # 异常列表、判定超时清理
+    )
 
 class HomeworkImage(db.Model):
     """作业图片表"""
     id = db.Column(db.Integer, primary_key=True)
-    submission_id = db.Column(db.Integer, db.ForeignKey('homework_submission.id'), nullable=False)
-    filename = db.Column(db.String(200), nullable=False)  # 存储的文件名
+    submission_id = db.Column(db.Integer, db.ForeignKey('homework_submission.id'), nullable=False, index=True)
+    filename = db.Column(db.String(200), nullable=False, index=True)  # 存储的文件名（内容哈希，相同内容的图片共用一个文件）
     original_filename = db.Column(db.String(200), nullable=False)  # 原始文件名
-    uploaded_at = db.Column(db.DateTime, default=get_china_time)
+    uploaded_at = db.Column(ChinaDateTime, default=get_china_time)
+    phash = db.Column(db.String(16))  # 图片感知哈希（dHash），用于识别重复图片
+    processing_status = db.Column(db.String(20), default='ready')  # processing, ready, failed
+    processing_owner = db.Column(db.String(100))  # 处理中图片所在进程的标识（PROCESS_ID），进程退出后由其他进程接管
     submission = db.relationship('HomeworkSubmission', backref='images')
+    
+    __table_args__ = (
+        db.Index('ix_image_status_submission', 'processing_status', 'submission_id'),  # AI队列排除图片处理中的提交
+    )
 
-# 初始化数据库
-with app.app_context():
-    db.create_all()
+class AIReviewJob(db.Model):
+    """AI审核任务队列表（每个提交最多一个未完成任务）"""
+    id = db.Column(db.Integer, primary_key=True)
+    submission_id = db.Column(db.Integer, db.ForeignKey('homework_submission.id', ondelete='CASCADE'), unique=True, nullable=False)
+    status = db.Column(db.String(20), default='queued')  # queued, running
+    created_at = db.Column(ChinaDateTime, default=get_china_time)
+    started_at = db.Column(ChinaDateTime)
+    owner = db.Column(db.String(100))  # 执行中任务所在进程的标识（PROCESS_ID）
+
+class FileDeletionJob(db.Model):
+    """待删除图片文件队列表（删除记录时登记，由后台线程删除文件，失败后重试）"""
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(200), nullable=False)
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(ChinaDateTime, default=get_china_time, index=True)
+    created_at = db.Column(ChinaDateTime, default=get_china_time)
+
+class DataVersion(db.Model):
+    """数据版本号表（只有一行），学生端看板缓存和ETag依据此版本号判断数据是否变化"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+
+@event.listens_for(db.session, 'before_commit')
+def apply_data_version_bump(session):
+    """提交前递增数据版本号，与数据变更在同一事务中提交（后台线程的提交在 db_write_lock 内执行）"""
+    if session.info.pop('bump_data_version', False):
+        session.execute(db.update(DataVersion).where(DataVersion.id == 1).values(version=DataVersion.version + 1))
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_data_version_bump(session, previous_transaction):
+    """事务回滚时放弃未提交的版本号递增"""
+    session.info.pop('bump_data_version', None)
+
+def get_data_version():
+    """读取当前数据版本号"""
+    return db.session.query(DataVersion.version).filter(DataVersion.id == 1).scalar()
+
+class AppEvent(db.Model):
+    """服务器推送事件表：各进程发布的事件按编号顺序推送给所有进程的SSE订阅者，保留 EVENT_RETENTION_MINUTES 分钟"""
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(20), nullable=False)
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(ChinaDateTime, default=get_china_time, index=True)
+    
+    __table_args__ = {'sqlite_autoincrement': True}  # 删除旧事件后编号不重复使用
+
+class ServiceLease(db.Model):
+    """后台任务租约表：多个进程中只有持有未过期租约的进程执行对应任务（如定时任务）"""
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(100), nullable=False)  # 持有租约的进程标识
+    expires_at = db.Column(ChinaDateTime, nullable=False)
+
+# 计入作业统计的审核状态及对应的计数列
+HOMEWORK_STATUS_COUNTERS = {'approved': 'approved_count', 'rejected': 'rejected_count', 'error': 'error_count'}
+
+def apply_counter_deltas(session, image_deltas, homework_deltas):
+    """用增量UPDATE更新提交的图片数和作业的状态计数（并发更新不会互相覆盖）"""
+    submission_table = HomeworkSubmission.__table__
+    homework_table = Homework.__table__
+    for submission_id, delta in image_deltas.items():
+        if delta:
+            session.execute(submission_table.update().where(submission_table.c.id == submission_id).values(
+                image_count=submission_table.c.image_count + delta
+            ))
+    for homework_id, deltas in homework_deltas.items():
+        values = {column: homework_table.c[column] + delta for column, delta in deltas.items() if delta}
+        if values:
+            session.execute(homework_table.update().where(homework_table.c.id == homework_id).values(**values))
+
+def subtract_submission_counters(submission_ids):
+    """批量SQL删除提交记录前调用，从所属作业的计数中减去这些提交（submission_ids 为提交ID的子查询）"""
+    rows = db.session.query(
+        HomeworkSubmission.homework_id,
+        HomeworkSubmission.ai_review_status,
+        db.func.count(HomeworkSubmission.id)
+    ).filter(
+        HomeworkSubmission.id.in_(submission_ids)
+    ).group_by(HomeworkSubmission.homework_id, HomeworkSubmission.ai_review_status).all()
+    
+    homework_deltas = defaultdict(Counter)
+    for homework_id, status, count in rows:
+        homework_deltas[homework_id]['submitted_count'] -= count
+        if status in HOMEWORK_STATUS_COUNTERS:
+            homework_deltas[homework_id][HOMEWORK_STATUS_COUNTERS[status]] -= count
+    apply_counter_deltas(db.session, {}, homework_deltas)
+
+@event.listens_for(db.session, 'before_flush')
+def track_submission_counters(session, flush_context, instances):
+    """通过ORM新增/删除图片和提交记录、修改审核状态时，在同一次flush中更新计数"""
+    image_deltas = Counter()
+    homework_deltas = defaultdict(Counter)
+    
+    def count_status(homework_id, status, delta):
+        if status in HOMEWORK_STATUS_COUNTERS:
+            homework_deltas[homework_id][HOMEWORK_STATUS_COUNTERS[status]] += delta
+    
+    for obj in session.new:
+        if isinstance(obj, HomeworkImage):
+            image_deltas[obj.submission_id] += 1
+        elif isinstance(obj, HomeworkSubmission):
+            homework_deltas[obj.homework_id]['submitted_count'] += 1
+            count_status(obj.homework_id, obj.ai_review_status, 1)
+    
+    for obj in session.deleted:
+        if isinstance(obj, HomeworkImage):
+            image_deltas[obj.submission_id] -= 1
+        elif isinstance(obj, HomeworkSubmission):
+            # 删除前在同一flush中修改过状态时，按数据库中原来的状态扣减
+            history = db.inspect(obj).attrs.ai_review_status.history
+            status = history.deleted[0] if history.deleted else obj.ai_review_status
+            homework_deltas[obj.homework_id]['submitted_count'] -= 1
+            count_status(obj.homework_id, status, -1)
+    
+    for obj in session.dirty:
+        if isinstance(obj, HomeworkSubmission) and obj not in session.deleted:
+            history = db.inspect(obj).attrs.ai_review_status.history
+            if history.added and history.deleted and history.added[0] != history.deleted[0]:
+                count_status(obj.homework_id, history.deleted[0], -1)
+                count_status(obj.homework_id, history.added[0], 1)
+    
+    apply_counter_deltas(session, image_deltas, homework_deltas)
+
+def reconcile_counters():
+    """按实际数据重新计算提交的图片数和作业的状态计数，修正偏差，返回(修正的提交数, 修正的作业数)"""
+    actual_image_count = db.select(db.func.count(HomeworkImage.id)).where(
+        HomeworkImage.submission_id == HomeworkSubmission.id
+    ).scalar_subquery()
+    fixed_submissions = db.session.execute(
+        db.update(HomeworkSubmission).where(
+            db.func.coalesce(HomeworkSubmission.image_count, -1) != actual_image_count
+        ).values(image_count=actual_image_count).execution_options(synchronize_session=False)
+    ).rowcount
+    
+    def actual_submission_count(*conditions):
+        return db.select(db.func.count(HomeworkSubmission.id)).where(
+            HomeworkSubmission.homework_id == Homework.id, *conditions
+        ).scalar_subquery()
+    actual = {'submitted_count': actual_submission_count()}
+    for status, column in HOMEWORK_STATUS_COUNTERS.items():
+        actual[column] = actual_submission_count(HomeworkSubmission.ai_review_status == status)
+    fixed_homeworks = db.session.execute(
+        db.update(Homework).where(
+            db.or_(*[db.func.coalesce(getattr(Homework, column), -1) != value for column, value in actual.items()])
+        ).values(**actual).execution_options(synchronize_session=False)
+    ).rowcount
+    return fixed_submissions, fixed_homeworks
+
+def add_missing_columns(metadata):
+    """为已有数据库补充 metadata 中定义而数据库中缺少的列和索引（create_all 不会修改已存在的表）"""
+    inspector = db.inspect(db.engine)
+    for table in metadata.sorted_tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            # 带默认值的列同时回填已有记录
+            default = ''
+            if column.default is not None and column.default.is_scalar:
+                value = column.default.arg
+                default = f" DEFAULT '{value}'" if isinstance(value, str) else f" DEFAULT {int(value)}"
+            db.session.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}'))
+            print(f"[系统] 数据库升级: {table.name} 新增列 {column.name}")
+    db.session.commit()
+    
+    for table in metadata.sorted_tables:
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=db.engine)
+                print(f"[系统] 数据库升级: {table.name} 新增索引 {index.name}")
+
+def merge_duplicate_submissions(tables):
+    """合并同一学生同一作业的重复提交记录（旧版并发创建可能产生），图片归入最早的一条，之后才能建立唯一索引"""
+    submission, image, job = tables['homework_submission'], tables['homework_image'], tables['ai_review_job']
+    duplicates = db.session.execute(
+        db.select(submission.c.student_id, submission.c.homework_id, db.func.min(submission.c.id))
+        .group_by(submission.c.student_id, submission.c.homework_id)
+        .having(db.func.count(submission.c.id) > 1)
+    ).all()
+    
+    merged_count = 0
+    for student_id, homework_id, keep_id in duplicates:
+        extra_ids = db.session.execute(db.select(submission.c.id).where(
+            submission.c.student_id == student_id,
+            submission.c.homework_id == homework_id,
+            submission.c.id != keep_id
+        )).scalars().all()
+        db.session.execute(db.update(image).where(image.c.submission_id.in_(extra_ids)).values(submission_id=keep_id))
+        db.session.execute(db.delete(job).where(job.c.submission_id.in_(extra_ids)))
+        db.session.execute(db.delete(submission).where(submission.c.id.in_(extra_ids)))
+        merged_count += len(extra_ids)
+    db.session.commit()
+    if merged_count:
+        print(f"[系统] 数据库升级: 合并重复提交记录 {merged_count} 条")
+
+class SchemaMigration(db.Model):
+    """数据库结构版本表（每执行一个迁移记录一行）"""
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(ChinaDateTime, default=get_china_time)
+
+# 以下迁移中的表定义和DDL是各版本发布时表结构的副本，不引用模型，之后修改模型时不再修改这里
+
+def schema_v1_tables():
+    """版本1的全部表结构"""
+    metadata = db.MetaData()
+    db.Table(
+        'admin', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('username', db.String(80), unique=True, nullable=False),
+        db.Column('password', db.String(200), nullable=False),
+        db.Column('created_at', db.DateTime)
+    )
+    db.Table(
+        'teacher', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('username', db.String(80), unique=True, nullable=False),
+        db.Column('password', db.String(200), nullable=False),
+        db.Column('subject', db.String(50), nullable=False),
+        db.Column('enable_ai_review', db.Boolean, default=True),
+        db.Column('created_at', db.DateTime)
+    )
+    db.Table(
+        'student', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('name', db.String(80), nullable=False),
+        db.Column('student_id', db.String(50), unique=True, nullable=False),
+        db.Column('created_at', db.DateTime)
+    )
+    db.Table(
+        'homework', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('subject', db.String(50), nullable=False),
+        db.Column('teacher_id', db.Integer, db.ForeignKey('teacher.id'), nullable=False),
+        db.Column('title', db.String(200), nullable=False),
+        db.Column('ai_prompt', db.Text),
+        db.Column('max_images', db.Integer, default=5),
+        db.Column('created_at', db.DateTime, index=True),
+        db.Column('submitted_count', db.Integer, default=0),
+        db.Column('approved_count', db.Integer, default=0),
+        db.Column('rejected_count', db.Integer, default=0),
+        db.Column('error_count', db.Integer, default=0),
+        db.Index('ix_homework_teacher_created', 'teacher_id', 'created_at')
+    )
+    db.Table(
+        'homework_submission', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('student_id', db.Integer, db.ForeignKey('student.id'), nullable=False),
+        db.Column('homework_id', db.Integer, db.ForeignKey('homework.id'), nullable=False),
+        db.Column('submitted_at', db.DateTime),
+        db.Column('ai_review_status', db.String(20), default='pending'),
+        db.Column('ai_review_result', db.Text),
+        db.Column('ai_reviewed_at', db.DateTime),
+        db.Column('image_count', db.Integer, default=0),
+        db.Index('uq_submission_student_homework', 'student_id', 'homework_id', unique=True),
+        db.Index('ix_submission_homework_status', 'homework_id', 'ai_review_status'),
+        db.Index('ix_submission_status_submitted', 'ai_review_status', 'submitted_at')
+    )
+    db.Table(
+        'homework_image', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('submission_id', db.Integer, db.ForeignKey('homework_submission.id'), nullable=False, index=True),
+        db.Column('filename', db.String(200), nullable=False, index=True),
+        db.Column('original_filename', db.String(200), nullable=False),
+        db.Column('uploaded_at', db.DateTime),
+        db.Column('phash', db.String(16)),
+        db.Column('processing_status', db.String(20), default='ready'),
+        db.Index('ix_image_status_submission', 'processing_status', 'submission_id')
+    )
+    db.Table(
+        'ai_review_job', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('submission_id', db.Integer, db.ForeignKey('homework_submission.id', ondelete='CASCADE'), unique=True, nullable=False),
+        db.Column('status', db.String(20), default='queued'),
+        db.Column('created_at', db.DateTime),
+        db.Column('started_at', db.DateTime)
+    )
+    db.Table(
+        'file_deletion_job', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('filename', db.String(200), nullable=False),
+        db.Column('attempts', db.Integer, default=0),
+        db.Column('next_attempt_at', db.DateTime, index=True),
+        db.Column('created_at', db.DateTime)
+    )
+    return metadata
+
+def migrate_legacy_schema():
+    """版本1：引入版本管理之前创建的数据库，补齐版本1的表、列和索引"""
+    metadata = schema_v1_tables()
+    metadata.create_all(bind=db.engine)
+    if 'uq_submission_student_homework' not in {index['name'] for index in db.inspect(db.engine).get_indexes('homework_submission')}:
+        merge_duplicate_submissions(metadata.tables)
+    add_missing_columns(metadata)
+
+def add_service_lease_table():
+    """版本2：后台任务租约表"""
+    metadata = db.MetaData()
+    db.Table(
+        'service_lease', metadata,
+        db.Column('name', db.String(50), primary_key=True),
+        db.Column('owner', db.String(100), nullable=False),
+        db.Column('expires_at', db.DateTime, nullable=False)
+    )
+    metadata.create_all(bind=db.engine, checkfirst=False)
+
+def add_data_version_table():
+    """版本3：数据版本号表"""
+    metadata = db.MetaData()
+    db.Table(
+        'data_version', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('version', db.BigInteger, nullable=False)
+    )
+    metadata.create_all(bind=db.engine, checkfirst=False)
+
+def add_app_event_table():
+    """版本4：服务器推送事件表"""
+    metadata = db.MetaData()
+    db.Table(
+        'app_event', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('event_type', db.String(20), nullable=False),
+        db.Column('data', db.Text, nullable=False),
+        db.Column('created_at', db.DateTime, index=True),
+        sqlite_autoincrement=True
+    )
+    metadata.create_all(bind=db.engine, checkfirst=False)
+
+def add_review_job_owner():
+    """版本5：审核任务记录执行进程"""
+    db.session.execute(db.text('ALTER TABLE ai_review_job ADD COLUMN owner VARCHAR(100)'))
+    db.session.commit()
+
+def add_image_processing_owner():
+    """版本6：图片记录处理进程"""
+    db.session.execute(db.text('ALTER TABLE homework_image ADD COLUMN processing_owner VARCHAR(100)'))
+    db.session.commit()
+
+# 数据库结构迁移：(版本号, 说明, 迁移函数)，修改表结构时在末尾追加新版本，已发布的迁移不再修改
+# 新建的数据库按当前模型建表后直接记为最新版本，不逐个执行迁移；
+# 迁移从上一版本的表结构出发写明本版本的变化（新建表、ALTER TABLE等），不按当前模型补齐，可以包含删除、重命名列等变化
+SCHEMA_MIGRATIONS = [
+    (1, '补齐旧版数据库的表、列和索引', migrate_legacy_schema),
+    (2, '新增后台任务租约表', add_service_lease_table),
+    (3, '新增数据版本号表', add_data_version_table),
+    (4, '新增服务器推送事件表', add_app_event_table),
+    (5, '审核任务记录执行进程', add_review_job_owner),
+    (6, '图片记录处理进程', add_image_processing_owner),
+]
+SCHEMA_LOCK_KEY = 20240601  # PostgreSQL咨询锁编号，多个进程同时启动时只有一个执行迁移
+
+def apply_schema_migrations():
+    """建表或执行尚未执行的迁移，执行了迁移时返回True"""
+    table_names = set(db.inspect(db.engine).get_table_names())
+    if SchemaMigration.__tablename__ not in table_names:
+        if not table_names & set(db.metadata.tables):
+            db.create_all()
+            for version, description, _ in SCHEMA_MIGRATIONS:
+                db.session.add(SchemaMigration(version=version, description=description))
+            db.session.commit()
+            print(f"[系统] 已创建数据库，结构版本 {SCHEMA_MIGRATIONS[-1][0]}")
+            return False
+        SchemaMigration.__table__.create(bind=db.engine)
+    
+    applied = {version for (version,) in db.session.query(SchemaMigration.version)}
+    migrated = False
+    for version, description, migrate in SCHEMA_MIGRATIONS:
+        if version in applied:
+            continue
+        migrate()
+        db.session.add(SchemaMigration(version=version, description=description))
+        db.session.commit()
+        migrated = True
+        print(f"[系统] 数据库升级到版本 {version}: {description}")
+    return migrated
+
+def setup_database():
+    """升级数据库结构、回填统计计数并创建默认管理员账户"""
+    if apply_schema_migrations():
+        # 升级旧数据库时回填计数列；平时计数随写入维护，由定时任务校正，多个进程启动时不再各自全表校正
+        fixed_submissions, fixed_homeworks = reconcile_counters()
+        db.session.commit()
+        if fixed_submissions or fixed_homeworks:
+            print(f"[系统] 校正统计计数: 提交 {fixed_submissions} 条, 作业 {fixed_homeworks} 个")
+    # 数据版本号初始值取当前时间戳，重建数据库后不会与之前发出的ETag重复
+    if db.session.get(DataVersion, 1) is None:
+        db.session.add(DataVersion(id=1, version=int(time.time())))
+        db.session.commit()
     # 创建默认管理员账户 (admin/admin123)
     admin = Admin.query.filter_by(username='admin').first()
     if not admin:
@@ -135,6 +1017,22 @@ with app.app_context():
         db.session.commit()
         print("[系统] 已创建默认管理员账户: admin/admin123")
 
+def initialize_database():
+    """启动时初始化数据库；PostgreSQL下用咨询锁保证多个进程同时启动时依次执行"""
+    with db.engine.connect() as lock_connection:
+        use_lock = db.engine.dialect.name == 'postgresql'
+        if use_lock:
+            lock_connection.execute(db.text('SELECT pg_advisory_lock(:key)'), {'key': SCHEMA_LOCK_KEY})
+        try:
+            setup_database()
+        finally:
+            if use_lock:
+                lock_connection.execute(db.text('SELECT pg_advisory_unlock(:key)'), {'key': SCHEMA_LOCK_KEY})
+
+# 初始化数据库
+with app.app_context():
+    initialize_database()
+
 # 定时任务：每天00:00清空学生端前一天的作业显示
 def clear_previous_day_homework_for_students():
     """清空学生端前一天的作业（仅影响学生端显示，教师端仍可查看）"""
@@ -146,6 +1044,9 @@ def clear_previous_day_homework_for_students():
             # 获取今天之前布置的所有作业
             old_homeworks = Homework.query.filter(Homework.created_at < today_start).all()
             
+            # 通知学生端切换到当天作业
+            publish_event('refresh', {'scope': 'day'})
+            
             if old_homeworks:
                 print(f"[定时任务] {now.strftime('%Y-%m-%d %H:%M:%S')} - 清理前一天作业，共 {len(old_homeworks)} 个作业")
             else:
@@ -156,43 +1057,102 @@ def clear_previous_day_homework_for_students():
             import traceback
             traceback.print_exc()
 
+def delete_empty_submissions(created_before):
+    """分批删除创建时间早于 created_before 且没有图片的提交记录，返回(删除条数, 批次数)"""
+    has_images = db.exists().where(HomeworkImage.submission_id == HomeworkSubmission.id)
+    deleted_count = batch_count = 0
+    while True:
+        with db_write_lock:
+            ids = [submission_id for (submission_id,) in db.session.query(HomeworkSubmission.id).filter(
+                HomeworkSubmission.submitted_at < created_before,
+                ~has_images
+            ).order_by(HomeworkSubmission.id).limit(CLEANUP_BATCH_SIZE)]
+            if not ids:
+                break
+            # 删除时再次检查没有图片，查询之后刚上传了图片的提交不会被删除
+            delete_submissions_bulk(
+                db.session.query(HomeworkSubmission.id).filter(HomeworkSubmission.id.in_(ids), ~has_images)
+            )
+            bump_data_version()
+            db.session.commit()
+        deleted_count += len(ids)
+        batch_count += 1
+        if len(ids) < CLEANUP_BATCH_SIZE:
+            break
+    return deleted_count, batch_count
+
+def fail_stale_reviews(started_before, now):
+    """分批将早于 started_before 提交、仍在判定中且没有进行中审核任务的记录转为error，返回(更新条数, 批次数)"""
+    # 仍在队列中等待、或刚开始执行的审核任务不计入超时
+    active_jobs = db.session.query(AIReviewJob.submission_id).filter(
+        db.or_(
+            AIReviewJob.status == 'queued',
+            AIReviewJob.started_at >= started_before
+        )
+    )
+    updated_count = batch_count = 0
+    while True:
+        with db_write_lock:
+            rows = db.session.query(HomeworkSubmission.id, HomeworkSubmission.homework_id).filter(
+                HomeworkSubmission.ai_review_status == 'reviewing',
+                HomeworkSubmission.submitted_at < started_before,
+                HomeworkSubmission.id.notin_(active_jobs)
+            ).order_by(HomeworkSubmission.id).limit(CLEANUP_BATCH_SIZE).all()
+            if not rows:
+                break
+            HomeworkSubmission.query.filter(
+                HomeworkSubmission.id.in_([submission_id for submission_id, _ in rows]),
+                HomeworkSubmission.ai_review_status == 'reviewing'
+            ).update({
+                'ai_review_status': 'error',
+                'ai_review_result': 'AI判定超时（超过5分钟）',
+                'ai_reviewed_at': now
+            }, synchronize_session=False)
+            # 批量UPDATE不经过flush，error计数在这里同步增加
+            homework_deltas = defaultdict(Counter)
+            for _, homework_id in rows:
+                homework_deltas[homework_id][HOMEWORK_STATUS_COUNTERS['error']] += 1
+            apply_counter_deltas(db.session, {}, homework_deltas)
+            bump_data_version()
+            db.session.commit()
+        updated_count += len(rows)
+        batch_count += 1
+        if len(rows) < CLEANUP_BATCH_SIZE:
+            break
+    return updated_count, batch_count
+
 # 定时任务：清理无图片的提交记录和超时的判定中状态
 def cleanup_invalid_submissions():
-    """清理无图片的提交记录，并将超时的判定中状态转为error"""
+    """清理无图片的提交记录，将超时的判定中状态转为error，并删除过期的推送事件
+    
+    两项清理都按条件批量查询和修改，每批最多 CLEANUP_BATCH_SIZE 条，每批单独提交并释放写入锁，
+    耗时只与需要清理的记录数有关，不随提交记录总数增长
+    """
     with app.app_context():
         try:
+            started = time.perf_counter()
             now = get_china_time()
             
-            # 1. 删除没有图片的提交记录
-            all_submissions = HomeworkSubmission.query.all()
-            deleted_count = 0
-            for submission in all_submissions:
-                image_count = HomeworkImage.query.filter_by(submission_id=submission.id).count()
-                if image_count == 0:
-                    db.session.delete(submission)
-                    deleted_count += 1
-            
-            if deleted_count > 0:
-                db.session.commit()
-                print(f"[定时任务] {now.strftime('%Y-%m-%d %H:%M:%S')} - 删除无图片提交记录: {deleted_count} 条")
+            # 1. 删除创建超过保留时间仍没有图片的提交记录（刚创建、尚在上传的提交不删除）
+            deleted_count, delete_batches = delete_empty_submissions(now - timedelta(minutes=CLEANUP_GRACE_MINUTES))
             
             # 2. 将判定中超过5分钟的记录转为error状态
-            timeout_threshold = now - timedelta(minutes=5)
-            timeout_submissions = HomeworkSubmission.query.filter(
-                HomeworkSubmission.ai_review_status == 'reviewing',
-                HomeworkSubmission.submitted_at < timeout_threshold
-            ).all()
+            timeout_count, timeout_batches = fail_stale_reviews(now - timedelta(minutes=5), now)
             
-            timeout_count = 0
-            for submission in timeout_submissions:
-                submission.ai_review_status = 'error'
-                submission.ai_review_result = 'AI判定超时（超过5分钟）'
-                submission.ai_reviewed_at = now
-                timeout_count += 1
+            if deleted_count or timeout_count:
+                publish_event('refresh', {'scope': 'submissions'})
             
-            if timeout_count > 0:
+            # 3. 删除已推送过的旧事件
+            with db_write_lock:
+                event_count = AppEvent.query.filter(
+                    AppEvent.created_at < now - timedelta(minutes=EVENT_RETENTION_MINUTES)
+                ).delete(synchronize_session=False)
                 db.session.commit()
-                print(f"[定时任务] {now.strftime('%Y-%m-%d %H:%M:%S')} - 判定超时转error: {timeout_count} 条")
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            print(f"[定时任务] {now.strftime('%Y-%m-%d %H:%M:%S')} - 清理无效提交: "
+                  f"删除无图片提交记录 {deleted_count} 条({delete_batches} 批), "
+                  f"判定超时转error {timeout_count} 条({timeout_batches} 批), "
+                  f"删除旧推送事件 {event_count} 条, 耗时 {elapsed_ms:.0f} ms")
                 
         except Exception as e:
             db.session.rollback()
@@ -200,12 +1160,145 @@ def cleanup_invalid_submissions():
             import traceback
             traceback.print_exc()
 
-# 初始化定时任务调度器
+# 定时任务：校正提交图片数和作业统计计数
+def reconcile_counters_job():
+    """计数在各写入路径中增量维护，定期按实际数据校正，修复异常中断等原因造成的偏差"""
+    with app.app_context():
+        try:
+            with db_write_lock:
+                fixed_submissions, fixed_homeworks = reconcile_counters()
+                if fixed_submissions or fixed_homeworks:
+                    bump_data_version()
+                db.session.commit()
+            if fixed_submissions or fixed_homeworks:
+                print(f"[定时任务] 校正统计计数: 提交 {fixed_submissions} 条, 作业 {fixed_homeworks} 个")
+        except Exception as e:
+            db.session.rollback()
+            print(f"[定时任务] 校正统计计数失败: {str(e)}")
+
+# 定时任务：清理过期的AI审核内联图片缓存
+def prune_ai_image_cache():
+    """删除超过2天的内联图片缓存（审核通常在上传后几分钟内完成）"""
+    if not os.path.exists(AI_IMAGE_CACHE_FOLDER):
+        return
+    
+    expire_before = time.time() - 2 * 24 * 3600
+    removed_count = 0
+    for name in os.listdir(AI_IMAGE_CACHE_FOLDER):
+        path = os.path.join(AI_IMAGE_CACHE_FOLDER, name)
+        try:
+            if os.path.getmtime(path) < expire_before:
+                os.remove(path)
+                removed_count += 1
+        except OSError:
+            pass
+    
+    if removed_count > 0:
+        print(f"[定时任务] 清理AI内联图片缓存: {removed_count} 个文件")
+
+# 本进程标识（主机名-进程号-随机后缀），用于后台任务租约
+PROCESS_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+SCHEDULER_LEASE_NAME = 'scheduler'
+SCHEDULER_LEASE_SECONDS = 600  # 大于清理任务的执行间隔，持有者每次执行时续期
+
+def acquire_lease(name, seconds):
+    """获取或续期租约：租约不存在、已过期或本进程持有时成功，返回是否持有"""
+    now = get_china_time()
+    with db_write_lock:
+        try:
+            updated = ServiceLease.query.filter(
+                ServiceLease.name == name,
+                db.or_(ServiceLease.owner == PROCESS_ID, ServiceLease.expires_at < now)
+            ).update({'owner': PROCESS_ID, 'expires_at': now + timedelta(seconds=seconds)}, synchronize_session=False)
+            if not updated:
+                if db.session.get(ServiceLease, name) is not None:
+                    db.session.commit()
+                    return False
+                db.session.add(ServiceLease(name=name, owner=PROCESS_ID, expires_at=now + timedelta(seconds=seconds)))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            # 其他进程同时创建了租约
+            db.session.rollback()
+            return False
+
+# 每个进程持有一个存活租约（process:<PROCESS_ID>），每30秒续期；租约过期说明进程已退出，
+# 其领取后未完成的审核任务由其他进程放回队列
+PROCESS_LEASE_PREFIX = 'process:'
+PROCESS_LEASE_SECONDS = 90
+AI_REVIEW_JOB_ORPHAN_SECONDS = 600  # 没有记录执行进程的旧任务，开始执行超过这么久仍未完成时放回队列
+
+def live_process_owners():
+    """存活租约未过期的进程标识"""
+    now = get_china_time()
+    return {name[len(PROCESS_LEASE_PREFIX):] for (name,) in db.session.query(ServiceLease.name).filter(
+        ServiceLease.name.like(f'{PROCESS_LEASE_PREFIX}%'),
+        ServiceLease.expires_at >= now
+    )}
+
+def recover_orphaned_ai_jobs():
+    """把已退出进程领取后未完成的审核任务放回队列，返回放回的任务数（仍在执行的任务不受影响）"""
+    now = get_china_time()
+    live = live_process_owners()
+    with db_write_lock:
+        requeued = AIReviewJob.query.filter(
+            AIReviewJob.status == 'running',
+            db.or_(
+                AIReviewJob.owner.notin_(live),
+                db.and_(
+                    AIReviewJob.owner.is_(None),
+                    AIReviewJob.started_at < now - timedelta(seconds=AI_REVIEW_JOB_ORPHAN_SECONDS)
+                )
+            )
+        ).update({'status': 'queued', 'started_at': None, 'owner': None}, synchronize_session=False)
+        db.session.commit()
+    if requeued:
+        print(f"[AI队列] 恢复已退出进程未完成的审核任务: {requeued} 个")
+        ai_review_wakeup.set()
+    return requeued
+
+def process_heartbeat():
+    """续期本进程的存活租约，删除已过期的租约，并接管已退出进程未完成的工作（每个进程每30秒执行）"""
+    with app.app_context():
+        try:
+            acquire_lease(f'{PROCESS_LEASE_PREFIX}{PROCESS_ID}', PROCESS_LEASE_SECONDS)
+            with db_write_lock:
+                ServiceLease.query.filter(
+                    ServiceLease.name.like(f'{PROCESS_LEASE_PREFIX}%'),
+                    ServiceLease.expires_at < get_china_time()
+                ).delete(synchronize_session=False)
+                db.session.commit()
+            recover_orphaned_ai_jobs()
+            recover_orphaned_images()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[系统] 进程心跳失败: {str(e)}")
+
+def run_as_scheduler_leader(func):
+    """包装定时任务：多个进程（gunicorn多worker、多台服务器）都启动了调度器时，只有持有调度租约的进程执行
+    
+    持有者每次执行任务时续期，进程退出后租约过期，由其他进程在下次执行时接管
+    """
+    @functools.wraps(func)
+    def wrapper():
+        with app.app_context():
+            try:
+                leader = acquire_lease(SCHEDULER_LEASE_NAME, SCHEDULER_LEASE_SECONDS)
+            except Exception as e:
+                db.session.rollback()
+                print(f"[定时任务] 获取调度租约失败: {str(e)}")
+                return
+        if leader:
+            func()
+    return wrapper
+
+# 初始化定时任务调度器（每个进程都启动，清理、校正等全局任务由 run_as_scheduler_leader 保证只在一个进程中执行；
+# AI服务cookie刷新、本机AI图片缓存清理在每个进程中执行）
 scheduler = BackgroundScheduler(timezone='Asia/Shanghai')
 
 # 每天北京时间00:00执行清理任务
 scheduler.add_job(
-    func=clear_previous_day_homework_for_students,
+    func=run_as_scheduler_leader(clear_previous_day_homework_for_students),
     trigger=CronTrigger(hour=0, minute=0, timezone='Asia/Shanghai'),
     id='clear_homework_daily',
     name='清空学生端前一天作业',
@@ -214,17 +1307,49 @@ scheduler.add_job(
 
 # 每5分钟执行一次清理无效提交和超时判定的任务
 scheduler.add_job(
-    func=cleanup_invalid_submissions,
+    func=run_as_scheduler_leader(cleanup_invalid_submissions),
     trigger=CronTrigger(minute='*/5', timezone='Asia/Shanghai'),
     id='cleanup_invalid_submissions',
     name='清理无效提交和超时判定',
     replace_existing=True
 )
 
-scheduler.start()
-print("[系统] 定时任务调度器已启动")
-print("[系统] - 每天00:00清空学生端前一天作业")
-print("[系统] - 每5分钟清理无图片提交记录和超时判定")
+# 每天北京时间03:00清理AI内联图片缓存
+scheduler.add_job(
+    func=prune_ai_image_cache,
+    trigger=CronTrigger(hour=3, minute=0, timezone='Asia/Shanghai'),
+    id='prune_ai_image_cache',
+    name='清理AI内联图片缓存',
+    replace_existing=True
+)
+
+# 每30秒续期进程存活租约，恢复已退出进程未完成的任务（每个进程都执行）
+scheduler.add_job(
+    func=process_heartbeat,
+    trigger=IntervalTrigger(seconds=30),
+    id='process_heartbeat',
+    name='进程心跳',
+    replace_existing=True
+)
+
+# 每天北京时间04:00校正统计计数
+scheduler.add_job(
+    func=run_as_scheduler_leader(reconcile_counters_job),
+    trigger=CronTrigger(hour=4, minute=0, timezone='Asia/Shanghai'),
+    id='reconcile_counters',
+    name='校正统计计数',
+    replace_existing=True
+)
+
+def start_scheduler():
+    """启动定时任务调度器"""
+    scheduler.start()
+    print("[系统] 定时任务调度器已启动")
+    print("[系统] - 每天00:00清空学生端前一天作业")
+    print("[系统] - 每5分钟清理无图片提交记录和超时判定")
+    print("[系统] - 每天03:00清理AI内联图片缓存")
+    print("[系统] - 每天04:00校正统计计数")
+    print("[系统] - 每30秒续期进程租约并恢复已退出进程未完成的任务")
 
 # ==================== 配置接口 ====================
 @app.route('/api/config')
@@ -235,6 +1360,8 @@ def get_config():
         'max_images_per_homework': MAX_IMAGES_PER_HOMEWORK,
         'allowed_image_formats': list(ALLOWED_EXTENSIONS),
         'max_image_size_mb': MAX_IMAGE_SIZE_MB,
+        'image_max_edge': IMAGE_MAX_EDGE,
+        'image_jpeg_quality': IMAGE_JPEG_QUALITY,
         'enable_ai_review': ENABLE_AI_REVIEW,
         'ai_review_action': AI_REVIEW_ACTION
     })
@@ -250,29 +1377,94 @@ def about():
     """关于页面"""
     return render_template('about.html')
 
-@app.route('/api/students')
-def get_students():
-    """获取所有学生列表及作业提交状态"""
-    students = Student.query.all()
-    # 获取所有已布置的作业（仅限当天）
-    now = get_china_time()
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+def verdict_cache_key(prompt_text, images):
+    """构建判定缓存键，存在未计算感知哈希的图片时返回None"""
+    hashes = [img.phash for img in images]
+    if not hashes or None in hashes:
+        return None
+    prompt_hash = hashlib.sha1(prompt_text.encode('utf-8')).hexdigest()
+    return prompt_hash, tuple(sorted(hashes))
+
+def get_cached_verdict(key):
+    """查询判定缓存，命中返回ok值，未命中返回None"""
+    if key is None:
+        return None
+    with ai_verdict_cache_lock:
+        entry = ai_verdict_cache.get(key)
+        if entry and time.monotonic() - entry[1] < AI_VERDICT_CACHE_TTL_HOURS * 3600:
+            ai_verdict_cache.move_to_end(key)
+            ai_verdict_cache_stats['hits'] += 1
+            return entry[0]
+        if entry:
+            del ai_verdict_cache[key]
+        ai_verdict_cache_stats['misses'] += 1
+        return None
+
+def store_cached_verdict(key, ok):
+    """写入判定缓存，超出容量时淘汰最久未使用的条目"""
+    if key is None or AI_VERDICT_CACHE_SIZE <= 0:
+        return
+    with ai_verdict_cache_lock:
+        ai_verdict_cache[key] = (ok, time.monotonic())
+        ai_verdict_cache.move_to_end(key)
+        while len(ai_verdict_cache) > AI_VERDICT_CACHE_SIZE:
+            ai_verdict_cache.popitem(last=False)
+
+def submission_event_data(submission, deleted=False):
+    """构建提交记录变更事件数据（删除时需在删除前调用）"""
+    return {
+        'submission_id': submission.id,
+        'student_id': submission.student_id,
+        'homework_id': submission.homework_id,
+        'teacher_id': submission.homework.teacher_id,
+        'deleted': deleted,
+        'submitted_at': submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'image_count': 0 if deleted else submission.image_count,
+        'ai_review_status': None if deleted else submission.ai_review_status,
+        'ai_review_result': None if deleted else submission.ai_review_result
+    }
+
+def homework_event_data(homework, action):
+    """构建作业变更事件数据（action: published / deleted）"""
+    return {
+        'action': action,
+        'homework_id': homework.id,
+        'teacher_id': homework.teacher_id,
+        'subject': homework.subject,
+        'title': homework.title,
+        'created_at': homework.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def build_student_board(homeworks):
+    """一次性构建学生端作业看板（一次查询取出该批作业的所有提交记录及图片数量）"""
+    homework_ids = [hw.id for hw in homeworks]
     
-    homeworks = Homework.query.filter(
-        Homework.created_at >= today_start,
-        Homework.created_at <= today_end
-    ).all()
+    submissions = {}
+    if homework_ids:
+        rows = db.session.query(
+            HomeworkSubmission.id,
+            HomeworkSubmission.student_id,
+            HomeworkSubmission.homework_id,
+            HomeworkSubmission.submitted_at,
+            HomeworkSubmission.ai_review_status,
+            HomeworkSubmission.ai_review_result,
+            HomeworkSubmission.image_count
+        ).filter(
+            HomeworkSubmission.homework_id.in_(homework_ids)
+        ).order_by(HomeworkSubmission.id).all()
+        
+        for row in rows:
+            # 同一学生同一作业存在多条记录时，与原逻辑一致取最早的一条
+            submissions.setdefault((row[1], row[2]), row)
+    
+    students = db.session.query(Student.id, Student.name, Student.student_id).order_by(Student.id).all()
     
     student_list = []
     for student in students:
         # 获取该学生所有学科的提交状态
         homework_status = {}
         for hw in homeworks:
-            submission = HomeworkSubmission.query.filter_by(
-                student_id=student.id,
-                homework_id=hw.id
-            ).first()
+            submission = submissions.get((student.id, hw.id))
             
             if hw.subject not in homework_status:
                 homework_status[hw.subject] = []
@@ -283,7 +1475,7 @@ def get_students():
             ai_review_result = None
             has_images = False
             if submission:
-                image_count = HomeworkImage.query.filter_by(submission_id=submission.id).count()
+                image_count = submission.image_count or 0
                 has_images = image_count > 0
                 ai_review_status = submission.ai_review_status
                 ai_review_result = submission.ai_review_result
@@ -306,7 +1498,147 @@ def get_students():
             'homework_status': homework_status
         })
     
-    return jsonify(student_list)
+    return student_list
+
+@app.route('/api/students')
+def get_students():
+    """获取所有学生列表及作业提交状态"""
+    now = get_china_time()
+    day = now.strftime('%Y-%m-%d')
+    # 读取共享的版本号（主键查询一行），其他进程修改的数据同样使缓存失效
+    version = get_data_version()
+    etag = f'{day}-{version}'
+    
+    # 数据未变化时直接返回304
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    cached = student_board_cache.get('board')
+    if cached and cached['key'] == (day, version):
+        body = cached['body']
+    else:
+        # 获取所有已布置的作业（仅限当天）
+        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+        
+        homeworks = Homework.query.filter(
+            Homework.created_at >= today_start,
+            Homework.created_at <= today_end
+        ).all()
+        
+        body = jsonify(build_student_board(homeworks)).get_data()
+        student_board_cache['board'] = {'key': (day, version), 'body': body}
+    
+    response = make_response(body)
+    response.mimetype = 'application/json'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def relay_events(state):
+    """写入本进程待发布的事件，再把所有进程新发布的事件推送给本进程的订阅者
+    
+    state 记录已检查到的事件编号（cursor）和最近已推送的编号（delivered），没有订阅者时不读取事件
+    """
+    rows = []
+    while True:
+        try:
+            event_type, data = event_outbox.get_nowait()
+        except queue.Empty:
+            break
+        rows.append({'event_type': event_type, 'data': data, 'created_at': get_china_time()})
+    if rows:
+        with db_write_lock:
+            db.session.execute(db.insert(AppEvent), rows)
+            db.session.commit()
+    
+    with event_lock:
+        has_subscribers = bool(event_subscribers)
+    if not has_subscribers:
+        state['cursor'] = None
+        return
+    
+    if state['cursor'] is None:
+        # 订阅者连接后由页面全量加载一次，只需推送此后发布的事件
+        latest = db.session.query(db.func.max(AppEvent.id)).scalar() or 0
+        state['cursor'] = latest
+        state['delivered'] = {event_id for (event_id,) in db.session.query(AppEvent.id).filter(
+            AppEvent.id > latest - EVENT_REORDER_WINDOW
+        )}
+        return
+    
+    # 编号较小的事件可能晚于编号较大的事件提交，向前多检查一段，用 delivered 去重
+    events = db.session.query(AppEvent.id, AppEvent.event_type, AppEvent.data).filter(
+        AppEvent.id > state['cursor'] - EVENT_REORDER_WINDOW
+    ).order_by(AppEvent.id).all()
+    for event_id, event_type, data in events:
+        if event_id not in state['delivered']:
+            dispatch_event(event_id, event_type, data)
+            state['delivered'].add(event_id)
+        state['cursor'] = max(state['cursor'], event_id)
+    low = state['cursor'] - EVENT_REORDER_WINDOW
+    state['delivered'] = {event_id for event_id in state['delivered'] if event_id > low}
+
+def event_relay_worker():
+    """事件转发线程：本进程发布事件时立即写入，有订阅者时每 EVENT_POLL_SECONDS 秒检查其他进程发布的事件"""
+    state = {'cursor': None, 'delivered': set()}
+    while True:
+        event_relay_wakeup.wait(timeout=EVENT_POLL_SECONDS)
+        event_relay_wakeup.clear()
+        try:
+            with app.app_context():
+                relay_events(state)
+        except Exception as e:
+            print(f"[推送] 转发事件失败: {str(e)}")
+            time.sleep(EVENT_POLL_SECONDS)
+
+def start_event_relay():
+    """启动事件转发线程"""
+    thread = threading.Thread(target=event_relay_worker, name='event-relay')
+    thread.daemon = True
+    thread.start()
+
+@app.route('/api/events/latest')
+def latest_event():
+    """最新的事件编号，页面定期核对是否漏收了推送"""
+    latest = db.session.query(db.func.max(AppEvent.id)).scalar() or 0
+    return jsonify({'id': latest})
+
+@app.route('/api/events')
+def event_stream():
+    """服务器推送事件流（SSE），替代页面的定时轮询
+    
+    每个连接在推送期间一直占用一个处理线程，需使用多线程（gthread）或协程（gevent）worker运行，见 gunicorn.conf.py
+    """
+    q = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+    with event_lock:
+        event_subscribers.append(q)
+    event_relay_wakeup.set()
+    
+    def generate():
+        try:
+            # 建议客户端断线后的重连间隔
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    yield q.get(timeout=EVENT_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    if q not in event_subscribers:
+                        return
+                    # 心跳注释，保持连接并及时发现断开的客户端
+                    yield ': ping\n\n'
+        finally:
+            with event_lock:
+                if q in event_subscribers:
+                    event_subscribers.remove(q)
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/api/create-submission', methods=['POST'])
 def create_submission():
@@ -349,7 +1681,9 @@ def create_submission():
         # 创建提交记录
         submission = HomeworkSubmission(student_id=student_id, homework_id=homework_id)
         db.session.add(submission)
+        bump_data_version()
         db.session.commit()
+        publish_event('submission', submission_event_data(submission))
         
         return jsonify({
             'success': True,
@@ -358,269 +1692,1058 @@ def create_submission():
             'subject': homework.subject,
             'max_images': homework.max_images or 5
         }), 200
+    except IntegrityError:
+        # 同一学生并发创建（如重复点击），唯一索引保证只有一条，返回已创建的记录
+        db.session.rollback()
+        existing_submission = HomeworkSubmission.query.filter_by(
+            student_id=student_id,
+            homework_id=homework_id
+        ).first()
+        if not existing_submission:
+            return jsonify({'success': False, 'message': '创建失败,请重试'}), 500
+        return jsonify({
+            'success': True,
+            'message': '提交记录已存在',
+            'submission_id': existing_submission.id,
+            'subject': homework.subject,
+            'max_images': homework.max_images or 5
+        }), 200
     except Exception as e:
         db.session.rollback()
         print(f"创建提交记录失败: {str(e)}")
         return jsonify({'success': False, 'message': '创建失败,请重试'}), 500
 
+def get_ai_loop():
+    """返回AI请求事件循环，首次调用时在后台线程中启动"""
+    with ai_loop_lock:
+        if ai_loop['loop'] is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='ai-http-loop')
+            thread.daemon = True
+            thread.start()
+            ai_loop['loop'] = loop
+        return ai_loop['loop']
+
+def run_ai_coroutine(coro):
+    """把协程交给AI事件循环执行，返回 concurrent.futures.Future（不能在事件循环线程中等待其结果）"""
+    return asyncio.run_coroutine_threadsafe(coro, get_ai_loop())
+
+def get_ai_http_client():
+    """返回AI请求共享的HTTP客户端（只在事件循环线程中使用）
+    
+    cookie由请求头显式携带，客户端不保存服务端返回的cookie
+    """
+    if ai_loop['client'] is None:
+        ai_loop['client'] = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=AI_HTTP_POOL_SIZE, max_keepalive_connections=AI_HTTP_POOL_SIZE),
+            # 读超时即首字节及分块间隔超时；等待空闲连接最多等一个总时限
+            timeout=httpx.Timeout(connect=AI_CONNECT_TIMEOUT, read=AI_FIRST_BYTE_TIMEOUT,
+                                  write=AI_FIRST_BYTE_TIMEOUT, pool=AI_TOTAL_TIMEOUT),
+            cookies=http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        )
+    return ai_loop['client']
+
+async def login_ai_gateway_async():
+    """登录AI服务，返回(cookie值, 有效秒数)，失败时返回(None, None)"""
+    try:
+        response = await get_ai_http_client().post(
+            AI_LOGIN_URL,
+            json={
+                'username': AI_USERNAME,
+                'password': AI_PASSWORD
+            },
+            timeout=httpx.Timeout(10, connect=AI_CONNECT_TIMEOUT)
+        )
+        
+        if response.status_code == 200:
+            # 从响应头中提取session cookie
+            set_cookie_header = response.headers.get('Set-Cookie', '')
+            if 'session=' in set_cookie_header:
+                # 提取session值
+                session_match = re.search(r'session=([^;]+)', set_cookie_header)
+                if session_match:
+                    # 服务端声明了过期时间（Expires/Max-Age）时以其为准
+                    expires = next((c.expires for c in response.cookies.jar if c.name == 'session' and c.expires), None)
+                    max_age = expires - time.time() if expires else AI_COOKIE_MAX_AGE_MINUTES * 60
+                    print(f"[AI] 成功获取session cookie，有效期 {max_age / 60:.0f} 分钟")
+                    return session_match.group(1), max_age
+        
+        print(f"[AI] 登录失败: {response.status_code}")
+        return None, None
+        
+    except Exception as e:
+        print(f"[AI] 登录异常: {str(e)}")
+        return None, None
+
+def login_ai_gateway():
+    """在AI事件循环中登录并等待结果（由刷新cookie的线程调用）"""
+    return run_ai_coroutine(login_ai_gateway_async()).result()
+
+def refresh_ai_session_cookie(stale_generation=None, invalidated=False):
+    """重新登录刷新cookie并返回(cookie值, 版本号)
+    
+    并发调用合并为一次登录：其他线程等待正在进行的登录结果。
+    传入 stale_generation 时，若cookie在此期间已被其他线程刷新则直接返回新cookie。
+    登录失败时保留原cookie继续使用，只有AI服务已返回401/403（invalidated=True）时才清除
+    """
+    with ai_cookie_lock:
+        if stale_generation is not None and ai_session_cookie['generation'] != stale_generation:
+            return ai_session_cookie['value'], ai_session_cookie['generation']
+        leader = not ai_cookie_refresh['running']
+        if leader:
+            ai_cookie_refresh['running'] = True
+            ai_cookie_refresh['done'] = threading.Event()
+        done = ai_cookie_refresh['done']
+    
+    if not leader:
+        done.wait(timeout=AI_CONNECT_TIMEOUT + 10)
+    else:
+        try:
+            value, max_age = login_ai_gateway()
+            with ai_cookie_lock:
+                if value:
+                    now = time.time()
+                    ai_session_cookie.update(
+                        value=value,
+                        obtained_at=now,
+                        expires_at=now + max_age,
+                        generation=ai_session_cookie['generation'] + 1
+                    )
+        finally:
+            with ai_cookie_lock:
+                ai_cookie_refresh['running'] = False
+            done.set()
+    
+    with ai_cookie_lock:
+        if invalidated and ai_session_cookie['generation'] == stale_generation:
+            # 已确认失效且未能刷新的cookie不再使用
+            ai_session_cookie['value'] = None
+        return ai_session_cookie['value'], ai_session_cookie['generation']
+
 def get_ai_session_cookie():
-    """获取或刷新AI API的session cookie"""
-    global ai_session_cookie
+    """获取AI API的session cookie，返回(cookie值, 版本号)
     
+    cookie有效时直接返回；临近过期时在后台刷新，调用方不等待登录；
+    只有尚无cookie或已过期时才同步登录
+    """
     with ai_cookie_lock:
-        # 如果已有cookie，先尝试使用
-        if ai_session_cookie:
-            return ai_session_cookie
+        value = ai_session_cookie['value']
+        generation = ai_session_cookie['generation']
+        remaining = ai_session_cookie['expires_at'] - time.time()
+        refreshing = ai_cookie_refresh['running']
+    
+    if value and remaining > 0:
+        if remaining < AI_COOKIE_REFRESH_BEFORE_MINUTES * 60 and not refreshing:
+            threading.Thread(target=refresh_ai_session_cookie, args=(generation,), daemon=True).start()
+        return value, generation
+    
+    return refresh_ai_session_cookie(generation if value else None)
+
+def refresh_ai_cookie_if_needed():
+    """定时检查cookie有效期，临近过期时提前刷新"""
+    with ai_cookie_lock:
+        generation = ai_session_cookie['generation']
+        remaining = ai_session_cookie['expires_at'] - time.time()
+    if remaining < AI_COOKIE_REFRESH_BEFORE_MINUTES * 60:
+        print("[定时任务] AI session cookie即将过期或尚未获取，刷新cookie")
+        refresh_ai_session_cookie(generation)
+
+# 启用AI审核时每分钟检查一次AI服务cookie，临近过期提前刷新（启动后立即登录一次）
+if ENABLE_AI_REVIEW:
+    scheduler.add_job(
+        func=refresh_ai_cookie_if_needed,
+        trigger=CronTrigger(minute='*', timezone='Asia/Shanghai'),
+        id='refresh_ai_cookie',
+        name='刷新AI服务cookie',
+        next_run_time=get_china_time(),
+        replace_existing=True
+    )
+
+async def iter_sse_data(response, deadline):
+    """增量解析SSE响应（httpx流式响应），逐行返回data内容，超过总时限时抛出超时异常"""
+    async for line_text in response.aiter_lines():
+        if time.monotonic() > deadline:
+            raise httpx.ReadTimeout(f'AI响应超过总时限 {AI_TOTAL_TIMEOUT} 秒')
+        if not line_text:
+            continue
         
-        # 登录获取新cookie
-        try:
-            response = requests.post(
-                AI_LOGIN_URL,
-                json={
-                    'username': AI_USERNAME,
-                    'password': AI_PASSWORD
-                },
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                # 从响应头中提取session cookie
-                set_cookie_header = response.headers.get('Set-Cookie', '')
-                if 'session=' in set_cookie_header:
-                    # 提取session值
-                    session_match = re.search(r'session=([^;]+)', set_cookie_header)
-                    if session_match:
-                        ai_session_cookie = session_match.group(1)
-                        print(f"[AI] 成功获取session cookie")
-                        return ai_session_cookie
+        if line_text.startswith(':') or line_text.startswith(('event:', 'id:', 'retry:')):
+            continue
+        if line_text.startswith('data:'):
+            line_text = line_text[5:].lstrip(' ')
+        # 兼容不带data:前缀的逐行JSON输出
+        yield line_text
+
+class AIReviewDeferred(Exception):
+    """AI服务处于熔断状态，本次审核需延后执行"""
+
+def ai_breaker_wait_seconds():
+    """熔断打开时返回距离允许探测的剩余秒数（半开且探测进行中时返回1），否则返回0"""
+    with ai_breaker_lock:
+        if ai_breaker['state'] == 'half_open' and ai_breaker['probing']:
+            return 1.0
+        if ai_breaker['state'] != 'open':
+            return 0
+        return max(0.0, ai_breaker['opened_at'] + ai_breaker['open_seconds'] - time.monotonic())
+
+def ai_breaker_allow_request():
+    """判断当前是否允许向AI服务发送请求，返回(是否允许, 是否为探测请求)
+    
+    半开状态下同一时间只放行一个探测请求，请求结束后把是否为探测请求传给 ai_breaker_record
+    """
+    with ai_breaker_lock:
+        if ai_breaker['state'] == 'open':
+            if time.monotonic() < ai_breaker['opened_at'] + ai_breaker['open_seconds']:
+                return False, False
+            ai_breaker['state'] = 'half_open'
+            print("[AI熔断] 冷却结束，进入半开状态，放行探测请求")
+        if ai_breaker['state'] == 'half_open':
+            if ai_breaker['probing']:
+                return False, False
+            ai_breaker['probing'] = True
+            return True, True
+        return True, False
+
+def ai_breaker_record(success, probe=False):
+    """记录一次AI请求结果并更新熔断状态
+    
+    熔断或半开状态下只由探测请求的结果决定是否恢复；熔断前发出、之后才结束的请求只累计失败次数
+    """
+    with ai_breaker_lock:
+        if probe:
+            ai_breaker['probing'] = False
+        elif ai_breaker['state'] != 'closed':
+            if not success:
+                ai_breaker['failures'] += 1
+            return
+        if success:
+            if ai_breaker['state'] != 'closed':
+                print("[AI熔断] 探测请求成功，恢复正常")
+            ai_breaker.update(state='closed', failures=0, open_seconds=AI_BREAKER_OPEN_SECONDS)
+            return
+        
+        ai_breaker['failures'] += 1
+        if ai_breaker['state'] == 'half_open':
+            # 探测失败，冷却时间翻倍
+            ai_breaker['open_seconds'] = min(ai_breaker['open_seconds'] * 2, AI_BREAKER_MAX_OPEN_SECONDS)
+        elif ai_breaker['failures'] < AI_BREAKER_FAILURE_THRESHOLD:
+            return
+        ai_breaker['state'] = 'open'
+        ai_breaker['opened_at'] = time.monotonic()
+        ai_breaker['trips'] += 1
+        print(f"[AI熔断] 连续失败 {ai_breaker['failures']} 次，熔断 {ai_breaker['open_seconds']:.0f} 秒")
+
+def ai_retry_delay(attempt):
+    """第attempt次尝试失败后的等待时间：指数退避并加入随机抖动"""
+    return random.uniform(0, min(AI_RETRY_BACKOFF_MAX_SECONDS, AI_RETRY_BACKOFF_SECONDS * (2 ** attempt)))
+
+def acquire_ai_slot():
+    """占用一个AI审核并发名额，超过当前并发上限时等待"""
+    with ai_concurrency_cond:
+        while ai_concurrency['in_flight'] >= max(1, int(ai_concurrency['limit'])):
+            ai_concurrency_cond.wait()
+        ai_concurrency['in_flight'] += 1
+
+def release_ai_slot():
+    """释放AI审核并发名额"""
+    with ai_concurrency_cond:
+        ai_concurrency['in_flight'] -= 1
+        ai_concurrency_cond.notify_all()
+
+def ai_concurrency_record(latency, success):
+    """根据请求延迟调整并发上限：达标时加性增加，超时或失败时乘性减半"""
+    with ai_concurrency_cond:
+        previous = ai_concurrency['latency']
+        ai_concurrency['latency'] = latency if previous is None else previous * 0.8 + latency * 0.2
+        limit = ai_concurrency['limit']
+        if success and latency <= AI_LATENCY_TARGET_SECONDS:
+            ai_concurrency['limit'] = min(float(AI_MAX_CONCURRENT_REQUESTS), limit + 1 / limit)
+        else:
+            ai_concurrency['limit'] = max(1.0, limit / 2)
+        ai_concurrency_cond.notify_all()
+
+async def stream_ai_completion_async(payload, headers, stop_when=None):
+    """通过共享连接池发送流式chat-completions请求，返回(状态码, 拼接后的回复内容)
+    
+    stop_when 用于提前结束：每收到一段内容就以最近的内容片段调用，返回True时立即关闭流
+    熔断打开时抛出 AIReviewDeferred；每次请求的结果和耗时计入熔断器与自适应并发
+    """
+    allowed, probe = ai_breaker_allow_request()
+    if not allowed:
+        raise AIReviewDeferred()
+    
+    started = time.monotonic()
+    deadline = started + AI_TOTAL_TIMEOUT
+    full_content = ""
+    status_code = None
+    
+    try:
+        # 连接超时 / 首字节（及分块间隔）超时由客户端处理，总时长由deadline控制
+        async with get_ai_http_client().stream('POST', AI_API_URL, json=payload, headers=headers) as response:
+            status_code = response.status_code
+            print(f"[AI] API响应状态码: {response.status_code}")
+            if response.status_code != 200:
+                # 只在非 200 时打印完整响应体，避免日志太大
+                try:
+                    await response.aread()
+                    print(f"[AI] API响应体（非200）: {response.text}")
+                except Exception as log_e:
+                    print(f"[AI] 打印响应体时出错: {log_e}")
+                return status_code, full_content
             
-            print(f"[AI] 登录失败: {response.status_code}")
-            return None
+            events = iter_sse_data(response, deadline)
+            async for data in events:
+                if data.strip() == '[DONE]':
+                    break
+                
+                try:
+                    chunk = json.loads(data)
+                    if 'choices' in chunk and len(chunk['choices']) > 0:
+                        delta = chunk['choices'][0].get('delta', {})
+                        if delta.get('content'):
+                            full_content += delta['content']
+                            # 只检查新内容及其之前的一小段，判定标记跨分块时也能识别
+                            if stop_when and stop_when(full_content[-(len(delta['content']) + 32):]):
+                                print("[AI] 已获得判定结果，提前结束流式响应")
+                                return status_code, full_content
+                except json.JSONDecodeError:
+                    continue
             
-        except Exception as e:
-            print(f"[AI] 登录异常: {str(e)}")
-            return None
+            # 读完[DONE]之后的结束块，连接才能放回连接池复用
+            async for _ in events:
+                pass
+    except Exception:
+        status_code = None
+        raise
+    finally:
+        # 网络异常、超时、429和5xx计为失败，其他状态码说明服务本身可达
+        success = status_code is not None and status_code != 429 and status_code < 500
+        ai_breaker_record(success, probe)
+        ai_concurrency_record(time.monotonic() - started, success)
+    
+    return status_code, full_content
 
-def call_ai_review(submission_id):
-    """调用AI进行作业审核（异步执行）"""
-    global ai_session_cookie
+def stream_ai_completion(payload, headers, stop_when=None):
+    """在AI事件循环中执行 stream_ai_completion_async 并等待结果（供线程中的同步代码调用）"""
+    return run_ai_coroutine(stream_ai_completion_async(payload, headers, stop_when)).result()
+
+AI_SYSTEM_PROMPT = "你是一个作业审核助手。你的任务是判断图片是否为学生作业。请只输出JSON格式的结果，不要添加任何其他内容。"
+
+def build_ai_prompt_text(custom_prompt):
+    """构建审核提示词 - 使用自定义prompt或默认prompt"""
+    if custom_prompt:
+        return f"{custom_prompt}\n\n请严格按照以下JSON格式输出，不要添加任何其他文字或解释：\n{{\"ok\": true}}  或  {{\"ok\": false}}\n\n其中ok为true表示这些图片符合要求，ok为false表示不符合要求。"
+    return "请仔细查看这些图片，判断它们是否看起来像是学生提交的作业（例如：作业本、试卷、练习题、手写内容等）。\n\n请严格按照以下JSON格式输出，不要添加任何其他文字或解释：\n{\"ok\": true}  或  {\"ok\": false}\n\n其中ok为true表示这些图片看起来像作业，ok为false表示不像作业。"
+
+def write_downscaled_jpeg(source, target_path, max_edge, quality):
+    """把图片（路径或文件对象）缩小到最长边不超过max_edge后保存为JPEG，返回文件大小"""
+    from PIL import Image
     
-    with app.app_context():
-        try:
-            submission = HomeworkSubmission.query.get(submission_id)
-            if not submission:
-                return
-            
-            # 设置为"判定中"状态
-            submission.ai_review_status = 'reviewing'
-            submission.ai_review_result = 'AI正在判定中...'
-            db.session.commit()
+    with Image.open(source) as image:
+        # JPEG解码时直接按比例缩小，减少大图的解码开销
+        image.draft('RGB', (max_edge, max_edge))
+        image = image.convert('RGB')
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        # 先写临时文件再替换，避免并发请求读到写了一半的文件
+        temp_path = f"{target_path}.{threading.get_ident()}.tmp"
+        image.save(temp_path, 'JPEG', quality=quality)
+    os.replace(temp_path, target_path)
+    return os.path.getsize(target_path)
+
+def build_inline_image_url(filename):
+    """生成缩小后的图片base64 data URI，缩小版缓存在磁盘上，重试时无需重新编码"""
+    name = os.path.splitext(filename)[0]
+    cache_path = os.path.join(AI_IMAGE_CACHE_FOLDER, f"{name}_{AI_INLINE_MAX_EDGE}_{AI_INLINE_QUALITY}.jpg")
+    
+    if not os.path.exists(cache_path):
+        with image_storage.open(filename) as source:
+            write_downscaled_jpeg(source, cache_path, AI_INLINE_MAX_EDGE, AI_INLINE_QUALITY)
+    
+    with open(cache_path, 'rb') as f:
+        encoded = base64.b64encode(f.read()).decode('ascii')
+    return f"data:image/jpeg;base64,{encoded}"
+
+def build_image_parts(images):
+    """构建图片URL列表（inline模式下为内联的base64图片）"""
+    image_urls = []
+    for img in images:
+        image_url = None
+        if AI_IMAGE_MODE == 'inline':
+            try:
+                image_url = build_inline_image_url(img.filename)
+            except Exception as e:
+                print(f"[AI] 内联图片生成失败，改用URL - {img.filename}: {str(e)}")
+        if image_url is None:
+            # 对象存储直接给出预签名URL，AI服务无需经过本服务下载图片
+            image_url = image_storage.presigned_url(img.filename) or f"{HOMEWORK_BASE_URL}/uploads/{img.filename}"
+            print(image_url)
+        image_urls.append({
+            "type": "image_url",
+            "image_url": {"url": image_url}
+        })
+    return image_urls
+
+def build_ai_payload(content):
+    """构建chat-completions请求体"""
+    return {
+        "model": AI_MODEL,
+        "group": "default",
+        "messages": [
+            {
+                "role": "system",
+                "content": AI_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": content
+            }
+        ],
+        "stream": True,
+        "temperature": 0.3,
+        "top_p": 1,
+        "frequency_penalty": 0,
+        "presence_penalty": 0
+    }
+
+def build_ai_headers(session_cookie):
+    """构建携带session cookie的请求头"""
+    return {
+        'Content-Type': 'application/json',
+        'Cookie': f'session={session_cookie}',
+        'New-Api-User': '2'
+    }
+
+async def request_ai_completion_async(payload, stop_when=None):
+    """携带session cookie发送AI请求，返回401/403时重新登录并重试一次
+    
+    返回(状态码, 回复内容)，无法获取cookie时状态码为None。
+    获取和刷新cookie可能需要等待登录，放到线程中执行，不阻塞事件循环中的其他请求
+    """
+    loop = asyncio.get_running_loop()
+    session_cookie, generation = await loop.run_in_executor(None, get_ai_session_cookie)
+    if not session_cookie:
+        print("[AI] 无法获取session cookie，跳过审核")
+        return None, ""
+    
+    status_code, full_content = await stream_ai_completion_async(payload, build_ai_headers(session_cookie), stop_when)
+    if status_code in (401, 403):
+        print(f"[AI] session cookie已失效（{status_code}），重新登录后重试")
+        session_cookie, new_generation = await loop.run_in_executor(
+            None, functools.partial(refresh_ai_session_cookie, generation, invalidated=True)
+        )
+        if session_cookie and new_generation != generation:
+            status_code, full_content = await stream_ai_completion_async(payload, build_ai_headers(session_cookie), stop_when)
+    return status_code, full_content
+
+def request_ai_completion(payload, stop_when=None):
+    """在AI事件循环中执行 request_ai_completion_async 并等待结果（供线程中的同步代码调用）"""
+    return run_ai_coroutine(request_ai_completion_async(payload, stop_when)).result()
+
+def parse_ai_json(full_content):
+    """处理返回的内容，移除可能的代码块标记后解析JSON（失败时抛出JSONDecodeError）"""
+    content_clean = full_content.strip()
+    content_clean = re.sub(r'^```json\s*', '', content_clean)
+    content_clean = re.sub(r'^```\s*', '', content_clean)
+    content_clean = re.sub(r'\s*```$', '', content_clean)
+    content_clean = content_clean.strip()
+    return json.loads(content_clean)
+
+# 匹配 "ok": true/false，容忍代码块包裹、单引号及前后多余内容
+AI_OK_VERDICT_PATTERN = re.compile(r'["\']ok["\']\s*:\s*(true|false)(?![A-Za-z0-9_])', re.IGNORECASE)
+
+def find_ok_verdict(text):
+    """在（可能不完整的）回复内容中查找ok判定，找到返回True/False，否则返回None"""
+    match = AI_OK_VERDICT_PATTERN.search(text)
+    if not match:
+        return None
+    return match.group(1).lower() == 'true'
+
+def parse_ai_verdict(full_content):
+    """解析单个提交的判定结果，优先按JSON解析，失败时从内容中提取ok判定，无法识别时返回None"""
+    try:
+        result = parse_ai_json(full_content)
+        if isinstance(result, dict) and isinstance(result.get('ok'), bool):
+            return result['ok']
+    except json.JSONDecodeError:
+        pass
+    return find_ok_verdict(full_content)
+
+def apply_ai_verdict(submission, images, ok):
+    """根据AI判定结果更新提交记录，不合格时按 AI_REVIEW_ACTION 处理"""
+    submission_id = submission.id
+    if ok:
+        print(f"[AI] ✓ AI判定为正常作业 - Submission ID: {submission_id}")
+        submission.ai_review_status = 'approved'
+        submission.ai_review_result = '通过AI审核'
+    else:
+        print(f"[AI] ✗ AI判定为异常作业 - Submission ID: {submission_id}")
+        # AI判定不像作业，根据配置处理
+        if AI_REVIEW_ACTION == 'reject':
+            print("[AI] 执行操作: 打回作业并删除记录")
+            # 打回作业 - 删除提交记录和图片
+            submission.ai_review_status = 'rejected'
+            submission.ai_review_result = 'AI判定不像作业，已自动打回'
+            submission.ai_reviewed_at = get_china_time()
+            bump_data_version()
+            commit_background_write()
             
-            # 获取该提交的所有图片
-            images = HomeworkImage.query.filter_by(submission_id=submission_id).all()
-            if not images:
-                submission.ai_review_status = 'approved'
-                submission.ai_review_result = '无图片，自动通过'
-                submission.ai_reviewed_at = get_china_time()
+            # 删除图片和提交记录
+            deleted_event = submission_event_data(submission, deleted=True)
+            with db_write_lock:
+                enqueue_file_deletions(img.filename for img in images)
+                for img in images:
+                    db.session.delete(img)
+                db.session.delete(submission)
+                bump_data_version()
                 db.session.commit()
-                return
+            file_deletion_wakeup.set()
+            publish_event('submission', deleted_event)
+            return
             
-            # 获取作业信息，使用自定义prompt
-            homework = submission.homework
-            custom_prompt = homework.ai_prompt
+        elif AI_REVIEW_ACTION == 'mark_abnormal':
+            print("[AI] 执行操作: 标记为异常，保留记录")
+            # 标记为异常，保留提交记录
+            submission.ai_review_status = 'rejected'
+            submission.ai_review_result = 'AI判定不像作业，已标记为异常'
             
-            # 构建图片URL列表
-            image_urls = []
-            for img in images:
-                image_url = f"{HOMEWORK_BASE_URL}/uploads/{img.filename}"
-                print(image_url)
-                image_urls.append({
-                    "type": "image_url",
-                    "image_url": {"url": image_url}
-                })
+        else:  # ignore
+            print("[AI] 执行操作: 忽略AI判断")
+            # 忽略AI判断，标记但不影响提交
+            submission.ai_review_status = 'rejected'
+            submission.ai_review_result = 'AI判定不像作业（已忽略）'
+
+    submission.ai_reviewed_at = get_china_time()
+    bump_data_version()
+    commit_background_write()
+    publish_event('submission', submission_event_data(submission))
+    print(f"[AI] 审核完成 - Submission ID: {submission_id}, 状态: {submission.ai_review_status}")
+
+def mark_ai_review_error(submission_id, message):
+    """把提交标记为审核失败"""
+    try:
+        submission = db.session.get(HomeworkSubmission, submission_id)
+        if submission:
+            submission.ai_review_status = 'error'
+            submission.ai_review_result = message
+            submission.ai_reviewed_at = get_china_time()
+            bump_data_version()
+            commit_background_write()
+            publish_event('submission', submission_event_data(submission))
+    except Exception:
+        db.session.rollback()
+
+def prepare_ai_review(submission_id):
+    """开始审核单个提交（需在应用上下文中调用）：标记为判定中并构建AI请求体
+    
+    无图片、图片全部处理失败或命中判定缓存时直接完成审核并返回None，
+    否则返回(请求体, 判定缓存键, 图片数量)，由 review_submission_async 发送请求
+    """
+    try:
+        submission = db.session.get(HomeworkSubmission, submission_id)
+        if not submission:
+            return None
+        
+        # 设置为"判定中"状态
+        submission.ai_review_status = 'reviewing'
+        submission.ai_review_result = 'AI正在判定中...'
+        bump_data_version()
+        commit_background_write()
+        publish_event('submission', submission_event_data(submission))
+        
+        # 获取该提交的所有图片（处理失败的图片无法审核）
+        images = HomeworkImage.query.filter_by(submission_id=submission_id, processing_status='ready').all()
+        if not images and HomeworkImage.query.filter_by(submission_id=submission_id, processing_status='failed').count() > 0:
+            mark_ai_review_error(submission_id, '图片处理失败，请重新上传')
+            return None
+        if not images:
+            submission.ai_review_status = 'approved'
+            submission.ai_review_result = '无图片，自动通过'
+            submission.ai_reviewed_at = get_china_time()
+            bump_data_version()
+            commit_background_write()
+            publish_event('submission', submission_event_data(submission))
+            return None
+        
+        # 获取作业信息，使用自定义prompt
+        homework = submission.homework
+        prompt_text = build_ai_prompt_text(homework.ai_prompt)
+        
+        # 相同提示词下的相同图片组合直接使用缓存的判定结果
+        cache_key = verdict_cache_key(prompt_text, images)
+        cached_ok = get_cached_verdict(cache_key)
+        if cached_ok is not None:
+            print(f"[AI] 命中判定缓存 - Submission ID: {submission_id}")
+            apply_ai_verdict(submission, images, cached_ok)
+            return None
+        
+        content = [{
+            "type": "text",
+            "text": prompt_text
+        }]
+        content.extend(build_image_parts(images))
+        return build_ai_payload(content), cache_key, len(images)
+    
+    except Exception as e:
+        print(f"[AI] ✗ 审核异常 - Submission ID: {submission_id}")
+        print(f"[AI] 异常详情: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        db.session.rollback()
+        mark_ai_review_error(submission_id, f'审核异常: {str(e)}')
+        return None
+
+async def review_submission_async(submission_id, payload, image_count):
+    """在AI事件循环中请求单个提交的判定（失败时退避重试），返回ok判定，所有重试都失败时返回None
+    
+    熔断打开时抛出 AIReviewDeferred
+    """
+    for attempt in range(AI_REVIEW_MAX_RETRIES):
+        if attempt > 0:
+            # 指数退避后再重试，避免服务异常时连续请求
+            delay = ai_retry_delay(attempt - 1)
+            print(f"[AI] {delay:.1f} 秒后重试 - Submission ID: {submission_id}")
+            await asyncio.sleep(delay)
+        
+        try:
+            print(f"[AI] 开始第 {attempt + 1}/{AI_REVIEW_MAX_RETRIES} 次审核尝试 - Submission ID: {submission_id}")
             
-            # 构建消息内容 - 使用自定义prompt或默认prompt
-            if custom_prompt:
-                prompt_text = f"{custom_prompt}\n\n请严格按照以下JSON格式输出，不要添加任何其他文字或解释：\n{{\"ok\": true}}  或  {{\"ok\": false}}\n\n其中ok为true表示这些图片符合要求，ok为false表示不符合要求。"
-            else:
-                prompt_text = "请仔细查看这些图片，判断它们是否看起来像是学生提交的作业（例如：作业本、试卷、练习题、手写内容等）。\n\n请严格按照以下JSON格式输出，不要添加任何其他文字或解释：\n{\"ok\": true}  或  {\"ok\": false}\n\n其中ok为true表示这些图片看起来像作业，ok为false表示不像作业。"
+            print(f"[AI] 发送API请求到: {AI_API_URL}")
+            print(f"[AI] 使用模型: {AI_MODEL}")
+            print(f"[AI] 图片数量: {image_count}")
             
-            content = [{
-                "type": "text",
-                "text": prompt_text
-            }]
-            content.extend(image_urls)
+            # 识别到ok判定后立即结束流式响应，不必等待[DONE]
+            status_code, full_content = await request_ai_completion_async(
+                payload,
+                stop_when=lambda text: find_ok_verdict(text) is not None
+            )
+            if status_code != 200:
+                continue
             
-            # 准备API请求
-            payload = {
-                "model": AI_MODEL,
-                "group": "default",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "你是一个作业审核助手。你的任务是判断图片是否为学生作业。请只输出JSON格式的结果，不要添加任何其他内容。"
-                    },
-                    {
-                        "role": "user",
-                        "content": content
-                    }
-                ],
-                "stream": True,
-                "temperature": 0.3,
-                "top_p": 1,
-                "frequency_penalty": 0,
-                "presence_penalty": 0
-            }
+            ok = parse_ai_verdict(full_content)
+            if ok is None:
+                print("[AI] 无法识别AI判定结果")
+                print(f"[AI] 原始内容: {full_content.strip()[:200]}...")
+                # 解析失败，继续重试
+                continue
             
-            # 尝试多次调用AI API
-            for attempt in range(AI_REVIEW_MAX_RETRIES):
-                try:
-                    print(f"[AI] 开始第 {attempt + 1}/{AI_REVIEW_MAX_RETRIES} 次审核尝试 - Submission ID: {submission_id}")
-                    
-                    # 获取session cookie
-                    session_cookie = get_ai_session_cookie()
-                    if not session_cookie:
-                        print(f"[AI] 无法获取session cookie，跳过审核")
-                        continue
-                    
-                    # 准备请求头
-                    headers = {
-                        'Content-Type': 'application/json',
-                        'Cookie': f'session={session_cookie}',
-                        'New-Api-User': '2'
-                    }
-                    
-                    print(f"[AI] 发送API请求到: {AI_API_URL}")
-                    print(f"[AI] 使用模型: {AI_MODEL}")
-                    print(f"[AI] 图片数量: {len(images)}")
-                    
-                    response = requests.post(
-                        AI_API_URL,
-                        json=payload,
-                        headers=headers,
-                        stream=True,
-                        timeout=60
-                    )
-                    
-                    print(f"[AI] API响应状态码: {response.status_code}")
-                    
-                    print(f"[AI] API响应状态码: {response.status_code}")
-                    try:
-                    # 只在非 200 时打印完整响应体，避免日志太大
-                        if response.status_code != 200:
-                            print(f"[AI] API响应体（非200）: {response.text}")  # 截断避免过长
-                    except Exception as log_e:
-                        print(f"[AI] 打印响应体时出错: {log_e}")
-                    
-                    # 解析流式响应
-                    full_content = ""
-                    for line in response.iter_lines():
-                        if line:
-                            line_text = line.decode('utf-8')
-                            if line_text.startswith('data: '):
-                                line_text = line_text[6:]
-                            
-                            if line_text.strip() == '[DONE]':
-                                break
-                            
-                            try:
-                                chunk = json.loads(line_text)
-                                if 'choices' in chunk and len(chunk['choices']) > 0:
-                                    delta = chunk['choices'][0].get('delta', {})
-                                    if 'content' in delta:
-                                        full_content += delta['content']
-                            except json.JSONDecodeError:
-                                continue
-                    
-                    # 处理返回的内容，提取JSON
-                    # 移除可能的代码块标记
-                    content_clean = full_content.strip()
-                    content_clean = re.sub(r'^```json\s*', '', content_clean)
-                    content_clean = re.sub(r'^```\s*', '', content_clean)
-                    content_clean = re.sub(r'\s*```$', '', content_clean)
-                    content_clean = content_clean.strip()
-                    
-                    # 尝试解析JSON
-                    try:
-                        result = json.loads(content_clean)
-                        print(f"[AI] 成功解析AI响应: {result}")
-                        
-                        if 'ok' in result and isinstance(result['ok'], bool):
-                            # 成功解析，更新数据库
-                            if result['ok']:
-                                print(f"[AI] ✓ AI判定为正常作业 - Submission ID: {submission_id}")
-                                submission.ai_review_status = 'approved'
-                                submission.ai_review_result = '通过AI审核'
-                            else:
-                                print(f"[AI] ✗ AI判定为异常作业 - Submission ID: {submission_id}")
-                                # AI判定不像作业，根据配置处理
-                                if AI_REVIEW_ACTION == 'reject':
-                                    print(f"[AI] 执行操作: 打回作业并删除记录")
-                                    # 打回作业 - 删除提交记录和图片
-                                    submission.ai_review_status = 'rejected'
-                                    submission.ai_review_result = 'AI判定不像作业，已自动打回'
-                                    submission.ai_reviewed_at = get_china_time()
-                                    db.session.commit()
-                                    
-                                    # 删除图片和提交记录
-                                    for img in images:
-                                        filepath = os.path.join(app.config['UPLOAD_FOLDER'], img.filename)
-                                        if os.path.exists(filepath):
-                                            os.remove(filepath)
-                                        db.session.delete(img)
-                                    db.session.delete(submission)
-                                    db.session.commit()
-                                    return
-                                    
-                                elif AI_REVIEW_ACTION == 'mark_abnormal':
-                                    print(f"[AI] 执行操作: 标记为异常，保留记录")
-                                    # 标记为异常，保留提交记录
-                                    submission.ai_review_status = 'rejected'
-                                    submission.ai_review_result = 'AI判定不像作业，已标记为异常'
-                                    
-                                else:  # ignore
-                                    print(f"[AI] 执行操作: 忽略AI判断")
-                                    # 忽略AI判断，标记但不影响提交
-                                    submission.ai_review_status = 'rejected'
-                                    submission.ai_review_result = 'AI判定不像作业（已忽略）'
-
-                            submission.ai_reviewed_at = get_china_time()
-                            db.session.commit()
-                            print(f"[AI] 审核完成 - Submission ID: {submission_id}, 状态: {submission.ai_review_status}")
-                            return
-                    except json.JSONDecodeError as je:
-                        print(f"[AI] JSON解析失败: {str(je)}")
-                        print(f"[AI] 原始内容: {content_clean[:200]}...")
-                        # JSON解析失败，继续重试
-                        continue
-                        
-                except Exception as e:
-                    print(f"[AI] ✗ 审核尝试 {attempt + 1} 失败: {str(e)}")
-                    import traceback
-                    traceback.print_exc()
-                    continue
+            print(f"[AI] 成功解析AI响应: ok={ok}")
+            return ok
+        
+        except AIReviewDeferred:
+            raise
+        except Exception as e:
+            print(f"[AI] ✗ 审核尝试 {attempt + 1} 失败: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            continue
+    
+    print(f"[AI] ✗ 所有重试均失败 - Submission ID: {submission_id}")
+    return None
+
+def finish_ai_review(submission_id, cache_key, future):
+    """写回单个提交的审核结果（需在应用上下文中调用），future 为 review_submission_async 的结果
+    
+    熔断中时抛出 AIReviewDeferred，提交保持判定中状态，由队列稍后重新执行
+    """
+    try:
+        ok = future.result()
+    except AIReviewDeferred:
+        print(f"[AI] AI服务熔断中，延后审核 - Submission ID: {submission_id}")
+        raise
+    except Exception as e:
+        print(f"[AI] ✗ 审核异常 - Submission ID: {submission_id}")
+        print(f"[AI] 异常详情: {str(e)}")
+        mark_ai_review_error(submission_id, f'审核异常: {str(e)}')
+        return
+    
+    submission = db.session.get(HomeworkSubmission, submission_id)
+    if not submission or submission.ai_review_status != 'reviewing':
+        # 请求期间提交已被删除或已由教师处理
+        return
+    if ok is None:
+        mark_ai_review_error(submission_id, 'AI审核失败，已达最大重试次数')
+        return
+    
+    images = HomeworkImage.query.filter_by(submission_id=submission_id, processing_status='ready').all()
+    store_cached_verdict(cache_key, ok)
+    apply_ai_verdict(submission, images, ok)
+
+def call_ai_review(submission_id):
+    """审核单个提交并等待结果（队列中的任务由 start_ai_review 交给事件循环，不占用线程等待）"""
+    with app.app_context():
+        prepared = prepare_ai_review(submission_id)
+        if prepared is None:
+            return
+        payload, cache_key, image_count = prepared
+        finish_ai_review(submission_id, cache_key, run_ai_coroutine(review_submission_async(submission_id, payload, image_count)))
+
+def build_batch_prompt_text(custom_prompt, group_count):
+    """构建批量审核提示词，要求按组输出JSON数组"""
+    if custom_prompt:
+        requirement = f"{custom_prompt}\n\n以上要求分别适用于每一组图片。"
+    else:
+        requirement = "请仔细查看每一组图片，分别判断它们是否看起来像是学生提交的作业（例如：作业本、试卷、练习题、手写内容等）。"
+    return (
+        f"下面共有 {group_count} 组图片，每组是一名学生的一份作业提交，组号写在每组图片前。\n\n{requirement}\n\n"
+        f"请严格按照以下JSON数组格式输出，每组一项，不要添加任何其他文字或解释：\n"
+        f"[{{\"id\": 1, \"ok\": true}}, {{\"id\": 2, \"ok\": false}}]\n\n"
+        f"其中id为组号，ok为true表示该组图片符合要求，ok为false表示不符合要求。"
+    )
+
+def parse_batch_verdicts(full_content, group_count):
+    """解析批量审核结果，返回{组号: ok}；结果不完整或格式不符时返回None"""
+    try:
+        result = parse_ai_json(full_content)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(result, list):
+        return None
+    
+    verdicts = {}
+    for item in result:
+        if not isinstance(item, dict):
+            return None
+        group_id = item.get('id')
+        ok = item.get('ok')
+        if not isinstance(group_id, int) or not isinstance(ok, bool):
+            return None
+        verdicts[group_id] = ok
+    
+    if set(verdicts) != set(range(1, group_count + 1)):
+        return None
+    return verdicts
+
+def prepare_ai_review_batch(submission_ids):
+    """开始批量审核同一作业的多份提交（需在应用上下文中调用），构建合并后的AI请求体
+    
+    无图片和命中判定缓存的提交直接完成。返回(请求体, 分组)，分组元素为(提交ID, 判定缓存键)；
+    需要请求AI服务的提交不足两份或构建请求出错时请求体为None，分组中的提交改为逐个审核
+    """
+    groups = []
+    try:
+        for submission_id in submission_ids:
+            submission = db.session.get(HomeworkSubmission, submission_id)
+            if not submission:
+                continue
+            images = HomeworkImage.query.filter_by(submission_id=submission_id, processing_status='ready').all()
+            if not images:
+                # 无图片的提交由单独审核流程处理（直接完成，不请求AI服务）
+                prepare_ai_review(submission_id)
+                continue
             
-            # 所有重试都失败
-            print(f"[AI] ✗ 所有重试均失败 - Submission ID: {submission_id}")
-            submission.ai_review_status = 'error'
-            submission.ai_review_result = 'AI审核失败，已达最大重试次数'
-            submission.ai_reviewed_at = get_china_time()
+            cache_key = verdict_cache_key(build_ai_prompt_text(submission.homework.ai_prompt), images)
+            cached_ok = get_cached_verdict(cache_key)
+            if cached_ok is not None:
+                print(f"[AI] 命中判定缓存 - Submission ID: {submission_id}")
+                apply_ai_verdict(submission, images, cached_ok)
+                continue
+            groups.append((submission, images, cache_key))
+        
+        if len(groups) < 2:
+            return None, [(submission.id, cache_key) for submission, _, cache_key in groups]
+        
+        homework = groups[0][0].homework
+        content = [{
+            "type": "text",
+            "text": build_batch_prompt_text(homework.ai_prompt, len(groups))
+        }]
+        for index, (submission, images, _) in enumerate(groups, start=1):
+            content.append({"type": "text", "text": f"第 {index} 组："})
+            content.extend(build_image_parts(images))
+        
+        print(f"[AI] 批量审核 {len(groups)} 份提交 - Homework ID: {homework.id}")
+        return build_ai_payload(content), [(submission.id, cache_key) for submission, _, cache_key in groups]
+    except Exception as e:
+        group_ids = [submission.id for submission, _, _ in groups]
+        db.session.rollback()
+        print(f"[AI] ✗ 批量审核异常，改为逐个审核: {str(e)}")
+        return None, [(submission_id, None) for submission_id in group_ids]
+
+async def review_batch_async(payload, group_count):
+    """在AI事件循环中请求批量判定，返回{组号: ok}，结果不可用时返回None；熔断打开时抛出 AIReviewDeferred"""
+    status_code, full_content = await request_ai_completion_async(payload)
+    if status_code != 200:
+        return None
+    verdicts = parse_batch_verdicts(full_content, group_count)
+    if verdicts is None:
+        print(f"[AI] 批量审核结果无法解析: {full_content.strip()[:200]}...")
+    return verdicts
+
+def finish_ai_review_batch(groups, future):
+    """写回批量审核结果（需在应用上下文中调用），返回需要改为逐个审核的提交ID集合
+    
+    熔断中时抛出 AIReviewDeferred
+    """
+    try:
+        verdicts = future.result()
+    except AIReviewDeferred:
+        print("[AI] AI服务熔断中，延后批量审核")
+        raise
+    except Exception as e:
+        print(f"[AI] ✗ 批量审核异常，改为逐个审核: {str(e)}")
+        verdicts = None
+    if verdicts is None:
+        return {submission_id for submission_id, _ in groups}
+    
+    for index, (submission_id, cache_key) in enumerate(groups, start=1):
+        submission = db.session.get(HomeworkSubmission, submission_id)
+        if not submission or submission.ai_review_status != 'reviewing':
+            continue
+        images = HomeworkImage.query.filter_by(submission_id=submission_id, processing_status='ready').all()
+        store_cached_verdict(cache_key, verdicts[index])
+        apply_ai_verdict(submission, images, verdicts[index])
+    return set()
+
+def call_ai_review_batch(submission_ids):
+    """将同一作业的多份提交合并为一次AI请求审核并等待结果，批量结果不可用时逐个审核"""
+    with app.app_context():
+        payload, groups = prepare_ai_review_batch(submission_ids)
+        single_ids = {submission_id for submission_id, _ in groups}
+        if payload is not None:
+            single_ids = finish_ai_review_batch(groups, run_ai_coroutine(review_batch_async(payload, len(groups))))
+    
+    # 批量结果不可用时回退到逐个审核
+    for submission_id in submission_ids:
+        if submission_id in single_ids:
+            call_ai_review(submission_id)
+
+def enqueue_ai_review(submission_id):
+    """将提交加入AI审核队列（需由调用方提交事务，同一提交只保留一个未完成任务）"""
+    job = AIReviewJob.query.filter_by(submission_id=submission_id).first()
+    if job:
+        return job
+    job = AIReviewJob(submission_id=submission_id)
+    db.session.add(job)
+    return job
+
+def ai_review_images_ready():
+    """查询条件：排除仍有图片在后台处理中的提交，处理完成后才开始审核"""
+    return AIReviewJob.submission_id.notin_(
+        db.session.query(HomeworkImage.submission_id).filter(HomeworkImage.processing_status == 'processing')
+    )
+
+def claim_ai_review_job():
+    """从队列中领取最早的待处理任务，返回(任务ID, 提交ID)或None"""
+    while True:
+        job = AIReviewJob.query.filter(
+            AIReviewJob.status == 'queued',
+            ai_review_images_ready()
+        ).order_by(AIReviewJob.id).first()
+        if not job:
+            return None
+        
+        now = get_china_time()
+        # 条件更新保证多个工作线程/进程不会领取同一个任务
+        with db_write_lock:
+            claimed = AIReviewJob.query.filter_by(id=job.id, status='queued').update(
+                {'status': 'running', 'started_at': now, 'owner': PROCESS_ID},
+                synchronize_session=False
+            )
+            db.session.commit()
+        if claimed:
+            ai_review_wait_times.append((now.replace(tzinfo=None) - job.created_at).total_seconds())
+            return job.id, job.submission_id
+
+def claim_ai_review_batch():
+    """按作业领取一批待处理任务：凑满批量大小或最早任务已等待足够久时才领取
+    
+    返回(任务列表, 建议等待秒数)，任务列表元素为(任务ID, 提交ID)
+    """
+    now = get_china_time()
+    groups = db.session.query(
+        HomeworkSubmission.homework_id,
+        db.func.count(AIReviewJob.id),
+        db.func.min(AIReviewJob.created_at)
+    ).select_from(AIReviewJob).outerjoin(
+        HomeworkSubmission, HomeworkSubmission.id == AIReviewJob.submission_id
+    ).filter(
+        AIReviewJob.status == 'queued',
+        ai_review_images_ready()
+    ).group_by(HomeworkSubmission.homework_id).order_by(db.func.min(AIReviewJob.created_at)).all()
+    
+    next_wait = AI_REVIEW_POLL_SECONDS
+    for homework_id, count, oldest in groups:
+        waited = (now.replace(tzinfo=None) - oldest).total_seconds()
+        # 提交已被删除的任务（homework_id为空）立即领取，由工作线程跳过
+        if homework_id is not None and count < AI_REVIEW_BATCH_SIZE and waited < AI_REVIEW_BATCH_WAIT_SECONDS:
+            next_wait = min(next_wait, AI_REVIEW_BATCH_WAIT_SECONDS - waited)
+            continue
+        
+        homework_filter = HomeworkSubmission.homework_id.is_(None) if homework_id is None else HomeworkSubmission.homework_id == homework_id
+        jobs = AIReviewJob.query.outerjoin(
+            HomeworkSubmission, HomeworkSubmission.id == AIReviewJob.submission_id
+        ).filter(
+            AIReviewJob.status == 'queued',
+            ai_review_images_ready(),
+            homework_filter
+        ).order_by(AIReviewJob.id).limit(AI_REVIEW_BATCH_SIZE).all()
+        
+        claimed = []
+        with db_write_lock:
+            for job in jobs:
+                # 条件更新保证多个工作线程/进程不会领取同一个任务
+                if AIReviewJob.query.filter_by(id=job.id, status='queued').update(
+                    {'status': 'running', 'started_at': now, 'owner': PROCESS_ID},
+                    synchronize_session=False
+                ):
+                    claimed.append((job.id, job.submission_id))
+                    ai_review_wait_times.append((now.replace(tzinfo=None) - job.created_at).total_seconds())
+            db.session.commit()
+        if claimed:
+            return claimed, 0
+    
+    return [], max(next_wait, 0.1)
+
+async def run_with_ai_slot(coro):
+    """执行审核协程，结束后释放领取任务时占用的并发名额"""
+    try:
+        return await coro
+    finally:
+        release_ai_slot()
+
+def submit_ai_review(claimed, coro, finish):
+    """把审核协程交给AI事件循环，请求结束后由结果线程调用 finish 写回（回调只入队，不在事件循环中访问数据库）"""
+    future = run_ai_coroutine(run_with_ai_slot(coro))
+    future.add_done_callback(lambda f: ai_review_results.put((claimed, finish, f)))
+
+def complete_ai_review_jobs(job_ids, deferred=False):
+    """删除已完成的审核任务；熔断中的任务放回队列（已完成审核的提交再次领取时会被跳过）"""
+    if not job_ids:
+        return
+    try:
+        with app.app_context(), db_write_lock:
+            jobs = AIReviewJob.query.filter(AIReviewJob.id.in_(job_ids))
+            if deferred:
+                jobs.update({'status': 'queued', 'started_at': None, 'owner': None}, synchronize_session=False)
+            else:
+                jobs.delete(synchronize_session=False)
             db.session.commit()
-            
-        except Exception as e:
-            print(f"[AI] ✗ 审核异常 - Submission ID: {submission_id}")
-            print(f"[AI] 异常详情: {str(e)}")
-            import traceback
-            traceback.print_exc()
+    except Exception as e:
+        print(f"[AI队列] 更新任务状态失败: {str(e)}")
+
+def start_ai_review(claimed):
+    """准备已领取任务的审核请求并交给AI事件循环，不等待AI服务响应
+    
+    claimed 为(任务ID, 提交ID)列表。需要请求AI服务时返回True，占用的并发名额在请求结束时释放；
+    无需请求的提交（已不在判定中、无图片、命中缓存）在这里直接完成并删除任务，返回False
+    """
+    with app.app_context():
+        # 只审核仍处于判定中的提交（已删除或已被教师处理的跳过）
+        reviewing = {submission_id for (submission_id,) in db.session.query(HomeworkSubmission.id).filter(
+            HomeworkSubmission.id.in_([submission_id for _, submission_id in claimed]),
+            HomeworkSubmission.ai_review_status == 'reviewing'
+        )}
+        pending = sorted((pair for pair in claimed if pair[1] in reviewing), key=lambda pair: pair[1])
+        
+        if len(pending) > 1:
+            payload, groups = prepare_ai_review_batch([submission_id for _, submission_id in pending])
+            group_ids = {submission_id for submission_id, _ in groups}
+            batch = [pair for pair in pending if pair[1] in group_ids]
+            if payload is not None:
+                complete_ai_review_jobs([job_id for job_id, submission_id in claimed if submission_id not in group_ids])
+                submit_ai_review(batch, review_batch_async(payload, len(groups)), functools.partial(finish_ai_review_batch, groups))
+                return True
+            # 需要请求AI服务的提交不足两份（或构建批量请求出错），逐个审核
+            for pair in batch[1:]:
+                ai_single_reviews.put(pair)
+                ai_review_wakeup.set()
+            pending = batch[:1]
+            claimed = [pair for pair in claimed if pair not in batch[1:]]
+        
+        if pending:
+            job_id, submission_id = pending[0]
+            prepared = prepare_ai_review(submission_id)
+            if prepared is not None:
+                payload, cache_key, image_count = prepared
+                complete_ai_review_jobs([other_id for other_id, _ in claimed if other_id != job_id])
+                submit_ai_review(
+                    pending,
+                    review_submission_async(submission_id, payload, image_count),
+                    functools.partial(finish_ai_review, submission_id, cache_key)
+                )
+                return True
+    
+    complete_ai_review_jobs([job_id for job_id, _ in claimed])
+    return False
+
+def ai_review_worker():
+    """AI审核工作线程：循环领取队列中的任务（启用批量时按作业合并），准备请求后交给AI事件循环
+    
+    线程不等待AI服务响应，同时进行的请求数由自适应并发上限决定，与工作线程数无关
+    """
+    while True:
+        # 熔断打开期间不领取任务，任务留在队列中等待
+        blocked_seconds = ai_breaker_wait_seconds()
+        if blocked_seconds > 0:
+            time.sleep(min(blocked_seconds, AI_REVIEW_POLL_SECONDS))
+            continue
+        
+        claimed = []
+        wait_seconds = AI_REVIEW_POLL_SECONDS
+        acquire_ai_slot()
+        try:
+            # 优先处理批量结果不可用、需逐个审核的任务
+            claimed = [ai_single_reviews.get_nowait()]
+        except queue.Empty:
             try:
-                submission = HomeworkSubmission.query.get(submission_id)
-                if submission:
-                    submission.ai_review_status = 'error'
-                    submission.ai_review_result = f'审核异常: {str(e)}'
-                    submission.ai_reviewed_at = get_china_time()
-                    db.session.commit()
-            except:
-                pass
+                with app.app_context():
+                    if AI_REVIEW_BATCH_SIZE > 1:
+                        claimed, wait_seconds = claim_ai_review_batch()
+                    else:
+                        job = claim_ai_review_job()
+                        claimed = [job] if job else []
+            except Exception as e:
+                print(f"[AI队列] 领取任务失败: {str(e)}")
+        
+        if not claimed:
+            release_ai_slot()
+            ai_review_wakeup.wait(timeout=wait_seconds)
+            ai_review_wakeup.clear()
+            continue
+        
+        try:
+            dispatched = start_ai_review(claimed)
+        except Exception as e:
+            print(f"[AI队列] 准备审核请求失败: {str(e)}")
+            complete_ai_review_jobs([job_id for job_id, _ in claimed])
+            dispatched = False
+        if not dispatched:
+            release_ai_slot()
+
+def handle_ai_review_result(claimed, finish, future):
+    """写回一个已结束的AI请求的结果并完成对应的队列任务，批量结果不可用的提交转为逐个审核"""
+    deferred = False
+    single_ids = set()
+    try:
+        with app.app_context():
+            single_ids = finish(future) or set()
+    except AIReviewDeferred:
+        deferred = True
+    except Exception as e:
+        print(f"[AI队列] 写回审核结果失败: {str(e)}")
+    
+    for pair in claimed:
+        if pair[1] in single_ids:
+            ai_single_reviews.put(pair)
+    if single_ids:
+        ai_review_wakeup.set()
+    complete_ai_review_jobs([job_id for job_id, submission_id in claimed if submission_id not in single_ids], deferred)
+
+def ai_review_result_worker():
+    """AI审核结果线程：依次写回事件循环中已结束的请求结果（数据库写入不在事件循环线程中执行）"""
+    while True:
+        handle_ai_review_result(*ai_review_results.get())
+
+def start_ai_review_workers():
+    """启动AI审核工作线程和结果线程（已退出进程未完成的任务由 process_heartbeat 放回队列，其他进程正在执行的任务不受影响）"""
+    for i in range(AI_REVIEW_WORKERS):
+        thread = threading.Thread(target=ai_review_worker, name=f'ai-review-worker-{i}')
+        thread.daemon = True
+        thread.start()
+    thread = threading.Thread(target=ai_review_result_worker, name='ai-review-results')
+    thread.daemon = True
+    thread.start()
+    print(f"[AI队列] 已启动 {AI_REVIEW_WORKERS} 个AI审核工作线程，最多同时进行 {AI_MAX_CONCURRENT_REQUESTS} 个AI请求")
 
 @app.route('/api/confirm-submission/<int:submission_id>', methods=['POST'])
 def confirm_submission(submission_id):
@@ -631,9 +2754,13 @@ def confirm_submission(submission_id):
 
     # 只有在启用了图片上传功能时，才检查是否至少上传了一张图片
     if ENABLE_IMAGE_UPLOAD:
-        image_count = HomeworkImage.query.filter_by(submission_id=submission_id).count()
-        if image_count == 0:
+        if not submission.image_count:
             return jsonify({'success': False, 'message': '请至少上传一张作业图片'}), 400
+        if not HomeworkImage.query.filter(
+            HomeworkImage.submission_id == submission_id,
+            HomeworkImage.processing_status != 'failed'
+        ).count():
+            return jsonify({'success': False, 'message': '图片处理失败，请删除后重新上传'}), 400
 
     homework = submission.homework
     teacher = homework.teacher  # 获取作业对应的教师
@@ -641,16 +2768,15 @@ def confirm_submission(submission_id):
     # 检查全局AI审核开关和教师个人AI审核开关
     ai_review_enabled = ENABLE_AI_REVIEW and teacher.enable_ai_review and ENABLE_IMAGE_UPLOAD
 
-    # 如果启用了AI审核且有图片，启动异步审核
+    # 如果启用了AI审核且有图片，加入AI审核队列
     if ai_review_enabled:
         submission.ai_review_status = 'reviewing'
         submission.ai_review_result = 'AI正在判定中...'
+        enqueue_ai_review(submission_id)
+        bump_data_version()
         db.session.commit()
-
-        # 在后台线程中执行AI审核
-        thread = threading.Thread(target=call_ai_review, args=(submission_id,))
-        thread.daemon = True
-        thread.start()
+        publish_event('submission', submission_event_data(submission))
+        ai_review_wakeup.set()
 
     return jsonify({
         'success': True,
@@ -659,6 +2785,426 @@ def confirm_submission(submission_id):
         'ai_review_enabled': ai_review_enabled
     })
 
+def image_raw_path(filename):
+    """图片原始文件的暂存路径"""
+    return os.path.join(UPLOAD_RAW_FOLDER, os.path.splitext(filename)[0])
+
+# 保护“复用已有文件并登记记录”和“检查引用后删除文件”，避免新记录引用到正被删除的文件
+# image_file_lock 只在本进程内互斥，多个进程之间由 lock_image_files 的数据库锁和删除延迟保证
+image_file_lock = Lock()
+IMAGE_FILE_LOCK_KEY = 20240602  # PostgreSQL咨询锁的命名空间
+
+FILE_DELETION_BATCH_SIZE = 100
+FILE_DELETION_MAX_ATTEMPTS = 10
+FILE_DELETION_DELAY_SECONDS = 60  # 登记后至少等待这么久才删除文件，覆盖其他进程中正在复用该文件的上传
+
+def lock_image_files(filenames):
+    """在当前事务中按文件名加锁，事务结束时释放（PostgreSQL咨询锁，多个进程、多台服务器之间互斥）
+    
+    SQLite只用于单机部署，进程之间依靠 FILE_DELETION_DELAY_SECONDS 的删除延迟
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for filename in sorted(set(filenames)):
+        db.session.execute(
+            db.text('SELECT pg_advisory_xact_lock(:namespace, hashtext(:filename))'),
+            {'namespace': IMAGE_FILE_LOCK_KEY, 'filename': filename}
+        )
+
+def enqueue_file_deletions(filenames):
+    """登记待删除的图片文件（需由调用方提交事务，提交后设置 file_deletion_wakeup）
+    
+    内容相同的图片共用一个文件，后台删除时仍有图片记录引用的文件会保留
+    """
+    next_attempt_at = get_china_time() + timedelta(seconds=FILE_DELETION_DELAY_SECONDS)
+    rows = [{'filename': filename, 'next_attempt_at': next_attempt_at} for filename in set(filenames)]
+    if rows:
+        db.session.execute(db.insert(FileDeletionJob), rows)
+
+def delete_submissions_bulk(submission_ids):
+    """用批量SQL删除提交记录及其图片记录和审核任务，并登记待删除的图片文件（需由调用方提交事务）
+    
+    submission_ids 为提交ID的子查询，图片和提交记录各用一条DELETE语句删除
+    """
+    image_query = HomeworkImage.query.filter(HomeworkImage.submission_id.in_(submission_ids))
+    filenames = [filename for (filename,) in image_query.with_entities(HomeworkImage.filename).distinct()]
+    image_query.delete(synchronize_session=False)
+    AIReviewJob.query.filter(AIReviewJob.submission_id.in_(submission_ids)).delete(synchronize_session=False)
+    subtract_submission_counters(submission_ids)
+    HomeworkSubmission.query.filter(HomeworkSubmission.id.in_(submission_ids)).delete(synchronize_session=False)
+    enqueue_file_deletions(filenames)
+    return len(filenames)
+
+def delete_image_file(filename):
+    """删除图片文件及其暂存文件和缩略图"""
+    image_storage.delete(filename)
+    paths = [image_raw_path(filename), image_storage.staging_path(filename)]
+    paths += [os.path.join(UPLOAD_DERIVED_FOLDER, f'{size}_{filename}') for size in IMAGE_DERIVATIVE_SIZES]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def process_file_deletions():
+    """处理一批到期的文件删除任务，失败的任务按指数退避重试，返回(处理的任务数, 删除的文件数)"""
+    with app.app_context():
+        now = get_china_time()
+        # 按到期时间排序，条件和排序都由 next_attempt_at 索引完成（按id排序时SQLite会改为全表扫描）
+        jobs = FileDeletionJob.query.filter(
+            FileDeletionJob.next_attempt_at <= now
+        ).order_by(FileDeletionJob.next_attempt_at).limit(FILE_DELETION_BATCH_SIZE).all()
+        if not jobs:
+            return 0, 0
+        
+        with image_file_lock:
+            filenames = {job.filename for job in jobs}
+            lock_image_files(filenames)
+            referenced = {filename for (filename,) in db.session.query(HomeworkImage.filename).filter(
+                HomeworkImage.filename.in_(filenames)
+            ).distinct()}
+            
+            deleted_count = 0
+            for job in jobs:
+                if job.filename not in referenced:
+                    try:
+                        delete_image_file(job.filename)
+                        deleted_count += 1
+                    except Exception as e:
+                        job.attempts = (job.attempts or 0) + 1
+                        if job.attempts < FILE_DELETION_MAX_ATTEMPTS:
+                            job.next_attempt_at = now + timedelta(seconds=min(2 ** job.attempts, 300))
+                            print(f"[文件删除] 删除失败，稍后重试（第{job.attempts}次）- {job.filename}: {str(e)}")
+                            continue
+                        print(f"[文件删除] ✗ 多次删除失败，放弃 - {job.filename}: {str(e)}")
+                db.session.delete(job)
+            commit_background_write()
+        return len(jobs), deleted_count
+
+def file_deletion_worker():
+    """后台文件删除线程：有新任务时被唤醒，否则定期检查需要重试的任务"""
+    deleted_total = 0
+    while True:
+        try:
+            processed, deleted_count = process_file_deletions()
+            deleted_total += deleted_count
+        except Exception as e:
+            print(f"[文件删除] 处理删除队列失败: {str(e)}")
+            processed = 0
+        
+        if processed < FILE_DELETION_BATCH_SIZE:
+            if deleted_total > 0:
+                print(f"[文件删除] 已删除 {deleted_total} 个图片文件")
+                deleted_total = 0
+            file_deletion_wakeup.wait(timeout=30)
+            file_deletion_wakeup.clear()
+
+def start_file_deletion_worker():
+    """启动后台文件删除线程，上次进程退出时未完成的删除任务会继续处理"""
+    thread = threading.Thread(target=file_deletion_worker, name='file-deletion-worker')
+    thread.daemon = True
+    thread.start()
+
+IMAGE_STORE_MAX_ATTEMPTS = 8
+IMAGE_STORE_RETRY_SECONDS = 2  # 保存处理结果失败后的首次重试间隔，之后每次加倍
+
+image_process_results = queue.Queue()  # 后台处理已结束的图片：(文件名, future, 第几次保存)
+image_finisher = {'thread': None}
+image_finisher_lock = Lock()
+
+def image_finish_worker():
+    """图片处理结果线程：保存处理结果、更新处理状态并通知页面
+    
+    进程池的完成回调在进程池的管理线程中执行，回调只把结果放入队列，上传、加锁和数据库写入都在本线程中完成
+    """
+    while True:
+        filename, future, attempt = image_process_results.get()
+        try:
+            finish_image_processing(filename, future, attempt)
+        except Exception as e:
+            print(f"[图片处理] ✗ 写回处理结果失败 - {filename}: {str(e)}")
+
+def start_image_finisher():
+    """首次提交图片处理时启动结果线程（上传接口不依赖后台任务是否已启动）"""
+    with image_finisher_lock:
+        if image_finisher['thread'] is None:
+            thread = threading.Thread(target=image_finish_worker, name='image-finisher')
+            thread.daemon = True
+            thread.start()
+            image_finisher['thread'] = thread
+
+def submit_image_processing(filename):
+    """把图片交给后台进程处理，完成后由结果线程更新图片的处理状态"""
+    global image_process_pool
+    output_path = image_storage.staging_path(filename)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    args = (process_uploaded_image, image_raw_path(filename), output_path, IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY)
+    try:
+        future = image_process_pool.submit(*args)
+    except BrokenExecutor:
+        # 工作进程意外退出（如内存不足被杀）后进程池不可再用，重新创建
+        print("[图片处理] 进程池已失效，重新创建")
+        image_process_pool = create_image_process_pool()
+        future = image_process_pool.submit(*args)
+    start_image_finisher()
+    future.add_done_callback(lambda f: image_process_results.put((filename, f, 1)))
+
+def finish_image_processing(filename, future, attempt=1):
+    """在结果线程中执行：保存处理结果，更新引用该文件的所有处理中记录，并通知页面和AI审核队列
+    
+    保存失败（如对象存储暂时不可用）时按指数退避重试，原始文件保留到保存成功为止；
+    重试期间进程退出的，由其他进程的恢复任务用原始文件重新处理
+    """
+    with app.app_context():
+        try:
+            staging_path = image_storage.staging_path(filename)
+            try:
+                phash = future.result()
+            except Exception as e:
+                print(f"[图片处理] ✗ 处理失败 - {filename}: {str(e)}")
+                phash, status = None, 'failed'
+            else:
+                try:
+                    image_storage.store(filename, staging_path)
+                    status = 'ready'
+                except Exception as e:
+                    if attempt < IMAGE_STORE_MAX_ATTEMPTS:
+                        delay = min(IMAGE_STORE_RETRY_SECONDS * 2 ** (attempt - 1), 300)
+                        print(f"[图片处理] 保存失败，{delay}秒后重试（第{attempt}次）- {filename}: {str(e)}")
+                        retry = threading.Timer(delay, image_process_results.put, args=((filename, future, attempt + 1),))
+                        retry.daemon = True
+                        retry.start()
+                        return
+                    print(f"[图片处理] ✗ 多次保存失败，放弃 - {filename}: {str(e)}")
+                    phash, status = None, 'failed'
+                    # 共享存储的暂存文件只在本机，放弃保存后不再需要
+                    if image_storage.shared and os.path.exists(staging_path):
+                        os.remove(staging_path)
+            raw_path = image_raw_path(filename)
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+            
+            with image_file_lock:
+                images = HomeworkImage.query.filter_by(filename=filename, processing_status='processing').all()
+                for image in images:
+                    image.processing_status = status
+                    image.phash = phash
+                if images:
+                    bump_data_version()
+                commit_background_write()
+            
+            if not images:
+                # 处理期间图片已被删除
+                with db_write_lock:
+                    enqueue_file_deletions([filename])
+                    db.session.commit()
+                file_deletion_wakeup.set()
+                return
+            
+            for submission in {image.submission for image in images}:
+                publish_event('submission', submission_event_data(submission))
+            # 等待图片处理的AI审核任务可以开始了
+            ai_review_wakeup.set()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[图片处理] 更新处理状态失败 - {filename}: {str(e)}")
+
+IMAGE_PROCESSING_ORPHAN_SECONDS = 600  # 没有记录处理进程、或原始文件不在本机的图片，上传超过这么久仍未处理完时才接管
+
+def recover_orphaned_images():
+    """接管已退出进程未处理完的图片，返回接管的文件数（其他进程正在处理的图片不受影响）
+    
+    原始文件只保存在上传时所在的服务器：本机有原始文件时重新提交处理；存储中已有处理结果时直接标记完成；
+    都没有时可能由其他服务器处理，超过 IMAGE_PROCESSING_ORPHAN_SECONDS 后才标记失败。
+    每个文件先用带条件的UPDATE领取，多个进程同时恢复时只有一个进程处理
+    """
+    stale_before = get_china_time() - timedelta(seconds=IMAGE_PROCESSING_ORPHAN_SECONDS)
+    live = live_process_owners()
+    orphaned = db.or_(
+        HomeworkImage.processing_owner.notin_(live),
+        db.and_(HomeworkImage.processing_owner.is_(None), HomeworkImage.uploaded_at < stale_before)
+    )
+    pending = db.session.query(
+        HomeworkImage.filename,
+        db.func.min(HomeworkImage.uploaded_at) < stale_before
+    ).filter(
+        HomeworkImage.processing_status == 'processing', orphaned
+    ).group_by(HomeworkImage.filename).all()
+    db.session.commit()
+    
+    resubmitted = []
+    recovered = 0
+    for filename, stale in pending:
+        if os.path.exists(image_raw_path(filename)):
+            values = {'processing_owner': PROCESS_ID}
+        elif image_storage.exists(filename):
+            values = {'processing_status': 'ready', 'processing_owner': None}
+        elif stale:
+            values = {'processing_status': 'failed', 'processing_owner': None}
+        else:
+            continue
+        with db_write_lock:
+            claimed = HomeworkImage.query.filter(
+                HomeworkImage.filename == filename,
+                HomeworkImage.processing_status == 'processing',
+                orphaned
+            ).update(values, synchronize_session=False)
+            if claimed and 'processing_status' in values:
+                bump_data_version()
+            db.session.commit()
+        if not claimed:
+            continue
+        recovered += 1
+        if 'processing_status' in values:
+            print(f"[图片处理] 已退出进程未处理完的图片标记为{'完成' if values['processing_status'] == 'ready' else '失败'} - {filename}")
+        else:
+            resubmitted.append(filename)
+    
+    for filename in resubmitted:
+        submit_image_processing(filename)
+    if resubmitted:
+        print(f"[图片处理] 接管已退出进程未处理完的图片: {len(resubmitted)} 张")
+    if recovered > len(resubmitted):
+        ai_review_wakeup.set()
+    return recovered
+
+def migrate_legacy_uploads():
+    """把旧版平铺在uploads目录下的图片分批移动到分片目录，每批之间暂停以限制磁盘IO，迁移期间旧路径仍可访问"""
+    moved_count = 0
+    batch_count = 0
+    next_report = 5000
+    try:
+        with os.scandir(UPLOAD_FOLDER) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.endswith('.tmp'):
+                    continue
+                target_path = image_storage_path(entry.name)
+                with image_file_lock:
+                    try:
+                        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                        if os.path.exists(target_path):
+                            # 分片目录中已有同名文件（文件名相同即内容相同）
+                            os.remove(entry.path)
+                        else:
+                            os.replace(entry.path, target_path)
+                        moved_count += 1
+                    except FileNotFoundError:
+                        # 文件刚被删除
+                        continue
+                
+                batch_count += 1
+                if batch_count >= UPLOAD_MIGRATE_BATCH_SIZE:
+                    batch_count = 0
+                    if moved_count >= next_report:
+                        print(f"[存储迁移] 已移动 {moved_count} 个文件")
+                        next_report += 5000
+                    time.sleep(UPLOAD_MIGRATE_INTERVAL_SECONDS)
+    except Exception as e:
+        print(f"[存储迁移] 迁移中断（下次启动时继续）: {str(e)}")
+        return
+    print(f"[存储迁移] 完成，共移动 {moved_count} 个文件到分片目录")
+
+def start_upload_migration():
+    """uploads目录下还有旧版平铺的图片时，启动后台迁移线程"""
+    if image_storage.shared:
+        return
+    with os.scandir(UPLOAD_FOLDER) as entries:
+        has_legacy = any(entry.is_file() and not entry.name.endswith('.tmp') for entry in entries)
+    if has_legacy:
+        thread = threading.Thread(target=migrate_legacy_uploads, name='upload-migration')
+        thread.daemon = True
+        thread.start()
+        print("[存储迁移] 发现旧版目录中的图片，开始后台迁移到分片目录")
+
+# 后台任务（定时任务、AI审核、文件删除、存储迁移）每个进程只启动一次
+background_services = {'started': False}
+background_services_lock = Lock()
+
+def start_background_services():
+    """启动定时任务调度器和各后台线程"""
+    with background_services_lock:
+        if background_services['started']:
+            return
+        background_services['started'] = True
+    # 先登记本进程的存活租约，再领取任务（心跳同时接管已退出进程未完成的审核任务和图片处理）
+    process_heartbeat()
+    start_scheduler()
+    start_event_relay()
+    start_ai_review_workers()
+    start_file_deletion_worker()
+    start_upload_migration()
+
+# 由flask命令行加载时（dedup-uploads等维护命令）不启动后台任务，避免维护命令与后台线程同时修改文件和数据库；
+# flask run 在收到第一个请求时再启动。环境变量 BACKGROUND_SERVICES=0 时始终不启动（测试）
+if BACKGROUND_SERVICES_ENABLED and os.environ.get('FLASK_RUN_FROM_CLI') != 'true':
+    start_background_services()
+
+@app.before_request
+def ensure_background_services():
+    if BACKGROUND_SERVICES_ENABLED and not background_services['started']:
+        start_background_services()
+
+def check_image_upload(submission_id):
+    """检查提交记录是否存在及图片数量限制，返回(提交记录, 错误响应)"""
+    submission = HomeworkSubmission.query.get(submission_id)
+    if not submission:
+        return None, (jsonify({'success': False, 'message': '提交记录不存在'}), 404)
+    
+    # 检查图片数量限制 - 使用作业的max_images设置
+    homework = submission.homework
+    max_images = homework.max_images or MAX_IMAGES_PER_HOMEWORK
+    if (submission.image_count or 0) >= max_images:
+        return None, (jsonify({'success': False, 'message': f'最多只能上传{max_images}张图片'}), 400)
+    
+    # 接收图片和等待文件锁可能较慢，先结束只读事务把数据库连接还给连接池
+    db.session.commit()
+    return submission, None
+
+def register_uploaded_image(submission, upload_path, content_hash):
+    """原始文件保存后登记图片记录并提交后台处理，返回上传接口的响应
+    
+    文件按内容哈希命名，内容相同的图片（如网络错误后重新上传）直接引用已有文件，不再重复处理
+    """
+    filename = f"{content_hash}.jpg"
+    with image_file_lock:
+        lock_image_files([filename])
+        existing = HomeworkImage.query.filter(
+            HomeworkImage.filename == filename,
+            HomeworkImage.processing_status != 'failed'
+        ).first()
+        reuse = existing is not None and (
+            existing.processing_status == 'processing'
+            or image_storage.exists(filename)
+        )
+        db_image = HomeworkImage(
+            submission_id=submission.id,
+            filename=filename,
+            original_filename=f"camera_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg",
+            processing_status=existing.processing_status if reuse else 'processing',
+            processing_owner=existing.processing_owner if reuse else PROCESS_ID,
+            phash=existing.phash if reuse else None
+        )
+        db.session.add(db_image)
+        bump_data_version()
+        db.session.commit()
+        if reuse:
+            os.remove(upload_path)
+        else:
+            os.replace(upload_path, image_raw_path(filename))
+    
+    publish_event('submission', submission_event_data(submission))
+    if not reuse:
+        submit_image_processing(filename)
+    
+    return jsonify({
+        'success': True,
+        'message': '图片上传成功',
+        'image': {
+            'id': db_image.id,
+            'filename': filename,
+            'processing_status': db_image.processing_status,
+            'uploaded_at': db_image.uploaded_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+    }), 200
+
 @app.route('/api/upload-image', methods=['POST'])
 def upload_image():
     """上传作业图片（Base64格式）"""
@@ -675,62 +3221,158 @@ def upload_image():
     if not image_data:
         return jsonify({'success': False, 'message': '图片数据不能为空'}), 400
     
-    # 检查提交记录是否存在
-    submission = HomeworkSubmission.query.get(submission_id)
-    if not submission:
-        return jsonify({'success': False, 'message': '提交记录不存在'}), 404
-    
-    # 检查图片数量限制 - 使用作业的max_images设置
-    homework = submission.homework
-    max_images = homework.max_images or MAX_IMAGES_PER_HOMEWORK
-    current_image_count = HomeworkImage.query.filter_by(submission_id=submission_id).count()
-    if current_image_count >= max_images:
-        return jsonify({'success': False, 'message': f'最多只能上传{max_images}张图片'}), 400
+    submission, error = check_image_upload(submission_id)
+    if error:
+        return error
     
+    raw_path = None
     try:
-        import base64
-        import io
-        from PIL import Image
-        
         # 解析Base64数据
         if ',' in image_data:
             image_data = image_data.split(',')[1]
         
         # 解码Base64
         image_bytes = base64.b64decode(image_data)
+        if not detect_image_format(image_bytes[:16]):
+            return jsonify({'success': False, 'message': '不支持的图片格式'}), 400
         
-        # 打开图片并转换为JPEG
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # 生成唯一文件名
-        filename = f"{uuid.uuid4().hex}.jpg"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # 保存为JPEG格式
-        if image.mode in ('RGBA', 'LA', 'P'):
-            image = image.convert('RGB')
-        image.save(filepath, 'JPEG', quality=85)
-        
-        # 保存到数据库
-        db_image = HomeworkImage(
-            submission_id=submission_id,
-            filename=filename,
-            original_filename=f"camera_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-        )
-        db.session.add(db_image)
-        db.session.commit()
+        # 先保存原始文件，按内容哈希登记，转换为JPEG在后台完成
+        raw_path = image_raw_path(uuid.uuid4().hex)
+        with open(raw_path, 'wb') as f:
+            f.write(image_bytes)
+        if not verify_image_file(raw_path):
+            os.remove(raw_path)
+            return jsonify({'success': False, 'message': '图片文件已损坏或格式不正确'}), 400
         
-        return jsonify({
-            'success': True,
-            'message': '图片上传成功',
-            'image': {
-                'id': db_image.id,
-                'filename': filename,
-                'uploaded_at': db_image.uploaded_at.strftime('%Y-%m-%d %H:%M:%S')
-            }
-        }), 200
+        return register_uploaded_image(submission, raw_path, hashlib.sha256(image_bytes).hexdigest())
+    except Exception as e:
+        db.session.rollback()
+        if raw_path and os.path.exists(raw_path):
+            os.remove(raw_path)
+        print(f"上传图片失败: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'message': '上传失败,请重试'}), 500
+
+class ImageUploadError(Exception):
+    """上传的图片数据不符合要求"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+def max_upload_request_bytes():
+    """流式上传请求体的大小上限：图片大小上限加上multipart边界和字段头的余量"""
+    return MAX_IMAGE_SIZE_MB * 1024 * 1024 + UPLOAD_CHUNK_SIZE
+
+def iter_request_body():
+    """逐块读取请求体，累计超过上限时立即停止接收（分块传输的请求没有Content-Length）"""
+    max_bytes = max_upload_request_bytes()
+    size = 0
+    while True:
+        chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        size += len(chunk)
+        if size > max_bytes:
+            raise ImageUploadError(f'图片大小不能超过{MAX_IMAGE_SIZE_MB}MB', 413)
+        yield chunk
+
+def iter_multipart_file(field_name):
+    """流式解析multipart请求体，逐块返回指定文件字段的内容（不在内存或临时文件中缓存整个请求）"""
+    boundary = request.mimetype_params.get('boundary')
+    if not boundary:
+        raise ImageUploadError('缺少multipart边界')
+    
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    body = iter_request_body()
+    in_file = False
+    stream_ended = False
+    try:
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                if stream_ended:
+                    break
+                chunk = next(body, b'')
+                stream_ended = not chunk
+                decoder.receive_data(chunk or None)
+            elif isinstance(event, Epilogue):
+                break
+            elif isinstance(event, File):
+                in_file = event.name == field_name
+            elif isinstance(event, Field):
+                in_file = False
+            elif isinstance(event, Data) and in_file:
+                if event.data:
+                    yield event.data
+                if not event.more_data:
+                    return
+    except ValueError:
+        raise ImageUploadError('上传数据格式错误')
+    raise ImageUploadError(f'未找到图片字段 {field_name}')
+
+def write_upload_chunks(chunks, raw_path):
+    """把上传数据逐块写入文件，写入过程中检查大小上限和图片格式，返回内容的sha256"""
+    max_bytes = MAX_IMAGE_SIZE_MB * 1024 * 1024
+    size = 0
+    header = b''
+    digest = hashlib.sha256()
+    with open(raw_path, 'wb') as f:
+        for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise ImageUploadError(f'图片大小不能超过{MAX_IMAGE_SIZE_MB}MB', 413)
+            if len(header) < 16:
+                header += chunk[:16 - len(header)]
+                if len(header) == 16 and not detect_image_format(header):
+                    raise ImageUploadError('不支持的图片格式')
+            digest.update(chunk)
+            f.write(chunk)
+    
+    if size == 0:
+        raise ImageUploadError('图片数据不能为空')
+    if not detect_image_format(header):
+        raise ImageUploadError('不支持的图片格式')
+    if not verify_image_file(raw_path):
+        raise ImageUploadError('图片文件已损坏或格式不正确')
+    return digest.hexdigest()
+
+@app.route('/api/upload-image/<int:submission_id>', methods=['POST'])
+def upload_image_stream(submission_id):
+    """上传作业图片（二进制格式）：支持 multipart/form-data 的 image 字段或 image/* 原始请求体"""
+    if not ENABLE_IMAGE_UPLOAD:
+        return jsonify({'success': False, 'message': '图片上传功能未启用'}), 403
+    
+    if request.content_length and request.content_length > max_upload_request_bytes():
+        return jsonify({'success': False, 'message': f'图片大小不能超过{MAX_IMAGE_SIZE_MB}MB'}), 413
+    
+    if request.mimetype == 'multipart/form-data':
+        chunks = iter_multipart_file('image')
+    elif request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        chunks = iter_request_body()
+    else:
+        return jsonify({'success': False, 'message': '请使用 multipart/form-data 或 image/* 格式上传'}), 415
+    
+    submission, error = check_image_upload(submission_id)
+    if error:
+        return error
+    
+    # 请求体边接收边写入原始文件，按内容哈希登记，转换为JPEG在后台完成
+    raw_path = image_raw_path(uuid.uuid4().hex)
+    try:
+        content_hash = write_upload_chunks(chunks, raw_path)
+        return register_uploaded_image(submission, raw_path, content_hash)
+    except ImageUploadError as e:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+        return jsonify({'success': False, 'message': e.message}), e.status_code
     except Exception as e:
         db.session.rollback()
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
         print(f"上传图片失败: {str(e)}")
         import traceback
         traceback.print_exc()
@@ -752,7 +3394,9 @@ def get_submission_images(submission_id):
             'filename': img.filename,
             'original_filename': img.original_filename,
             'uploaded_at': img.uploaded_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'url': f'/uploads/{img.filename}'
+            'url': f'/uploads/{img.filename}',
+            'urls': image_urls(img.filename),
+            'processing_status': img.processing_status
         })
     
     return jsonify(image_list)
@@ -768,14 +3412,14 @@ def delete_image(image_id):
         return jsonify({'success': False, 'message': '图片不存在'}), 404
     
     try:
-        # 删除文件
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], image.filename)
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        
-        # 删除数据库记录
+        # 删除数据库记录，文件由后台删除（没有其他记录引用时）
+        submission = image.submission
+        enqueue_file_deletions([image.filename])
         db.session.delete(image)
+        bump_data_version()
         db.session.commit()
+        file_deletion_wakeup.set()
+        publish_event('submission', submission_event_data(submission))
         
         return jsonify({'success': True, 'message': '图片删除成功'}), 200
     except Exception as e:
@@ -783,10 +3427,121 @@ def delete_image(image_id):
         print(f"删除图片失败: {str(e)}")
         return jsonify({'success': False, 'message': '删除失败,请重试'}), 500
 
+def send_upload(path, etag):
+    """发送上传目录中的文件，path为None时返回404
+    
+    文件名为内容哈希（旧文件为uuid）且内容不再变化，因此使用基于文件名的强ETag和长期不可变缓存；
+    direct模式由Flask发送并支持条件请求和Range，x-accel-redirect/x-sendfile模式只返回响应头，
+    由前置的Nginx/Apache直接发送文件内容
+    """
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    
+    if UPLOAD_SEND_MODE in ('x-accel-redirect', 'x-sendfile'):
+        response = Response(mimetype='image/jpeg' if path.lower().endswith(('.jpg', '.jpeg')) else None)
+        if UPLOAD_SEND_MODE == 'x-accel-redirect':
+            relative_path = os.path.relpath(path, app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = UPLOAD_ACCEL_PREFIX.rstrip('/') + '/' + relative_path
+        else:
+            response.headers['X-Sendfile'] = path
+        response.set_etag(etag)
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            response.headers.pop('X-Accel-Redirect', None)
+            response.headers.pop('X-Sendfile', None)
+    else:
+        response = send_file(path, etag=etag, max_age=UPLOAD_CACHE_MAX_AGE)
+        response.accept_ranges = 'bytes'
+    
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = UPLOAD_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     """访问上传的图片"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    filename = secure_filename(filename)
+    presigned_url = image_storage.presigned_url(filename)
+    if presigned_url:
+        # 对象存储：重定向到预签名URL，由浏览器直接下载；重定向本身在签名过期前可缓存
+        response = redirect(presigned_url)
+        response.cache_control.private = True
+        response.cache_control.max_age = S3_PRESIGN_EXPIRES // 2
+        return response
+    
+    try:
+        return send_upload(resolve_image_path(filename), filename)
+    except FileNotFoundError:
+        # 查找路径后文件恰好被后台迁移移动，重新查找一次
+        return send_upload(resolve_image_path(filename), filename)
+
+def image_urls(filename):
+    """图片各尺寸的访问地址"""
+    urls = {size: f'/uploads/{size}/{filename}' for size in IMAGE_DERIVATIVE_SIZES}
+    urls['full'] = f'/uploads/{filename}'
+    return urls
+
+def evict_image_derivatives():
+    """缩略图缓存超出预算时，按最近访问时间淘汰到预算的90%"""
+    budget = IMAGE_DERIVATIVE_CACHE_MB * 1024 * 1024
+    entries = []
+    for entry in os.scandir(UPLOAD_DERIVED_FOLDER):
+        if entry.is_file() and not entry.name.endswith('.tmp'):
+            stat = entry.stat()
+            entries.append((stat.st_atime, stat.st_size, entry.path))
+    
+    total = sum(size for _, size, _ in entries)
+    removed_count = 0
+    if total > budget:
+        for _, size, path in sorted(entries):
+            if total <= budget * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed_count += 1
+            except OSError:
+                pass
+    image_derivative_state['bytes'] = total
+    if removed_count > 0:
+        print(f"[图片缓存] 缩略图缓存超出预算，淘汰 {removed_count} 个文件")
+
+@app.route('/uploads/<any(thumb, medium):size>/<filename>')
+def uploaded_file_derivative(size, filename):
+    """访问图片的缩略图/中图，首次访问时生成并缓存"""
+    filename = secure_filename(filename)
+    derived_name = f'{size}_{filename}'
+    derived_path = os.path.join(UPLOAD_DERIVED_FOLDER, derived_name)
+    
+    if os.path.exists(derived_path):
+        # 更新访问时间供LRU淘汰使用，修改时间保持不变
+        try:
+            os.utime(derived_path, (time.time(), os.stat(derived_path).st_mtime))
+        except OSError:
+            pass
+    else:
+        max_edge, quality = IMAGE_DERIVATIVE_SIZES[size]
+        try:
+            with image_storage.open(filename) as source:
+                file_size = write_downscaled_jpeg(source, derived_path, max_edge, quality)
+        except FileNotFoundError:
+            abort(404)
+        except Exception as e:
+            print(f"[图片缓存] 生成{size}失败 - {filename}: {str(e)}")
+            return uploaded_file(filename)
+        
+        with image_derivative_lock:
+            if image_derivative_state['bytes'] is None:
+                evict_image_derivatives()
+            else:
+                image_derivative_state['bytes'] += file_size
+                if image_derivative_state['bytes'] > IMAGE_DERIVATIVE_CACHE_MB * 1024 * 1024:
+                    evict_image_derivatives()
+    
+    max_edge, quality = IMAGE_DERIVATIVE_SIZES[size]
+    return send_upload(derived_path, f'{size}-{max_edge}-{quality}-{filename}')
 
 @app.route('/api/delete-submission/<int:submission_id>', methods=['DELETE'])
 def delete_submission(submission_id):
@@ -796,17 +3551,20 @@ def delete_submission(submission_id):
         return jsonify({'success': False, 'message': '提交记录不存在'}), 404
     
     try:
+        deleted_event = submission_event_data(submission, deleted=True)
+        
         # 删除相关图片
         images = HomeworkImage.query.filter_by(submission_id=submission_id).all()
+        enqueue_file_deletions(img.filename for img in images)
         for img in images:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], img.filename)
-            if os.path.exists(filepath):
-                os.remove(filepath)
             db.session.delete(img)
         
         # 删除提交记录
         db.session.delete(submission)
+        bump_data_version()
         db.session.commit()
+        file_deletion_wakeup.set()
+        publish_event('submission', deleted_event)
         
         return jsonify({'success': True, 'message': '提交记录已删除'}), 200
     except Exception as e:
@@ -872,6 +3630,7 @@ def get_teacher_info():
 
     return jsonify({
         'success': True,
+        'teacher_id': teacher.id,
         'username': session.get('teacher_username'),
         'subject': session.get('teacher_subject'),
         'enable_ai_review': teacher.enable_ai_review
@@ -949,7 +3708,7 @@ def get_all_students_status():
             ai_review_status = None
             ai_review_result = None
             if submission:
-                image_count = HomeworkImage.query.filter_by(submission_id=submission.id).count()
+                image_count = submission.image_count or 0
                 ai_review_status = submission.ai_review_status
                 ai_review_result = submission.ai_review_result
             
@@ -989,9 +3748,13 @@ def reset_submissions():
         homeworks = Homework.query.filter_by(teacher_id=teacher_id).all()
         homework_ids = [hw.id for hw in homeworks]
         
-        # 删除这些作业的所有提交记录
-        HomeworkSubmission.query.filter(HomeworkSubmission.homework_id.in_(homework_ids)).delete(synchronize_session=False)
+        # 删除这些作业的所有提交记录及其图片
+        delete_submissions_bulk(
+            db.session.query(HomeworkSubmission.id).filter(HomeworkSubmission.homework_id.in_(homework_ids))
+        )
+        bump_data_version()
         db.session.commit()
+        publish_event('refresh', {'scope': 'submissions'})
         
         return jsonify({'success': True, 'message': '作业提交记录已还原'}), 200
     except Exception as e:
@@ -1037,7 +3800,9 @@ def publish_homework():
             max_images=max_images
         )
         db.session.add(homework)
+        bump_data_version()
         db.session.commit()
+        publish_event('homework', homework_event_data(homework, 'published'))
         
         return jsonify({
             'success': True,
@@ -1065,19 +3830,20 @@ def get_teacher_homeworks():
     teacher_id = session.get('teacher_id')
     homeworks = Homework.query.filter_by(teacher_id=teacher_id).order_by(Homework.created_at.desc()).all()
     
+    total_students = Student.query.count()
+    
     homework_list = []
     for hw in homeworks:
-        # 统计提交情况
-        total_students = Student.query.count()
-        submitted_count = HomeworkSubmission.query.filter_by(homework_id=hw.id).count()
-        
         homework_list.append({
             'id': hw.id,
             'title': hw.title,
             'subject': hw.subject,
             'created_at': hw.created_at.strftime('%Y-%m-%d %H:%M:%S'),
             'total_students': total_students,
-            'submitted_count': submitted_count
+            'submitted_count': hw.submitted_count or 0,
+            'approved_count': hw.approved_count or 0,
+            'rejected_count': hw.rejected_count or 0,
+            'error_count': hw.error_count or 0
         })
     
     return jsonify(homework_list)
@@ -1098,21 +3864,18 @@ def delete_homework(homework_id):
         return jsonify({'success': False, 'message': '无权限删除此作业'}), 403
     
     try:
-        # 删除相关图片
-        submissions = HomeworkSubmission.query.filter_by(homework_id=homework_id).all()
-        for sub in submissions:
-            images = HomeworkImage.query.filter_by(submission_id=sub.id).all()
-            for img in images:
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], img.filename)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                db.session.delete(img)
+        deleted_event = homework_event_data(homework, 'deleted')
         
-        # 删除相关提交记录
-        HomeworkSubmission.query.filter_by(homework_id=homework_id).delete()
+        # 批量删除相关图片和提交记录，图片文件由后台删除
+        delete_submissions_bulk(
+            db.session.query(HomeworkSubmission.id).filter(HomeworkSubmission.homework_id == homework_id)
+        )
         # 删除作业
-        db.session.delete(homework)
+        Homework.query.filter_by(id=homework_id).delete(synchronize_session=False)
+        bump_data_version()
         db.session.commit()
+        file_deletion_wakeup.set()
+        publish_event('homework', deleted_event)
         
         return jsonify({'success': True, 'message': '作业删除成功'}), 200
     except Exception as e:
@@ -1142,20 +3905,24 @@ def override_ai_review(submission_id):
             submission.ai_review_status = 'approved'
             submission.ai_review_result = '教师手动批准'
             submission.ai_reviewed_at = get_china_time()
+            bump_data_version()
             db.session.commit()
+            publish_event('submission', submission_event_data(submission))
             return jsonify({'success': True, 'message': '已批准该作业'}), 200
 
         elif action == 'reject_and_delete':
             # 教师确认打回，删除提交记录
+            deleted_event = submission_event_data(submission, deleted=True)
             images = HomeworkImage.query.filter_by(submission_id=submission_id).all()
+            enqueue_file_deletions(img.filename for img in images)
             for img in images:
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], img.filename)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
                 db.session.delete(img)
 
             db.session.delete(submission)
+            bump_data_version()
             db.session.commit()
+            file_deletion_wakeup.set()
+            publish_event('submission', deleted_event)
             return jsonify({'success': True, 'message': '已打回该作业'}), 200
 
     except Exception as e:
@@ -1181,12 +3948,11 @@ def retry_ai_review(submission_id):
         # 更新状态为 reviewing（判定中）
         submission.ai_review_status = 'reviewing'
         submission.ai_review_result = 'AI正在重新判定中...'
+        enqueue_ai_review(submission_id)
+        bump_data_version()
         db.session.commit()
-
-        # 启动后台线程进行审核
-        thread = threading.Thread(target=call_ai_review, args=(submission_id,))
-        thread.daemon = True
-        thread.start()
+        publish_event('submission', submission_event_data(submission))
+        ai_review_wakeup.set()
 
         return jsonify({'success': True, 'message': '已启动AI重审，请稍候...'}), 200
 
@@ -1247,11 +4013,9 @@ def get_daily_homework_stats():
         total_ai_error = 0
         
         for hw in daily_homeworks:
-            # 获取该作业的所有提交记录
-            submissions = HomeworkSubmission.query.filter_by(homework_id=hw.id).all()
-            submitted_count = len(submissions)
-            ai_rejected_count = sum(1 for s in submissions if s.ai_review_status == 'rejected')
-            ai_error_count = sum(1 for s in submissions if s.ai_review_status == 'error')
+            submitted_count = hw.submitted_count or 0
+            ai_rejected_count = hw.rejected_count or 0
+            ai_error_count = hw.error_count or 0
             
             total_submitted += submitted_count
             total_ai_rejected += ai_rejected_count
@@ -1348,8 +4112,6 @@ def get_abnormal_submissions():
         for submission in abnormal_submissions:
             student = submission.student
             homework = submission.homework
-            image_count = HomeworkImage.query.filter_by(submission_id=submission.id).count()
-            
             result.append({
                 'submission_id': submission.id,
                 'student_name': student.name,
@@ -1359,7 +4121,7 @@ def get_abnormal_submissions():
                 'submitted_at': submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S'),
                 'ai_review_status': submission.ai_review_status,
                 'ai_review_result': submission.ai_review_result,
-                'image_count': image_count
+                'image_count': submission.image_count or 0
             })
         
         return jsonify(result)
@@ -1814,23 +4576,19 @@ def admin_delete_teacher(teacher_id):
         return jsonify({'success': False, 'message': '教师不存在'}), 404
     
     try:
-        # 删除该教师布置的所有作业和相关提交
-        homeworks = Homework.query.filter_by(teacher_id=teacher_id).all()
-        for hw in homeworks:
-            submissions = HomeworkSubmission.query.filter_by(homework_id=hw.id).all()
-            for sub in submissions:
-                images = HomeworkImage.query.filter_by(submission_id=sub.id).all()
-                for img in images:
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], img.filename)
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                    db.session.delete(img)
-                db.session.delete(sub)
-            db.session.delete(hw)
+        # 批量删除该教师布置的所有作业和相关提交，图片文件由后台删除
+        homework_ids = db.session.query(Homework.id).filter(Homework.teacher_id == teacher_id)
+        delete_submissions_bulk(
+            db.session.query(HomeworkSubmission.id).filter(HomeworkSubmission.homework_id.in_(homework_ids))
+        )
+        Homework.query.filter_by(teacher_id=teacher_id).delete(synchronize_session=False)
         
         # 删除教师
-        db.session.delete(teacher)
+        Teacher.query.filter_by(id=teacher_id).delete(synchronize_session=False)
+        bump_data_version()
         db.session.commit()
+        file_deletion_wakeup.set()
+        publish_event('refresh', {'scope': 'homeworks'})
         
         return jsonify({'success': True, 'message': '教师删除成功'}), 200
     except Exception as e:
@@ -1880,7 +4638,9 @@ def admin_add_student():
     try:
         student = Student(name=name, student_id=student_id)
         db.session.add(student)
+        bump_data_version()
         db.session.commit()
+        publish_event('refresh', {'scope': 'students'})
         
         return jsonify({
             'success': True,
@@ -1922,7 +4682,9 @@ def admin_edit_student(student_id):
     try:
         student.name = name
         student.student_id = new_student_id
+        bump_data_version()
         db.session.commit()
+        publish_event('refresh', {'scope': 'students'})
         return jsonify({'success': True, 'message': '学生信息更新成功'}), 200
     except Exception as e:
         db.session.rollback()
@@ -1940,22 +4702,17 @@ def admin_delete_student(student_id):
         return jsonify({'success': False, 'message': '学生不存在'}), 404
     
     try:
-        # 删除该学生的所有作业图片
-        submissions = HomeworkSubmission.query.filter_by(student_id=student_id).all()
-        for sub in submissions:
-            images = HomeworkImage.query.filter_by(submission_id=sub.id).all()
-            for img in images:
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], img.filename)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                db.session.delete(img)
-        
-        # 删除该学生的所有作业提交记录
-        HomeworkSubmission.query.filter_by(student_id=student_id).delete()
+        # 批量删除该学生的所有作业图片和提交记录，图片文件由后台删除
+        delete_submissions_bulk(
+            db.session.query(HomeworkSubmission.id).filter(HomeworkSubmission.student_id == student_id)
+        )
         
         # 删除学生
-        db.session.delete(student)
+        Student.query.filter_by(id=student_id).delete(synchronize_session=False)
+        bump_data_version()
         db.session.commit()
+        file_deletion_wakeup.set()
+        publish_event('refresh', {'scope': 'students'})
         
         return jsonify({'success': True, 'message': '学生删除成功'}), 200
     except Exception as e:
@@ -2018,7 +4775,9 @@ def admin_import_students():
             except Exception as e:
                 error_rows.append(f"第{row_num}行: {str(e)}")
         
+        bump_data_version()
         db.session.commit()
+        publish_event('refresh', {'scope': 'students'})
         
         result_message = f"成功添加{added_count}个学生"
         if skipped_count > 0:
@@ -2041,6 +4800,69 @@ def admin_import_students():
         traceback.print_exc()
         return jsonify({'success': False, 'message': f'导入失败: {str(e)}'}), 500
 
+# AI审核队列
+@app.route('/api/admin/ai-review-queue')
+def get_ai_review_queue_stats():
+    """获取AI审核队列深度和等待时间"""
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': '未登录'}), 401
+    
+    queued = AIReviewJob.query.filter_by(status='queued').count()
+    running = AIReviewJob.query.filter_by(status='running').count()
+    oldest = AIReviewJob.query.filter_by(status='queued').order_by(AIReviewJob.created_at).first()
+    now = get_china_time().replace(tzinfo=None)
+    wait_times = list(ai_review_wait_times)
+    
+    with ai_breaker_lock:
+        breaker = {
+            'state': ai_breaker['state'],
+            'consecutive_failures': ai_breaker['failures'],
+            'open_seconds': ai_breaker['open_seconds'],
+            'trips': ai_breaker['trips']
+        }
+    breaker['retry_in_seconds'] = round(ai_breaker_wait_seconds(), 1)
+    with ai_concurrency_cond:
+        concurrency = {
+            'limit': int(ai_concurrency['limit']),
+            'in_flight': ai_concurrency['in_flight'],
+            'avg_latency_seconds': round(ai_concurrency['latency'], 2) if ai_concurrency['latency'] is not None else None,
+            'latency_target_seconds': AI_LATENCY_TARGET_SECONDS
+        }
+    
+    return jsonify({
+        'success': True,
+        'workers': AI_REVIEW_WORKERS,
+        'max_concurrent_requests': AI_MAX_CONCURRENT_REQUESTS,
+        'queued': queued,
+        'running': running,
+        'oldest_wait_seconds': round((now - oldest.created_at).total_seconds(), 1) if oldest else 0,
+        'avg_wait_seconds': round(sum(wait_times) / len(wait_times), 1) if wait_times else 0,
+        'max_wait_seconds': round(max(wait_times), 1) if wait_times else 0,
+        'breaker': breaker,
+        'concurrency': concurrency
+    })
+
+@app.route('/api/admin/ai-verdict-cache')
+def get_ai_verdict_cache_stats():
+    """获取AI判定缓存的命中率"""
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': '未登录'}), 401
+    
+    with ai_verdict_cache_lock:
+        hits = ai_verdict_cache_stats['hits']
+        misses = ai_verdict_cache_stats['misses']
+        size = len(ai_verdict_cache)
+    
+    return jsonify({
+        'success': True,
+        'size': size,
+        'capacity': AI_VERDICT_CACHE_SIZE,
+        'ttl_hours': AI_VERDICT_CACHE_TTL_HOURS,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses) * 100, 1) if hits + misses > 0 else 0
+    })
+
 # 作业管理
 @app.route('/api/admin/homeworks')
 def get_all_homeworks_admin():
@@ -2048,14 +4870,12 @@ def get_all_homeworks_admin():
     if 'admin_id' not in session:
         return jsonify({'success': False, 'message': '未登录'}), 401
     
-    homeworks = Homework.query.order_by(Homework.created_at.desc()).all()
+    homeworks = Homework.query.options(db.joinedload(Homework.teacher)).order_by(Homework.created_at.desc()).all()
+    total_students = Student.query.count()
     homework_list = []
     
     for hw in homeworks:
         teacher = hw.teacher
-        total_students = Student.query.count()
-        submitted_count = HomeworkSubmission.query.filter_by(homework_id=hw.id).count()
-        
         homework_list.append({
             'id': hw.id,
             'title': hw.title,
@@ -2064,7 +4884,10 @@ def get_all_homeworks_admin():
             'teacher_id': teacher.id,
             'created_at': hw.created_at.strftime('%Y-%m-%d %H:%M:%S'),
             'total_students': total_students,
-            'submitted_count': submitted_count,
+            'submitted_count': hw.submitted_count or 0,
+            'approved_count': hw.approved_count or 0,
+            'rejected_count': hw.rejected_count or 0,
+            'error_count': hw.error_count or 0,
             'max_images': hw.max_images,
             'ai_prompt': hw.ai_prompt
         })
@@ -2082,21 +4905,18 @@ def admin_delete_homework(homework_id):
         return jsonify({'success': False, 'message': '作业不存在'}), 404
     
     try:
-        # 删除相关图片
-        submissions = HomeworkSubmission.query.filter_by(homework_id=homework_id).all()
-        for sub in submissions:
-            images = HomeworkImage.query.filter_by(submission_id=sub.id).all()
-            for img in images:
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], img.filename)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                db.session.delete(img)
+        deleted_event = homework_event_data(homework, 'deleted')
         
-        # 删除相关提交记录
-        HomeworkSubmission.query.filter_by(homework_id=homework_id).delete()
+        # 批量删除相关图片和提交记录，图片文件由后台删除
+        delete_submissions_bulk(
+            db.session.query(HomeworkSubmission.id).filter(HomeworkSubmission.homework_id == homework_id)
+        )
         # 删除作业
-        db.session.delete(homework)
+        Homework.query.filter_by(id=homework_id).delete(synchronize_session=False)
+        bump_data_version()
         db.session.commit()
+        file_deletion_wakeup.set()
+        publish_event('homework', deleted_event)
         
         return jsonify({'success': True, 'message': '作业删除成功'}), 200
     except Exception as e:
@@ -2104,6 +4924,75 @@ def admin_delete_homework(homework_id):
         print(f"删除作业失败: {str(e)}")
         return jsonify({'success': False, 'message': '删除失败,请重试'}), 500
 
+@app.cli.command('dedup-uploads')
+@click.option('--dry-run', is_flag=True, help='只统计，不修改文件和数据库')
+def dedup_uploads_command(dry_run):
+    """把uploads目录中的旧图片改为按内容哈希命名，合并内容相同的文件（需先停止服务）
+    
+    新上传的图片按上传的原始字节命名，旧图片的原始文件已不存在，只能按处理后保存的字节命名，
+    因此旧图片与之后重新上传的同一张照片不会合并。两种文件名都是文件内容的唯一标识：
+    服务器原样保存的JPEG处理前后字节相同，文件名一致，重新编码的图片按原始字节命名，不会与其他内容冲突
+    """
+    if image_storage.shared:
+        click.echo('该命令只用于本地存储，请在切换到对象存储之前运行')
+        return
+    renamed_count = merged_count = freed_bytes = 0
+    seen = set()
+    for name, path in list(iter_stored_images()):
+        if not name.lower().endswith('.jpg'):
+            continue
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        filename = f"{digest.hexdigest()}.jpg"
+        if filename == name:
+            continue
+        
+        duplicate = filename in seen or resolve_image_path(filename) is not None
+        seen.add(filename)
+        if duplicate:
+            merged_count += 1
+            freed_bytes += os.path.getsize(path)
+        else:
+            renamed_count += 1
+        if dry_run:
+            continue
+        
+        # 先更新记录再移动文件，中断后重新运行可以继续完成
+        HomeworkImage.query.filter_by(filename=name).update({'filename': filename})
+        db.session.commit()
+        with image_file_lock:
+            # 文件可能已被后台迁移移动到分片目录
+            source_path = resolve_image_path(name)
+            if source_path is None:
+                continue
+            if duplicate:
+                os.remove(source_path)
+            else:
+                target_path = image_storage_path(filename)
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                os.replace(source_path, target_path)
+    
+    action = '需要' if dry_run else '已'
+    click.echo(f"{action}重命名 {renamed_count} 个文件，合并重复文件 {merged_count} 个，释放 {freed_bytes / 1024 / 1024:.1f}MB")
+
+@app.cli.command('upload-to-storage')
+def upload_to_storage_command():
+    """把本地uploads目录中的图片上传到配置的对象存储，已存在的跳过，本地文件保留"""
+    if not image_storage.shared:
+        click.echo('当前使用本地存储，无需上传')
+        return
+    
+    uploaded_count = skipped_count = 0
+    for name, path in iter_stored_images():
+        if image_storage.exists(name):
+            skipped_count += 1
+            continue
+        image_storage.store(name, path, keep_local=True)
+        uploaded_count += 1
+    click.echo(f"已上传 {uploaded_count} 个文件，跳过已存在的 {skipped_count} 个")
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5009)
 
@@ -0,0 +1,95 @@
+"""AI审核基准：比较图片URL模式和内联base64模式的请求体大小、AI服务下载量和审核耗时
+
+AI服务使用 tests/ai_stub.py 的本地替身：URL模式下替身像真实服务一样从本服务下载每张图片，
+内联模式下图片随请求发送。内联模式分别统计首次审核（需缩小编码）和缩小版已缓存时的耗时。
+本机回环网络没有带宽限制，URL模式的耗时不含公网下载时间，应结合AI服务下载的数据量比较。
+
+    python -m benchmarks.ai_review [提交数] [每份图片数]
+"""
+import os
+import sys
+import threading
+import time
+
+from PIL import Image
+
+
+def store_photo(path, size=(3000, 2000)):
+    """模拟手机照片：带噪点的渐变图，按高质量JPEG保存"""
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40)
+    photo = Image.merge('RGB', (gradient, noise, Image.blend(gradient, noise, 0.5)))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    photo.save(path, 'JPEG', quality=95)
+
+
+def main():
+    submission_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    image_count = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    from benchmarks.common import BENCH_DATA_DIR, reset_database, summarize
+    from werkzeug.serving import make_server
+    import app as homework_app
+    from app import db, Teacher, Student, Homework, HomeworkSubmission, HomeworkImage
+    from tests.ai_stub import AIStubServer
+
+    homework_app.UPLOAD_FOLDER = os.path.join(BENCH_DATA_DIR, 'uploads')
+    homework_app.AI_IMAGE_CACHE_FOLDER = os.path.join(BENCH_DATA_DIR, 'ai_image_cache')
+    os.makedirs(homework_app.AI_IMAGE_CACHE_FOLDER)
+
+    server = make_server('127.0.0.1', 0, homework_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    homework_app.HOMEWORK_BASE_URL = f'http://127.0.0.1:{server.server_port}'
+    stub = AIStubServer().start()
+    stub.fetch_images = True
+    homework_app.AI_API_URL = stub.completions_url
+    homework_app.AI_LOGIN_URL = stub.login_url
+
+    with homework_app.app.app_context():
+        reset_database()
+        teacher = Teacher(username='bench', password='x', subject='数学')
+        db.session.add(teacher)
+        db.session.flush()
+        homework = Homework(subject='数学', teacher_id=teacher.id, title='基准')
+        db.session.add(homework)
+        submission_ids = []
+        original_bytes = 0
+        for i in range(submission_count):
+            student = Student(name=f'学生{i}', student_id=f'B{i:04d}')
+            db.session.add(student)
+            db.session.flush()
+            submission = HomeworkSubmission(student_id=student.id, homework_id=homework.id)
+            db.session.add(submission)
+            db.session.flush()
+            for j in range(image_count):
+                filename = f'bench{i:04d}{j:02d}.jpg'
+                path = homework_app.image_storage_path(filename)
+                store_photo(path)
+                original_bytes += os.path.getsize(path)
+                db.session.add(HomeworkImage(submission_id=submission.id, filename=filename, original_filename=filename))
+            submission_ids.append(submission.id)
+        db.session.commit()
+
+    print(f'{submission_count} 份提交，每份 {image_count} 张图片，原图平均 {original_bytes / submission_count / image_count / 1024:.0f}KB')
+    for label, mode in (('URL', 'url'), ('内联（首次）', 'inline'), ('内联（已缓存）', 'inline')):
+        homework_app.AI_IMAGE_MODE = mode
+        stub.requests.clear()
+        stub.fetched_bytes = 0
+        samples = []
+        for submission_id in submission_ids:
+            with homework_app.app.app_context():
+                HomeworkSubmission.query.filter_by(id=submission_id).update({'ai_review_status': 'reviewing'})
+                db.session.commit()
+            started = time.perf_counter()
+            homework_app.call_ai_review(submission_id)
+            samples.append(time.perf_counter() - started)
+        payload_kb = sum(request['size'] for request in stub.requests) / len(stub.requests) / 1024
+        fetched_kb = stub.fetched_bytes / len(stub.requests) / 1024
+        print(f'{label}: 请求体平均 {payload_kb:.0f}KB, AI服务下载图片平均 {fetched_kb:.0f}KB, 审核耗时 {summarize(samples)}')
+
+    stub.stop()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""基准测试公共配置：在导入app之前设置临时数据库并关闭后台任务
+
+    python -m benchmarks.students
+    BENCH_DATABASE_URL=postgresql+psycopg2://homework:密码@127.0.0.1:5432/homework_bench python -m benchmarks.students
+
+会清空指定数据库中的全部数据，不要指向正式数据库
+"""
+import os
+import statistics
+import tempfile
+
+BENCH_DATA_DIR = tempfile.mkdtemp(prefix='homework-bench-')
+os.environ['BACKGROUND_SERVICES'] = '0'
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL') or f"sqlite:///{os.path.join(BENCH_DATA_DIR, 'bench.db')}"
+
+
+def reset_database():
+    """清空除结构版本表和数据版本号外的所有数据"""
+    from app import db
+    for table in reversed(db.metadata.sorted_tables):
+        if table.name not in ('schema_migration', 'data_version'):
+            db.session.execute(table.delete())
+    db.session.commit()
+
+
+def summarize(samples):
+    """耗时样本（秒）的中位数和p95，单位毫秒"""
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return f'中位数 {statistics.median(samples) * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms'
@@ -0,0 +1,141 @@
+"""并发提交压力测试：大量学生同时创建提交、上传图片、刷新看板并确认提交
+
+应用运行在本机多线程HTTP服务中，并启动全部后台任务（图片处理、AI审核队列、文件删除），
+AI服务使用 tests/ai_stub.py 的本地替身；同时有一个线程反复执行定时清理任务，模拟高峰期的后台写入。
+统计各状态码的响应数、"database is locked" 错误数、请求异常和统计计数偏差。
+
+    python -m benchmarks.load_submissions [并发学生数] [清理任务间隔秒数]
+"""
+import builtins
+import collections
+import io
+import os
+import sys
+import threading
+import time
+
+
+def main():
+    student_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    cleanup_interval = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    from benchmarks.common import BENCH_DATA_DIR, reset_database
+    import requests
+    from flask import got_request_exception
+    from PIL import Image
+    from werkzeug.serving import make_server
+    import app as homework_app
+    from app import db, Teacher, Student, Homework, HomeworkSubmission, AIReviewJob
+    from tests.ai_stub import AIStubServer, StubResponse
+
+    # 统计日志中的数据库锁错误（后台线程的异常只打印日志）
+    locked_logs = collections.Counter()
+    original_print = builtins.print
+
+    def counting_print(*args, **kwargs):
+        if 'database is locked' in ' '.join(str(arg) for arg in args):
+            locked_logs['count'] += 1
+        original_print(*args, **kwargs)
+    builtins.print = counting_print
+
+    request_errors = collections.Counter()
+    got_request_exception.connect(
+        lambda sender, exception, **kwargs: request_errors.update([f'{type(exception).__name__}: {str(exception)[:120]}']),
+        homework_app.app
+    )
+
+    homework_app.UPLOAD_FOLDER = os.path.join(BENCH_DATA_DIR, 'uploads')
+    homework_app.UPLOAD_RAW_FOLDER = os.path.join(homework_app.UPLOAD_FOLDER, 'raw')
+    os.makedirs(homework_app.UPLOAD_RAW_FOLDER)
+    homework_app.ENABLE_IMAGE_UPLOAD = True
+    homework_app.ENABLE_AI_REVIEW = True
+    stub = AIStubServer().start()
+    stub.default_response = StubResponse.verdict(True, delay=0.2)
+    homework_app.AI_API_URL = stub.completions_url
+    homework_app.AI_LOGIN_URL = stub.login_url
+
+    with homework_app.app.app_context():
+        reset_database()
+        teacher = Teacher(username='bench', password='x', subject='数学')
+        db.session.add(teacher)
+        db.session.flush()
+        homework = Homework(subject='数学', teacher_id=teacher.id, title='压力测试', max_images=5)
+        db.session.add(homework)
+        db.session.add_all([Student(name=f'学生{i}', student_id=f'L{i:05d}') for i in range(student_count)])
+        db.session.commit()
+        homework_id = homework.id
+        student_ids = [student_id for (student_id,) in db.session.query(Student.id)]
+
+    images = []
+    for i in range(student_count * 2):
+        buffer = io.BytesIO()
+        Image.effect_noise((320, 240), 20 + i % 50).convert('RGB').save(buffer, 'JPEG', quality=70)
+        images.append(buffer.getvalue())
+
+    homework_app.start_background_services()
+    server = make_server('127.0.0.1', 0, homework_app.app, threaded=True)
+    server.socket.listen(1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    statuses = collections.Counter()
+    latencies = []
+    barrier = threading.Barrier(student_count)
+
+    def submit(i):
+        session = requests.Session()
+        barrier.wait()
+        started = time.perf_counter()
+        try:
+            response = session.post(f'{base_url}/api/create-submission', json={'student_id': student_ids[i], 'homework_id': homework_id}, timeout=120)
+            statuses[response.status_code] += 1
+            submission_id = response.json()['submission_id']
+            for k in range(2):
+                response = session.post(f'{base_url}/api/upload-image/{submission_id}', data=images[i * 2 + k],
+                                        headers={'Content-Type': 'image/jpeg'}, timeout=120)
+                statuses[response.status_code] += 1
+            statuses[session.get(f'{base_url}/api/students', timeout=120).status_code] += 1
+            statuses[session.post(f'{base_url}/api/confirm-submission/{submission_id}', timeout=120).status_code] += 1
+        except Exception as e:
+            statuses[type(e).__name__] += 1
+        latencies.append(time.perf_counter() - started)
+
+    stopped = threading.Event()
+
+    def cleanup_loop():
+        while not stopped.is_set():
+            homework_app.cleanup_invalid_submissions()
+            stopped.wait(cleanup_interval)
+    threading.Thread(target=cleanup_loop, daemon=True).start()
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(student_count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    # 等待AI审核队列处理完
+    deadline = time.time() + 120
+    with homework_app.app.app_context():
+        while time.time() < deadline and AIReviewJob.query.count():
+            db.session.commit()
+            time.sleep(0.5)
+        stopped.set()
+        review_statuses = collections.Counter(status for (status,) in db.session.query(HomeworkSubmission.ai_review_status))
+        drift = homework_app.reconcile_counters()
+        db.session.rollback()
+
+    latencies.sort()
+    original_print(f'{student_count} 名学生并发提交，请求阶段 {elapsed:.1f}s，'
+                   f'每名学生耗时中位数 {latencies[len(latencies) // 2]:.2f}s，p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f}s')
+    original_print(f'响应: {dict(statuses)}')
+    original_print(f'"database is locked" 日志: {locked_logs["count"]} 条，请求异常: {sum(request_errors.values())} 个')
+    for error, count in request_errors.most_common(5):
+        original_print(f'  {count} x {error}')
+    original_print(f'审核状态: {dict(review_statuses)}，AI请求 {len(stub.requests)} 次，计数偏差（提交, 作业）: {drift}')
+
+
+if __name__ == '__main__':
+    main()
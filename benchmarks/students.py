@@ -0,0 +1,121 @@
+"""学生端看板基准：比较逐个学生查询的旧实现和一次查询构建看板的 /api/students
+
+统计每次请求执行的SQL语句数和耗时，并检查两种实现返回的数据完全相同。
+
+    python -m benchmarks.students [学生数] [当天作业数] [重复次数]
+"""
+import json
+import sys
+import time
+
+
+def legacy_student_board(homeworks):
+    """旧实现：每个学生的每份作业各查询一次提交记录和图片数量"""
+    from app import Student, HomeworkSubmission, HomeworkImage
+
+    student_list = []
+    for student in Student.query.all():
+        homework_status = {}
+        for hw in homeworks:
+            submission = HomeworkSubmission.query.filter_by(student_id=student.id, homework_id=hw.id).first()
+            image_count = 0
+            has_images = False
+            if submission:
+                image_count = HomeworkImage.query.filter_by(submission_id=submission.id).count()
+                has_images = image_count > 0
+            homework_status.setdefault(hw.subject, []).append({
+                'homework_id': hw.id,
+                'title': hw.title,
+                'submitted': submission is not None and has_images,
+                'submitted_at': submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S') if submission and has_images else None,
+                'submission_id': submission.id if submission else None,
+                'image_count': image_count,
+                'ai_review_status': submission.ai_review_status if submission else None,
+                'ai_review_result': submission.ai_review_result if submission else None
+            })
+        student_list.append({
+            'id': student.id,
+            'name': student.name,
+            'student_id': student.student_id,
+            'homework_status': homework_status
+        })
+    return student_list
+
+
+def seed(student_count, homework_count):
+    """写入学生、当天作业和约七成的提交记录（每份两张图片）"""
+    from app import db, Teacher, Student, Homework, HomeworkSubmission, HomeworkImage
+
+    subjects = ['语文', '数学', '英语', '物理']
+    db.session.execute(db.insert(Teacher), [
+        {'username': f'teacher{i}', 'password': 'x', 'subject': subject} for i, subject in enumerate(subjects)
+    ])
+    teachers = db.session.query(Teacher.id, Teacher.subject).all()
+    db.session.execute(db.insert(Homework), [
+        {'subject': teachers[i % len(teachers)][1], 'teacher_id': teachers[i % len(teachers)][0], 'title': f'作业{i}'}
+        for i in range(homework_count)
+    ])
+    db.session.execute(db.insert(Student), [{'name': f'学生{i}', 'student_id': f'S{i:05d}'} for i in range(student_count)])
+    homework_ids = db.session.scalars(db.select(Homework.id)).all()
+    student_ids = db.session.scalars(db.select(Student.id)).all()
+    db.session.execute(db.insert(HomeworkSubmission), [
+        {'student_id': student_id, 'homework_id': homework_id, 'ai_review_status': 'approved', 'image_count': 2}
+        for i, student_id in enumerate(student_ids) for j, homework_id in enumerate(homework_ids) if (i + j) % 10 < 7
+    ])
+    submission_ids = db.session.scalars(db.select(HomeworkSubmission.id)).all()
+    db.session.execute(db.insert(HomeworkImage), [
+        {'submission_id': submission_id, 'filename': f'{submission_id:07d}{k}.jpg', 'original_filename': 'camera.jpg'}
+        for submission_id in submission_ids for k in range(2)
+    ])
+    db.session.commit()
+    return len(submission_ids)
+
+
+def main():
+    student_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1500
+    homework_count = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    from benchmarks.common import reset_database, summarize
+    from sqlalchemy import event
+    import app as homework_app
+    from app import db, Homework
+
+    client = homework_app.app.test_client()
+    statements = []
+    with homework_app.app.app_context():
+        reset_database()
+        submission_count = seed(student_count, homework_count)
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(1))
+
+        def measure(label, func):
+            samples = []
+            for _ in range(repeat):
+                statements.clear()
+                db.session.expire_all()
+                started = time.perf_counter()
+                result = func()
+                samples.append(time.perf_counter() - started)
+            print(f'{label}: SQL {len(statements)} 条, {summarize(samples)}')
+            return result
+
+        print(f'{student_count} 名学生，当天 {homework_count} 份作业，{submission_count} 条提交记录')
+        homeworks = Homework.query.all()
+        legacy = measure('逐个查询（旧实现）', lambda: legacy_student_board(homeworks))
+
+        def uncached():
+            # 每次请求前使缓存失效，模拟数据刚发生变化
+            homework_app.bump_data_version()
+            db.session.commit()
+            return client.get('/api/students')
+        response = measure('/api/students 数据变化后', uncached)
+        assert json.loads(response.data) == json.loads(json.dumps(legacy)), '两种实现返回的数据不同'
+
+        measure('/api/students 缓存命中', lambda: client.get('/api/students'))
+        etag = response.headers['ETag']
+        response = measure('/api/students 未变化（304）', lambda: client.get('/api/students', headers={'If-None-Match': etag}))
+        assert response.status_code == 304
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""图片上传基准：比较Base64 JSON接口和流式二进制接口的耗时与内存峰值
+
+每种方式在单独的子进程中运行，分别统计请求耗时、Python内存分配峰值（tracemalloc）和进程RSS峰值的增量。
+只测量接收、校验和登记，后台图片处理不执行。
+
+    python -m benchmarks.upload [图片MB数] [上传次数]
+"""
+import base64
+import io
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+MODES = ('json', 'stream', 'multipart')
+
+
+def make_image(size_mb):
+    """指定大小的PNG（有效图片后补零，Pillow校验只读取到IEND）"""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), 'white').save(buffer, 'PNG')
+    return buffer.getvalue() + b'\0' * (int(size_mb * 1024 * 1024) - buffer.tell())
+
+
+def run_mode(mode, size_mb, count):
+    from benchmarks.common import BENCH_DATA_DIR, reset_database, summarize
+    import app as homework_app
+    from app import db, Teacher, Student, Homework, HomeworkSubmission
+
+    homework_app.ENABLE_IMAGE_UPLOAD = True
+    homework_app.UPLOAD_RAW_FOLDER = BENCH_DATA_DIR
+    homework_app.submit_image_processing = lambda filename: None
+    client = homework_app.app.test_client()
+    image = make_image(size_mb)
+    payload = base64.b64encode(image).decode()
+    del image
+
+    with homework_app.app.app_context():
+        reset_database()
+        teacher = Teacher(username='bench', password='x', subject='数学')
+        db.session.add(teacher)
+        db.session.flush()
+        homework = Homework(subject='数学', teacher_id=teacher.id, title='基准', max_images=count)
+        student = Student(name='基准', student_id='B0001')
+        db.session.add_all([homework, student])
+        db.session.flush()
+        submission = HomeworkSubmission(student_id=student.id, homework_id=homework.id)
+        db.session.add(submission)
+        db.session.commit()
+        submission_id = submission.id
+
+    samples = []
+    peak = 0
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for i in range(count):
+        # 每次上传的内容不同，避免按内容哈希复用已有文件
+        body = base64.b64decode(payload)[:-8] + i.to_bytes(8, 'big')
+        if mode == 'json':
+            kwargs = {'json': {'submission_id': submission_id, 'image_data': 'data:image/png;base64,' + base64.b64encode(body).decode()}}
+            url = '/api/upload-image'
+        elif mode == 'stream':
+            kwargs = {'data': body, 'content_type': 'image/png'}
+            url = f'/api/upload-image/{submission_id}'
+        else:
+            kwargs = {'data': {'image': (io.BytesIO(body), 'photo.png')}, 'content_type': 'multipart/form-data'}
+            url = f'/api/upload-image/{submission_id}'
+        del body
+        tracemalloc.start()
+        started = time.perf_counter()
+        response = client.post(url, **kwargs)
+        samples.append(time.perf_counter() - started)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        assert response.status_code == 200, response.get_json()
+        del kwargs
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    print(f'{mode:>9}: {summarize(samples)}, 内存分配峰值 {peak / 1024 / 1024:.1f}MB, RSS峰值增加 {rss_growth / 1024:.1f}MB')
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    if len(sys.argv) > 3:
+        run_mode(sys.argv[3], size_mb, count)
+        return
+    print(f'上传 {count} 张 {size_mb}MB 图片')
+    for mode in MODES:
+        subprocess.run([sys.executable, '-m', 'benchmarks.upload', str(size_mb), str(count), mode], check=True,
+                       cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+if __name__ == '__main__':
+    main()
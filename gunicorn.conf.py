@@ -0,0 +1,7 @@
+# Gunicorn配置：在项目目录下运行 gunicorn app:app 时自动加载
+# /api/events（服务器推送）的每个连接在页面打开期间一直占用一个处理线程，必须使用多线程（gthread）
+# 或协程（gevent）worker；默认的同步worker（sync）会被少量推送连接占满，其他请求全部排队
+bind = '0.0.0.0:5011'
+workers = 4
+worker_class = 'gthread'
+threads = 100  # 每个worker的线程数，workers * threads 应大于同时打开的学生端、教师端页面数加上并发请求数
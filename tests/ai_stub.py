@@ -0,0 +1,213 @@
+"""本地AI服务替身：模拟登录接口和chat-completions的SSE流式响应，供测试和基准脚本使用
+
+    stub = AIStubServer().start()
+    stub.responses.append(StubResponse.verdict(True))
+    ...
+    stub.stop()
+
+响应按HTTP/1.1分块传输逐段发送（可指定每段之间的延迟），连接保持复用，便于检查客户端的连接池行为
+"""
+import json
+import sys
+import threading
+import time
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOGIN_PATH = '/api/user/login'
+COMPLETIONS_PATH = '/pg/chat/completions'
+
+
+def sse_chunk(content=None, finish_reason=None):
+    """一条chat.completion.chunk事件（含data:前缀和空行）"""
+    delta = {} if content is None else {'content': content}
+    chunk = {
+        'id': 'chatcmpl-stub',
+        'object': 'chat.completion.chunk',
+        'model': 'stub',
+        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+    }
+    return f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8')
+
+
+def sse_stream(*contents):
+    """按内容片段生成完整的SSE响应体"""
+    return b''.join([sse_chunk(content) for content in contents] + [sse_chunk(finish_reason='stop'), b'data: [DONE]\n\n'])
+
+
+class StubResponse:
+    """一次请求的响应：状态码、响应体按 split 字节切分后逐段发送，每段之间等待 delay 秒
+
+    body 也可以是已切分好的片段列表，按列表逐段发送
+    """
+
+    def __init__(self, body=b'', status=200, split=None, delay=0.0):
+        self.body = body
+        self.status = status
+        self.split = split
+        self.delay = delay
+
+    @classmethod
+    def verdict(cls, ok, **kwargs):
+        return cls(sse_stream('{"ok": %s}' % ('true' if ok else 'false')), **kwargs)
+
+    def chunks(self):
+        if isinstance(self.body, list):
+            return self.body
+        if not self.split:
+            return [self.body] if self.body else []
+        return [self.body[i:i + self.split] for i in range(0, len(self.body), self.split)]
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """客户端提前断开（识别到判定后关闭流）是正常情况，不打印异常；监听队列按大量并发连接设置"""
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class AIStubServer:
+    """在本机随机端口运行的AI服务替身
+
+    responses 中的响应按请求顺序依次使用，用完后返回 default_response。
+    requests 记录每次chat-completions请求的请求体（已解析的JSON）、大小和Cookie，
+    connections 记录建立过的TCP连接数，max_active 记录同时在处理的审核请求数的峰值。fetch_images 为True时像真实的AI服务一样先下载请求中的图片URL，
+    下载的字节数计入 fetched_bytes
+    """
+
+    def __init__(self):
+        self.responses = deque()
+        self.default_response = StubResponse.verdict(True)
+        self.requests = []
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self.logins = 0
+        self.valid_cookies = set()
+        self.check_cookies = False
+        self.fetch_images = False
+        self.fetched_bytes = 0
+        self.lock = threading.Lock()
+        self.server = QuietHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = None
+
+    @property
+    def completions_url(self):
+        return self.url + COMPLETIONS_PATH
+
+    @property
+    def login_url(self):
+        return self.url + LOGIN_PATH
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), name='ai-stub', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reject_cookies(self):
+        """使已签发的cookie全部失效，之后携带旧cookie的请求返回401"""
+        with self.lock:
+            self.check_cookies = True
+            self.valid_cookies.clear()
+
+    def _next_response(self):
+        with self.lock:
+            return self.responses.popleft() if self.responses else self.default_response
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if self.path.startswith(LOGIN_PATH):
+                    self._login()
+                elif self.path == COMPLETIONS_PATH:
+                    self._complete(body)
+                else:
+                    self._send_empty(404)
+
+            def _send_empty(self, status, headers=()):
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def _login(self):
+                with stub.lock:
+                    stub.logins += 1
+                    cookie = f'stub-{stub.logins}'
+                    stub.valid_cookies.add(cookie)
+                self._send_empty(200, [('Set-Cookie', f'session={cookie}; Path=/; Max-Age=3600')])
+
+            def _fetch_images(self, payload):
+                for message in payload['messages']:
+                    if not isinstance(message['content'], list):
+                        continue
+                    for part in message['content']:
+                        url = part.get('image_url', {}).get('url', '')
+                        if url.startswith('http'):
+                            with urllib.request.urlopen(url) as image:
+                                size = len(image.read())
+                            with stub.lock:
+                                stub.fetched_bytes += size
+
+            def _complete(self, body):
+                cookie = self.headers.get('Cookie', '').replace('session=', '')
+                with stub.lock:
+                    stub.requests.append({'payload': json.loads(body), 'size': len(body), 'cookie': cookie})
+                    rejected = stub.check_cookies and cookie not in stub.valid_cookies
+                if rejected:
+                    self._send_empty(401)
+                    return
+
+                with stub.lock:
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                try:
+                    self._respond(json.loads(body))
+                finally:
+                    with stub.lock:
+                        stub.active -= 1
+
+            def _respond(self, payload):
+                if stub.fetch_images:
+                    self._fetch_images(payload)
+                response = stub._next_response()
+                self.send_response(response.status)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    for chunk in response.chunks():
+                        if response.delay:
+                            time.sleep(response.delay)
+                        self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                        self.wfile.flush()
+                    self.wfile.write(b'0\r\n\r\n')
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前关闭了连接
+                    self.close_connection = True
+
+        return Handler
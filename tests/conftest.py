@@ -0,0 +1,88 @@
+"""测试公共配置：默认使用临时SQLite数据库，设置 TEST_DATABASE_URL 时在指定的数据库（如PostgreSQL）上运行
+
+    pytest
+    TEST_DATABASE_URL=postgresql+psycopg2://homework:密码@127.0.0.1:5432/homework_test pytest
+
+测试会清空指定数据库中的全部数据，不要指向正式数据库
+"""
+import os
+import tempfile
+
+TEST_DATA_DIR = tempfile.mkdtemp(prefix='homework-test-')
+os.environ['BACKGROUND_SERVICES'] = '0'
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(TEST_DATA_DIR, 'test.db')}"
+
+import pytest
+
+import app as homework_app
+from app import db, Teacher, Student, Homework, HomeworkSubmission, HomeworkImage
+
+
+@pytest.fixture(autouse=True)
+def app_context():
+    """每个测试在应用上下文中运行，结束后清空除结构版本表和数据版本号外的所有数据"""
+    with homework_app.app.app_context():
+        yield
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            if table.name not in ('schema_migration', 'data_version'):
+                db.session.execute(table.delete())
+        db.session.commit()
+
+
+@pytest.fixture
+def client():
+    return homework_app.app.test_client()
+
+
+@pytest.fixture
+def make_submission():
+    """创建提交记录（连同所需的教师、作业和学生），可指定图片数量"""
+    counter = {'n': 0}
+
+    def factory(image_count=0, status='pending', homework=None):
+        counter['n'] += 1
+        n = counter['n']
+        if homework is None:
+            teacher = Teacher(username=f'teacher{n}', password='x', subject='数学')
+            db.session.add(teacher)
+            db.session.flush()
+            homework = Homework(subject='数学', teacher_id=teacher.id, title=f'作业{n}')
+            db.session.add(homework)
+        student = Student(name=f'学生{n}', student_id=f'S{n:04d}')
+        db.session.add(student)
+        db.session.flush()
+        submission = HomeworkSubmission(student_id=student.id, homework_id=homework.id, ai_review_status=status)
+        db.session.add(submission)
+        db.session.flush()
+        for i in range(image_count):
+            db.session.add(HomeworkImage(
+                submission_id=submission.id,
+                filename=f'{n:04d}{i:02d}.jpg',
+                original_filename=f'camera_{i}.jpg'
+            ))
+        db.session.commit()
+        return submission
+
+    return factory
+
+
+@pytest.fixture
+def ai_stub(monkeypatch):
+    """本地AI服务替身，登录和审核请求都发往替身；熔断器、自适应并发和cookie从初始状态开始"""
+    from tests.ai_stub import AIStubServer
+
+    stub = AIStubServer().start()
+    monkeypatch.setattr(homework_app, 'AI_API_URL', stub.completions_url)
+    monkeypatch.setattr(homework_app, 'AI_LOGIN_URL', stub.login_url)
+    cookie = dict(homework_app.ai_session_cookie)
+    breaker = dict(homework_app.ai_breaker)
+    concurrency = dict(homework_app.ai_concurrency)
+    homework_app.ai_session_cookie.update(value=None, obtained_at=0.0, expires_at=0.0)
+    homework_app.ai_breaker.update(state='closed', failures=0, probing=False)
+    homework_app.ai_concurrency.update(limit=float(homework_app.AI_MAX_CONCURRENT_REQUESTS), latency=None)
+    yield stub
+    homework_app.ai_session_cookie.update(cookie)
+    homework_app.ai_breaker.update(breaker)
+    homework_app.ai_concurrency.update(concurrency)
+    stub.stop()
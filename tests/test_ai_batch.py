@@ -0,0 +1,91 @@
+"""批量AI审核：同一作业的多份提交合并为一次请求，批量结果不可用时逐个审核"""
+import json
+
+import pytest
+
+import app as homework_app
+from app import db, AIReviewJob, HomeworkSubmission, call_ai_review_batch, claim_ai_review_batch, parse_batch_verdicts
+from tests.ai_stub import StubResponse, sse_stream
+
+
+def batch_response(verdicts):
+    return StubResponse(sse_stream(json.dumps([{'id': i, 'ok': ok} for i, ok in enumerate(verdicts, start=1)])))
+
+
+@pytest.fixture
+def reviewing(make_submission):
+    """同一作业下三份判定中的提交，每份两张图片"""
+    first = make_submission(image_count=2, status='reviewing')
+    submissions = [first] + [make_submission(image_count=2, status='reviewing', homework=first.homework) for _ in range(2)]
+    return [submission.id for submission in submissions]
+
+
+def statuses(submission_ids):
+    db.session.expire_all()
+    return [db.session.get(HomeworkSubmission, submission_id).ai_review_status for submission_id in submission_ids]
+
+
+def test_batch_reviews_all_submissions_in_one_request(ai_stub, reviewing, monkeypatch):
+    monkeypatch.setattr(homework_app, 'AI_REVIEW_ACTION', 'mark_abnormal')
+    ai_stub.responses.append(batch_response([True, False, True]))
+    call_ai_review_batch(reviewing)
+
+    assert len(ai_stub.requests) == 1
+    content = ai_stub.requests[0]['payload']['messages'][1]['content']
+    assert [part['text'] for part in content if part['type'] == 'text'][1:] == ['第 1 组：', '第 2 组：', '第 3 组：']
+    assert sum(part['type'] == 'image_url' for part in content) == 6
+    assert statuses(reviewing) == ['approved', 'rejected', 'approved']
+
+
+@pytest.mark.parametrize('reply', [
+    '这些都是作业',
+    '[{"id": 1, "ok": true}, {"id": 2, "ok": true}]',
+    '[{"id": 1, "ok": true}, {"id": 2, "ok": "yes"}, {"id": 3, "ok": true}]',
+])
+def test_unusable_batch_reply_falls_back_to_single_reviews(ai_stub, reviewing, reply):
+    ai_stub.responses.append(StubResponse(sse_stream(reply)))
+    call_ai_review_batch(reviewing)
+
+    # 一次批量请求加三次单独审核
+    assert len(ai_stub.requests) == 4
+    assert statuses(reviewing) == ['approved'] * 3
+
+
+@pytest.mark.parametrize('content, verdicts', [
+    ('[{"id": 1, "ok": true}, {"id": 2, "ok": false}]', {1: True, 2: False}),
+    ('```json\n[{"id": 2, "ok": false}, {"id": 1, "ok": true}]\n```', {1: True, 2: False}),
+    ('[{"id": 1, "ok": true}]', None),
+    ('[{"id": 1, "ok": true}, {"id": 3, "ok": false}]', None),
+    ('{"ok": true}', None),
+    ('', None),
+])
+def test_parse_batch_verdicts(content, verdicts):
+    assert parse_batch_verdicts(content, 2) == verdicts
+
+
+def test_claim_waits_until_batch_is_full(monkeypatch, reviewing):
+    monkeypatch.setattr(homework_app, 'AI_REVIEW_BATCH_SIZE', 3)
+    monkeypatch.setattr(homework_app, 'AI_REVIEW_BATCH_WAIT_SECONDS', 60)
+    for submission_id in reviewing[:2]:
+        db.session.add(AIReviewJob(submission_id=submission_id))
+    db.session.commit()
+
+    claimed, wait_seconds = claim_ai_review_batch()
+    assert claimed == []
+    assert 0 < wait_seconds <= homework_app.AI_REVIEW_POLL_SECONDS
+
+    db.session.add(AIReviewJob(submission_id=reviewing[2]))
+    db.session.commit()
+    claimed, wait_seconds = claim_ai_review_batch()
+    assert [submission_id for _, submission_id in claimed] == reviewing
+    assert wait_seconds == 0
+
+
+def test_claim_takes_partial_batch_after_wait(monkeypatch, reviewing):
+    monkeypatch.setattr(homework_app, 'AI_REVIEW_BATCH_SIZE', 3)
+    monkeypatch.setattr(homework_app, 'AI_REVIEW_BATCH_WAIT_SECONDS', 0)
+    db.session.add(AIReviewJob(submission_id=reviewing[0]))
+    db.session.commit()
+
+    claimed, _ = claim_ai_review_batch()
+    assert [submission_id for _, submission_id in claimed] == reviewing[:1]
@@ -0,0 +1,51 @@
+"""AI服务熔断器：半开状态下只由探测请求的结果决定是否恢复"""
+import time
+
+import pytest
+
+import app as homework_app
+from app import ai_breaker, ai_breaker_allow_request, ai_breaker_record
+
+
+@pytest.fixture(autouse=True)
+def closed_breaker():
+    initial = dict(ai_breaker)
+    ai_breaker.update(state='closed', failures=0, opened_at=0.0,
+                      open_seconds=homework_app.AI_BREAKER_OPEN_SECONDS, probing=False)
+    yield
+    ai_breaker.update(initial)
+
+
+def trip_and_cool_down():
+    for _ in range(homework_app.AI_BREAKER_FAILURE_THRESHOLD):
+        assert ai_breaker_allow_request() == (True, False)
+        ai_breaker_record(False)
+    assert ai_breaker['state'] == 'open'
+    assert ai_breaker_allow_request() == (False, False)
+    ai_breaker['opened_at'] = time.monotonic() - ai_breaker['open_seconds']
+
+
+def test_late_result_of_earlier_request_does_not_end_probe():
+    trip_and_cool_down()
+    assert ai_breaker_allow_request() == (True, True)
+
+    # 熔断前发出的请求此时才结束
+    ai_breaker_record(True)
+    ai_breaker_record(False)
+    assert ai_breaker['state'] == 'half_open'
+    assert ai_breaker_allow_request() == (False, False)
+
+    ai_breaker_record(True, probe=True)
+    assert ai_breaker['state'] == 'closed'
+    assert ai_breaker_allow_request() == (True, False)
+
+
+def test_failed_probe_reopens_with_longer_cool_down():
+    trip_and_cool_down()
+    open_seconds = ai_breaker['open_seconds']
+    assert ai_breaker_allow_request() == (True, True)
+
+    ai_breaker_record(False, probe=True)
+    assert ai_breaker['state'] == 'open'
+    assert ai_breaker['probing'] is False
+    assert ai_breaker['open_seconds'] == min(open_seconds * 2, homework_app.AI_BREAKER_MAX_OPEN_SECONDS)
@@ -0,0 +1,58 @@
+"""AI请求客户端：共享连接池复用连接、cookie失效后重新登录、总时限"""
+import threading
+
+import httpx
+import pytest
+
+import app as homework_app
+from app import build_ai_payload, request_ai_completion
+from tests.ai_stub import StubResponse, sse_chunk
+
+PAYLOAD = build_ai_payload([{'type': 'text', 'text': '测试'}])
+
+
+def test_sequential_requests_reuse_one_connection(ai_stub):
+    for _ in range(3):
+        assert request_ai_completion(PAYLOAD) == (200, '{"ok": true}')
+
+    assert ai_stub.logins == 1
+    # 登录和三次审核请求共用一个keep-alive连接
+    assert ai_stub.connections == 1
+
+
+def test_concurrent_requests_stay_within_pool_size(ai_stub):
+    ai_stub.default_response = StubResponse.verdict(True, split=32, delay=0.01)
+    request_ai_completion(PAYLOAD)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(request_ai_completion(PAYLOAD)))
+        for _ in range(homework_app.AI_HTTP_POOL_SIZE * 3)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [(200, '{"ok": true}')] * len(threads)
+    # 同时使用的连接数不超过连接池大小，连接被多个请求复用
+    assert ai_stub.max_active <= homework_app.AI_HTTP_POOL_SIZE
+    assert ai_stub.connections < len(threads)
+
+
+def test_rejected_cookie_triggers_login_and_retry(ai_stub):
+    request_ai_completion(PAYLOAD)
+    ai_stub.reject_cookies()
+
+    assert request_ai_completion(PAYLOAD) == (200, '{"ok": true}')
+    assert ai_stub.logins == 2
+    assert [request['cookie'] for request in ai_stub.requests] == ['stub-1', 'stub-1', 'stub-2']
+
+
+def test_slow_stream_exceeds_total_timeout(ai_stub, monkeypatch):
+    monkeypatch.setattr(homework_app, 'AI_TOTAL_TIMEOUT', 0.3)
+    # 每个事件都在首字节超时内到达，但整个响应超过总时限
+    ai_stub.default_response = StubResponse([sse_chunk('作业')] * 40, delay=0.05)
+
+    with pytest.raises(httpx.TimeoutException):
+        request_ai_completion(PAYLOAD)
+    assert homework_app.ai_breaker['failures'] == 1
@@ -0,0 +1,33 @@
+"""AI服务cookie：登录失败时保留原cookie，只有服务确认失效（401/403）后才清除"""
+import time
+
+import pytest
+
+import app as homework_app
+from app import ai_session_cookie, refresh_ai_session_cookie
+
+
+@pytest.fixture(autouse=True)
+def cookie(monkeypatch):
+    """当前cookie即将过期，登录一律失败"""
+    initial = dict(ai_session_cookie)
+    now = time.time()
+    ai_session_cookie.update(value='old-cookie', obtained_at=now, expires_at=now + 60, generation=7)
+    monkeypatch.setattr(homework_app, 'login_ai_gateway', lambda: (None, None))
+    yield
+    ai_session_cookie.update(initial)
+
+
+def test_failed_proactive_refresh_keeps_cookie():
+    homework_app.refresh_ai_cookie_if_needed()
+    assert refresh_ai_session_cookie(7) == ('old-cookie', 7)
+    assert ai_session_cookie['value'] == 'old-cookie'
+
+
+def test_failed_refresh_after_rejection_clears_cookie():
+    assert refresh_ai_session_cookie(7, invalidated=True) == (None, 7)
+
+
+def test_rejection_of_replaced_cookie_keeps_new_cookie():
+    ai_session_cookie.update(value='new-cookie', generation=8)
+    assert refresh_ai_session_cookie(7, invalidated=True) == ('new-cookie', 8)
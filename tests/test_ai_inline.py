@@ -0,0 +1,89 @@
+"""内联图片模式：AI请求中携带缩小后的base64图片，缩小版缓存在磁盘上"""
+import base64
+import io
+import os
+import time
+
+import pytest
+from PIL import Image
+
+import app as homework_app
+from app import db, HomeworkSubmission, call_ai_review, image_storage_path
+
+
+@pytest.fixture
+def inline_mode(monkeypatch, tmp_path):
+    """内联模式，图片和缩小版缓存写入临时目录，记录缩小编码的次数"""
+    monkeypatch.setattr(homework_app, 'AI_IMAGE_MODE', 'inline')
+    monkeypatch.setattr(homework_app, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(homework_app, 'AI_IMAGE_CACHE_FOLDER', str(tmp_path / 'cache'))
+    os.makedirs(tmp_path / 'cache')
+    encoded = []
+    write_downscaled_jpeg = homework_app.write_downscaled_jpeg
+
+    def counting_write(source, target_path, max_edge, quality):
+        encoded.append(target_path)
+        return write_downscaled_jpeg(source, target_path, max_edge, quality)
+
+    monkeypatch.setattr(homework_app, 'write_downscaled_jpeg', counting_write)
+    return encoded
+
+
+def store_photo(filename, size=(3000, 2000)):
+    """模拟手机照片：带噪点的渐变图，按高质量JPEG保存，返回文件大小"""
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40)
+    photo = Image.merge('RGB', (gradient, noise, Image.blend(gradient, noise, 0.5)))
+    path = image_storage_path(filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    photo.save(path, 'JPEG', quality=95)
+    return os.path.getsize(path)
+
+
+def sent_images(request):
+    content = request['payload']['messages'][1]['content']
+    return [part['image_url']['url'] for part in content if part['type'] == 'image_url']
+
+
+def test_inline_payload_carries_downscaled_images(ai_stub, inline_mode, make_submission):
+    submission = make_submission(image_count=2, status='reviewing')
+    original_size = sum(store_photo(image.filename) for image in submission.images)
+
+    started = time.monotonic()
+    call_ai_review(submission.id)
+    latency = time.monotonic() - started
+
+    assert len(ai_stub.requests) == 1
+    urls = sent_images(ai_stub.requests[0])
+    assert len(urls) == 2
+    for url in urls:
+        header, data = url.split(',', 1)
+        assert header == 'data:image/jpeg;base64'
+        with Image.open(io.BytesIO(base64.b64decode(data))) as image:
+            assert max(image.size) == homework_app.AI_INLINE_MAX_EDGE
+    # 缩小后的请求体远小于原图
+    assert ai_stub.requests[0]['size'] < original_size / 4
+    print(f'原图 {original_size / 1024:.0f}KB, 请求体 {ai_stub.requests[0]["size"] / 1024:.0f}KB, 审核耗时 {latency * 1000:.0f}ms')
+    db.session.expire_all()
+    assert db.session.get(HomeworkSubmission, submission.id).ai_review_status == 'approved'
+
+
+def test_downscaled_images_are_cached(ai_stub, inline_mode, make_submission):
+    submission = make_submission(image_count=1, status='reviewing')
+    store_photo(submission.images[0].filename)
+
+    call_ai_review(submission.id)
+    submission.ai_review_status = 'reviewing'
+    db.session.commit()
+    call_ai_review(submission.id)
+
+    assert len(ai_stub.requests) == 2
+    assert len(inline_mode) == 1
+    assert sent_images(ai_stub.requests[0]) == sent_images(ai_stub.requests[1])
+
+
+def test_missing_file_falls_back_to_url(ai_stub, inline_mode, make_submission):
+    submission = make_submission(image_count=1, status='reviewing')
+    call_ai_review(submission.id)
+
+    assert sent_images(ai_stub.requests[0]) == [f'{homework_app.HOMEWORK_BASE_URL}/uploads/{submission.images[0].filename}']
@@ -0,0 +1,78 @@
+"""AI审核队列：请求交给事件循环并发执行；只恢复已退出进程领取后未完成的任务，不抢走其他进程正在执行的任务"""
+import threading
+import time
+from datetime import timedelta
+
+import app as homework_app
+from app import db, AIReviewJob, HomeworkSubmission, get_china_time
+from tests.ai_stub import StubResponse
+
+
+def add_running_job(submission, owner, started_minutes_ago=1):
+    job = AIReviewJob(
+        submission_id=submission.id,
+        status='running',
+        owner=owner,
+        started_at=get_china_time() - timedelta(minutes=started_minutes_ago)
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def job_status(job_id):
+    db.session.expire_all()
+    return db.session.get(AIReviewJob, job_id).status
+
+
+def test_recovery_requeues_only_jobs_of_dead_processes(make_submission):
+    homework_app.acquire_lease('process:live-process', homework_app.PROCESS_LEASE_SECONDS)
+    live_job = add_running_job(make_submission(status='reviewing'), 'live-process')
+    dead_job = add_running_job(make_submission(status='reviewing'), 'dead-process')
+    recent_legacy_job = add_running_job(make_submission(status='reviewing'), None)
+    old_legacy_job = add_running_job(make_submission(status='reviewing'), None, started_minutes_ago=30)
+
+    assert homework_app.recover_orphaned_ai_jobs() == 2
+    assert job_status(live_job) == 'running'
+    assert job_status(dead_job) == 'queued'
+    assert job_status(recent_legacy_job) == 'running'
+    assert job_status(old_legacy_job) == 'queued'
+
+
+def test_heartbeat_keeps_own_jobs_and_expires_dead_leases(make_submission):
+    homework_app.process_heartbeat()
+    own_job = add_running_job(make_submission(status='reviewing'), homework_app.PROCESS_ID)
+    homework_app.acquire_lease('process:dead-process', -1)  # 已过期
+    homework_app.process_heartbeat()
+
+    assert job_status(own_job) == 'running'
+    assert homework_app.live_process_owners() == {homework_app.PROCESS_ID}
+
+
+def test_one_worker_keeps_many_reviews_in_flight(ai_stub, make_submission):
+    ai_stub.default_response = StubResponse.verdict(True, delay=2.0)
+    submissions = [make_submission(image_count=1, status='reviewing') for _ in range(60)]
+    db.session.add_all(AIReviewJob(submission_id=submission.id) for submission in submissions)
+    db.session.commit()
+    threads_before = threading.active_count()
+
+    # 在同一个线程中依次领取并发出全部请求，不等待AI服务响应
+    started = time.monotonic()
+    for _ in submissions:
+        homework_app.acquire_ai_slot()
+        assert homework_app.start_ai_review([homework_app.claim_ai_review_job()])
+    dispatch_seconds = time.monotonic() - started
+    for _ in submissions:
+        homework_app.handle_ai_review_result(*homework_app.ai_review_results.get(timeout=30))
+    total_seconds = time.monotonic() - started
+
+    assert dispatch_seconds < 2.0
+    assert ai_stub.max_active == len(submissions)
+    assert total_seconds < 8
+    # 新增的线程只有替身服务的连接线程，审核本身不占用线程
+    assert threading.active_count() - threads_before <= ai_stub.connections
+    db.session.expire_all()
+    assert {submission.ai_review_status for submission in HomeworkSubmission.query} == {'approved'}
+    assert AIReviewJob.query.count() == 0
+    assert homework_app.ai_concurrency['in_flight'] == 0
+    print(f'{len(submissions)} 个审核同时进行，发出请求 {dispatch_seconds * 1000:.0f}ms，全部完成 {total_seconds:.2f}s')
@@ -0,0 +1,112 @@
+"""AI流式响应解析：按录制的SSE响应检查增量解析、提前结束和判定提取
+
+tests/fixtures/ai_stream/ 中的响应由替身服务按7字节一段发送，事件和多字节字符都会被切断
+"""
+import asyncio
+import os
+import time
+
+import httpx
+import pytest
+
+from app import (build_ai_headers, build_ai_payload, find_ok_verdict, iter_sse_data,
+                 parse_ai_verdict, stream_ai_completion)
+from tests.ai_stub import StubResponse
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'ai_stream')
+PAYLOAD = build_ai_payload([{'type': 'text', 'text': '测试'}])
+HEADERS = build_ai_headers('stub')
+
+
+def recorded(name):
+    with open(os.path.join(FIXTURE_DIR, name), 'rb') as f:
+        return StubResponse(f.read(), split=7)
+
+
+def stop_on_verdict(text):
+    return find_ok_verdict(text) is not None
+
+
+def test_iter_sse_data_skips_comments_and_event_fields(ai_stub):
+    ai_stub.responses.append(recorded('chunk_split.sse'))
+
+    async def read_events():
+        async with httpx.AsyncClient() as client:
+            async with client.stream('POST', ai_stub.completions_url, json=PAYLOAD) as response:
+                return [data async for data in iter_sse_data(response, time.monotonic() + 10)]
+
+    data = asyncio.run(read_events())
+
+    assert len(data) == 10
+    assert all(item.startswith('{') for item in data[:-1])
+    assert data[-1] == '[DONE]'
+
+
+@pytest.mark.parametrize('name, content, verdict', [
+    ('fenced.sse', '```json\n{\n  "ok": true\n}\n```', True),
+    ('chunk_split.sse', '{"ok": false}', False),
+    ('malformed.sse', '无法判断图片内容。', None),
+    ('empty.sse', '', None),
+])
+def test_stream_collects_content(ai_stub, name, content, verdict):
+    ai_stub.responses.append(recorded(name))
+    status_code, full_content = stream_ai_completion(PAYLOAD, HEADERS)
+
+    assert status_code == 200
+    assert full_content == content
+    assert parse_ai_verdict(full_content) is verdict
+
+
+@pytest.mark.parametrize('name, content', [
+    ('fenced.sse', '```json\n{\n  "ok": true\n'),
+    ('chunk_split.sse', '{"ok": false'),
+    ('trailing_junk.sse', '{"ok": true}'),
+])
+def test_stream_stops_once_verdict_arrives(ai_stub, name, content):
+    ai_stub.responses.append(recorded(name))
+    status_code, full_content = stream_ai_completion(PAYLOAD, HEADERS, stop_when=stop_on_verdict)
+
+    assert status_code == 200
+    assert full_content == content
+
+
+def test_stream_without_verdict_reads_to_done(ai_stub):
+    ai_stub.responses.append(recorded('malformed.sse'))
+    assert stream_ai_completion(PAYLOAD, HEADERS, stop_when=stop_on_verdict) == (200, '无法判断图片内容。')
+
+
+def test_trailing_junk_after_verdict_is_tolerated(ai_stub):
+    ai_stub.responses.append(recorded('trailing_junk.sse'))
+    status_code, full_content = stream_ai_completion(PAYLOAD, HEADERS)
+
+    assert full_content.startswith('{"ok": true}\n\n说明：')
+    assert parse_ai_verdict(full_content) is True
+
+
+@pytest.mark.parametrize('text, verdict', [
+    ('{"ok": true}', True),
+    ('{"ok":false}', False),
+    ("{'ok': True}", True),
+    ('```json\n{"ok": false}\n```', False),
+    ('{"ok": tr', None),
+    ('{"ok": "true"}', None),
+    ('{"ok": trueish}', None),
+    ('{"okay": true}', None),
+    ('', None),
+])
+def test_find_ok_verdict(text, verdict):
+    assert find_ok_verdict(text) is verdict
+
+
+@pytest.mark.parametrize('content, verdict', [
+    ('{"ok": true}', True),
+    ('```json\n{"ok": false}\n```', False),
+    ('```\n{"ok": true}\n```', True),
+    ('{"ok": true} 以上是判定结果', True),
+    ('判定结果：{"ok": false}', False),
+    ('{"result": "ok"}', None),
+    ('[{"ok": true}]', True),
+    ('', None),
+])
+def test_parse_ai_verdict(content, verdict):
+    assert parse_ai_verdict(content) is verdict
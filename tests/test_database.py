@@ -0,0 +1,111 @@
+"""数据库相关测试：结构版本、计数维护、批量删除和多进程租约，SQLite和PostgreSQL上均应通过"""
+from datetime import timedelta
+
+import app as homework_app
+from app import (
+    db, Homework, HomeworkSubmission, HomeworkImage, AIReviewJob, FileDeletionJob, SchemaMigration, ServiceLease,
+    get_china_time
+)
+
+
+def test_schema_version_is_latest():
+    latest = db.session.query(db.func.max(SchemaMigration.version)).scalar()
+    assert latest == homework_app.SCHEMA_MIGRATIONS[-1][0]
+    assert homework_app.apply_schema_migrations() is False
+
+
+def database_schema():
+    """数据库中各表的列（名称、是否可空）和索引（名称、列、是否唯一）"""
+    inspector = db.inspect(db.engine)
+    return {
+        table: (
+            {(column['name'], column['nullable']) for column in inspector.get_columns(table)},
+            {(index['name'], tuple(index['column_names']), bool(index['unique'])) for index in inspector.get_indexes(table)}
+        )
+        for table in inspector.get_table_names()
+    }
+
+
+def test_migrations_from_legacy_schema_match_models():
+    # 迁移不引用模型：从版本1的表结构依次执行全部迁移后，应与按当前模型新建的数据库一致
+    db.session.commit()
+    expected = database_schema()
+    db.drop_all()
+    homework_app.schema_v1_tables().create_all(bind=db.engine)
+
+    homework_app.setup_database()
+
+    assert database_schema() == expected
+    assert [version for (version,) in db.session.query(SchemaMigration.version).order_by(SchemaMigration.version)] == [
+        version for version, _, _ in homework_app.SCHEMA_MIGRATIONS
+    ]
+
+
+def test_counters_follow_orm_writes(make_submission):
+    submission = make_submission(image_count=3)
+    homework = submission.homework
+    assert submission.image_count == 3
+    assert homework.submitted_count == 1
+
+    submission.ai_review_status = 'approved'
+    db.session.delete(submission.images[0])
+    db.session.commit()
+    db.session.refresh(submission)
+    db.session.refresh(homework)
+    assert submission.image_count == 2
+    assert homework.approved_count == 1
+
+    db.session.delete(submission.images[0])
+    db.session.delete(submission.images[1])
+    db.session.delete(submission)
+    db.session.commit()
+    db.session.refresh(homework)
+    assert homework.submitted_count == 0
+    assert homework.approved_count == 0
+    assert homework_app.reconcile_counters() == (0, 0)
+
+
+def test_bulk_delete_removes_review_jobs_and_delays_file_deletion(make_submission):
+    submission = make_submission(image_count=2, status='reviewing')
+    homework_id = submission.homework_id
+    db.session.add(AIReviewJob(submission_id=submission.id, status='running', started_at=get_china_time()))
+    db.session.commit()
+
+    homework_app.delete_submissions_bulk(
+        db.session.query(HomeworkSubmission.id).filter(HomeworkSubmission.id == submission.id)
+    )
+    db.session.commit()
+
+    assert HomeworkSubmission.query.count() == 0
+    assert HomeworkImage.query.count() == 0
+    assert AIReviewJob.query.count() == 0
+    assert db.session.get(Homework, homework_id).submitted_count == 0
+    jobs = FileDeletionJob.query.all()
+    assert len(jobs) == 2
+    # 其他进程可能正在复用这些文件，登记后延迟一段时间才删除
+    assert all(job.next_attempt_at > get_china_time().replace(tzinfo=None) for job in jobs)
+    assert homework_app.process_file_deletions() == (0, 0)
+
+
+def test_scheduler_lease_has_single_holder(monkeypatch):
+    assert homework_app.acquire_lease('scheduler', 600)
+    assert homework_app.acquire_lease('scheduler', 600)  # 持有者续期
+
+    monkeypatch.setattr(homework_app, 'PROCESS_ID', 'other-process')
+    assert not homework_app.acquire_lease('scheduler', 600)
+
+    # 持有者退出后租约过期，由其他进程接管
+    lease = db.session.get(ServiceLease, 'scheduler')
+    lease.expires_at = get_china_time() - timedelta(seconds=1)
+    db.session.commit()
+    assert homework_app.acquire_lease('scheduler', 600)
+    assert db.session.get(ServiceLease, 'scheduler').owner == 'other-process'
+
+
+def test_scheduled_job_runs_only_in_leader(monkeypatch):
+    calls = []
+    job = homework_app.run_as_scheduler_leader(lambda: calls.append(1))
+    job()
+    monkeypatch.setattr(homework_app, 'PROCESS_ID', 'other-process')
+    job()
+    assert calls == [1]
@@ -0,0 +1,70 @@
+"""服务器推送：事件经数据库转发，其他进程发布的事件也推送给本进程的订阅者"""
+import queue
+
+import pytest
+
+import app as homework_app
+from app import db, AppEvent
+
+
+@pytest.fixture
+def subscriber():
+    q = queue.Queue()
+    with homework_app.event_lock:
+        homework_app.event_subscribers.append(q)
+    yield q
+    with homework_app.event_lock:
+        if q in homework_app.event_subscribers:
+            homework_app.event_subscribers.remove(q)
+
+
+def drain(q):
+    messages = []
+    while not q.empty():
+        messages.append(q.get_nowait())
+    return messages
+
+
+def insert_event(event_id=None, event_type='refresh', data='{"scope": "students"}'):
+    """模拟其他进程写入的事件，返回事件编号"""
+    event = AppEvent(id=event_id, event_type=event_type, data=data)
+    db.session.add(event)
+    db.session.commit()
+    return event.id
+
+
+def test_events_from_all_processes_reach_local_subscribers(subscriber):
+    state = {'cursor': None, 'delivered': set()}
+    insert_event()  # 连接之前的事件不推送
+    homework_app.relay_events(state)
+
+    homework_app.publish_event('submission', {'submission_id': 5})
+    homework_app.relay_events(state)
+    local_id = db.session.query(db.func.max(AppEvent.id)).scalar()
+    assert drain(subscriber) == [f'id: {local_id}\nevent: submission\ndata: {{"submission_id": 5}}\n\n']
+
+    other_id = insert_event(event_type='homework', data='{"id": 3}')
+    homework_app.relay_events(state)
+    assert drain(subscriber) == [f'id: {other_id}\nevent: homework\ndata: {{"id": 3}}\n\n']
+
+
+def test_late_committed_event_is_delivered_once(subscriber):
+    # 指定远大于自增序列的编号，模拟并发提交时编号乱序可见
+    base = 1000000
+    state = {'cursor': None, 'delivered': set()}
+    insert_event(base)
+    homework_app.relay_events(state)
+    insert_event(base + 2)
+    homework_app.relay_events(state)
+    assert len(drain(subscriber)) == 1
+
+    # 编号较小的事件晚提交，仍在回看窗口内，只推送一次
+    insert_event(base + 1)
+    homework_app.relay_events(state)
+    homework_app.relay_events(state)
+    assert [message.split('\n')[0] for message in drain(subscriber)] == [f'id: {base + 1}']
+
+
+def test_latest_event_id(client):
+    event_id = insert_event()
+    assert client.get('/api/events/latest').get_json() == {'id': event_id}
@@ -0,0 +1,200 @@
+"""图片上传和处理恢复：无法解析的图片不登记，只接管已退出进程未处理完的图片"""
+import io
+import os
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+from PIL import Image
+
+import app as homework_app
+from app import db, HomeworkImage, HomeworkSubmission, get_china_time
+
+
+@pytest.fixture
+def uploads(monkeypatch, tmp_path):
+    """启用图片上传，原始文件写入临时目录，记录提交后台处理的文件而不真正处理"""
+    submitted = []
+    monkeypatch.setattr(homework_app, 'ENABLE_IMAGE_UPLOAD', True)
+    monkeypatch.setattr(homework_app, 'UPLOAD_RAW_FOLDER', str(tmp_path))
+    monkeypatch.setattr(homework_app, 'submit_image_processing', submitted.append)
+    return submitted
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'white').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def image_count(submission_id):
+    db.session.expire_all()
+    return db.session.get(HomeworkSubmission, submission_id).image_count
+
+
+def test_upload_rejects_body_with_only_image_magic(client, uploads, make_submission):
+    submission = make_submission()
+    response = client.post(f'/api/upload-image/{submission.id}', data=b'\xff\xd8\xff', content_type='image/jpeg')
+
+    assert response.status_code == 400
+    assert image_count(submission.id) == 0
+    assert uploads == []
+
+
+def test_upload_accepts_valid_image(client, uploads, make_submission):
+    submission = make_submission()
+    response = client.post(f'/api/upload-image/{submission.id}', data=png_bytes(), content_type='image/png')
+
+    assert response.status_code == 200
+    assert image_count(submission.id) == 1
+    assert len(uploads) == 1
+    image = HomeworkImage.query.filter_by(submission_id=submission.id).one()
+    assert image.processing_owner == homework_app.PROCESS_ID
+
+
+def test_confirm_blocked_when_all_images_failed(client, uploads, make_submission):
+    submission = make_submission(image_count=1)
+    HomeworkImage.query.filter_by(submission_id=submission.id).update({'processing_status': 'failed'})
+    db.session.commit()
+
+    response = client.post(f'/api/confirm-submission/{submission.id}')
+    assert response.status_code == 400
+
+
+def add_processing_image(submission, filename, owner, uploaded_minutes_ago=1):
+    image = HomeworkImage(
+        submission_id=submission.id,
+        filename=filename,
+        original_filename='camera.jpg',
+        processing_status='processing',
+        processing_owner=owner,
+        uploaded_at=get_china_time() - timedelta(minutes=uploaded_minutes_ago)
+    )
+    db.session.add(image)
+    db.session.commit()
+    return image.id
+
+
+def image_state(image_id):
+    db.session.expire_all()
+    image = db.session.get(HomeworkImage, image_id)
+    return image.processing_status, image.processing_owner
+
+
+def test_recovery_takes_over_only_images_of_dead_processes(uploads, make_submission):
+    homework_app.acquire_lease('process:live-process', homework_app.PROCESS_LEASE_SECONDS)
+    submission = make_submission()
+    for name in ('live', 'dead'):
+        open(homework_app.image_raw_path(f'{name}.jpg'), 'wb').close()
+    live_image = add_processing_image(submission, 'live.jpg', 'live-process')
+    dead_image = add_processing_image(submission, 'dead.jpg', 'dead-process')
+    # 原始文件不在本机：可能由其他服务器处理，超时后才标记失败
+    remote_image = add_processing_image(submission, 'remote.jpg', 'dead-process')
+    stale_image = add_processing_image(submission, 'stale.jpg', 'dead-process', uploaded_minutes_ago=30)
+
+    assert homework_app.recover_orphaned_images() == 2
+    assert uploads == ['dead.jpg']
+    assert image_state(live_image) == ('processing', 'live-process')
+    assert image_state(dead_image) == ('processing', homework_app.PROCESS_ID)
+    assert image_state(remote_image) == ('processing', 'dead-process')
+    assert image_state(stale_image) == ('failed', None)
+
+
+def test_recovery_does_not_resubmit_claimed_images(uploads, make_submission):
+    homework_app.process_heartbeat()
+    submission = make_submission()
+    open(homework_app.image_raw_path('dead.jpg'), 'wb').close()
+    add_processing_image(submission, 'dead.jpg', 'dead-process')
+
+    assert homework_app.recover_orphaned_images() == 1
+    assert homework_app.recover_orphaned_images() == 0
+    assert uploads == ['dead.jpg']
+
+
+def test_multipart_upload_at_size_limit_is_accepted(client, uploads, make_submission):
+    # multipart边界和字段头使请求体超过 MAX_CONTENT_LENGTH，流式接口只按图片本身的大小判断
+    submission = make_submission()
+    image = png_bytes()
+    image += b'\0' * (homework_app.MAX_IMAGE_SIZE_MB * 1024 * 1024 - len(image))
+    response = client.post(
+        f'/api/upload-image/{submission.id}',
+        data={'image': (io.BytesIO(image), 'photo.png')},
+        content_type='multipart/form-data'
+    )
+
+    assert response.status_code == 200
+    assert image_count(submission.id) == 1
+
+
+def test_upload_over_size_limit_is_rejected(client, uploads, make_submission):
+    submission = make_submission()
+    image = png_bytes()
+    image += b'\0' * (homework_app.MAX_IMAGE_SIZE_MB * 1024 * 1024 + 1 - len(image))
+    response = client.post(f'/api/upload-image/{submission.id}', data=image, content_type='image/png')
+
+    assert response.status_code == 413
+    assert image_count(submission.id) == 0
+
+
+def test_processing_result_is_finished_on_finisher_thread(monkeypatch, tmp_path, make_submission):
+    # 进程池的完成回调只把结果放入队列，保存和数据库写入在结果线程中完成
+    monkeypatch.setattr(homework_app, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(homework_app, 'UPLOAD_RAW_FOLDER', str(tmp_path / 'raw'))
+    (tmp_path / 'raw').mkdir()
+    finished = threading.Event()
+    threads = []
+    original = homework_app.finish_image_processing
+
+    def finish(filename, future, attempt):
+        threads.append(threading.current_thread().name)
+        original(filename, future, attempt)
+        finished.set()
+
+    monkeypatch.setattr(homework_app, 'finish_image_processing', finish)
+    submission = make_submission()
+    with open(homework_app.image_raw_path('fresh.jpg'), 'wb') as f:
+        f.write(png_bytes())
+    image_id = add_processing_image(submission, 'fresh.jpg', homework_app.PROCESS_ID)
+
+    homework_app.submit_image_processing('fresh.jpg')
+
+    assert finished.wait(timeout=30)
+    assert threads == ['image-finisher']
+    assert image_state(image_id)[0] == 'ready'
+    assert os.path.exists(homework_app.image_storage_path('fresh.jpg'))
+
+
+def test_failed_store_is_retried_and_raw_file_kept_until_stored(monkeypatch, tmp_path, make_submission):
+    # 对象存储暂时不可用时不标记失败，原始文件保留到保存成功，之后才删除
+    monkeypatch.setattr(homework_app, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(homework_app, 'UPLOAD_RAW_FOLDER', str(tmp_path / 'raw'))
+    monkeypatch.setattr(homework_app, 'IMAGE_STORE_RETRY_SECONDS', 0.05)
+    (tmp_path / 'raw').mkdir()
+    raw_path = homework_app.image_raw_path('flaky.jpg')
+    raw_kept = []
+    stored = threading.Event()
+    original = homework_app.image_storage.store
+
+    def flaky_store(filename, path, keep_local=False):
+        raw_kept.append(os.path.exists(raw_path))
+        if len(raw_kept) < 3:
+            raise OSError('storage unavailable')
+        original(filename, path, keep_local)
+        stored.set()
+
+    monkeypatch.setattr(homework_app.image_storage, 'store', flaky_store)
+    submission = make_submission()
+    with open(raw_path, 'wb') as f:
+        f.write(png_bytes())
+    image_id = add_processing_image(submission, 'flaky.jpg', homework_app.PROCESS_ID)
+
+    homework_app.submit_image_processing('flaky.jpg')
+
+    assert stored.wait(timeout=30)
+    deadline = time.monotonic() + 10
+    while image_state(image_id)[0] == 'processing' and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert image_state(image_id)[0] == 'ready'
+    assert raw_kept == [True, True, True]
+    assert not os.path.exists(raw_path)
@@ -0,0 +1,112 @@
+"""常用查询的执行计划：按数据库的 EXPLAIN 检查查询使用了对应的索引
+
+先写入一个学期规模的样本数据并执行 ANALYZE，数据库按统计信息在多个可用索引中选择。
+PostgreSQL在检查前还在当前事务中关闭顺序扫描（enable_seqscan=off），此时仍不使用索引说明索引不适用于该查询
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import (db, AIReviewJob, AppEvent, FileDeletionJob, Homework, HomeworkImage, HomeworkSubmission,
+                 Student, Teacher)
+
+DAY_START = datetime(2024, 9, 1)
+DAY_END = datetime(2024, 9, 2)
+
+# (说明, 构建查询的函数, 应使用的索引)，构建函数的参数为样本数据中的学生ID、作业ID和教师ID
+HOT_QUERIES = [
+    ('学生提交查询', lambda ids: HomeworkSubmission.query.filter_by(student_id=ids['student'], homework_id=ids['homework']),
+     'uq_submission_student_homework'),
+    ('按作业统计提交', lambda ids: HomeworkSubmission.query.filter(HomeworkSubmission.homework_id.in_([ids['homework']])),
+     'ix_submission_homework_status'),
+    ('按作业和状态筛选', lambda ids: HomeworkSubmission.query.filter_by(homework_id=ids['homework'], ai_review_status='rejected'),
+     'ix_submission_homework_status'),
+    ('判定超时清理', lambda ids: HomeworkSubmission.query.filter(
+        HomeworkSubmission.ai_review_status == 'reviewing', HomeworkSubmission.submitted_at < DAY_START - timedelta(hours=1)),
+     'ix_submission_status_submitted'),
+    ('提交的图片', lambda ids: HomeworkImage.query.filter_by(submission_id=ids['submission']),
+     'ix_homework_image_submission_id'),
+    ('按文件名查找图片', lambda ids: HomeworkImage.query.filter_by(filename='a.jpg'),
+     'ix_homework_image_filename'),
+    ('处理中的图片', lambda ids: db.session.query(HomeworkImage.submission_id).filter(HomeworkImage.processing_status == 'processing'),
+     'ix_image_status_submission'),
+    ('教师的作业列表', lambda ids: Homework.query.filter(
+        Homework.teacher_id == ids['teacher'], Homework.created_at >= DAY_START - timedelta(days=7)).order_by(Homework.created_at.desc()),
+     'ix_homework_teacher_created'),
+    ('当天作业', lambda ids: Homework.query.filter(Homework.created_at >= DAY_START, Homework.created_at < DAY_END),
+     'ix_homework_created_at'),
+    ('到期的文件删除任务', lambda ids: FileDeletionJob.query.filter(
+        FileDeletionJob.next_attempt_at <= DAY_START).order_by(FileDeletionJob.next_attempt_at),
+     'ix_file_deletion_job_next_attempt_at'),
+    ('过期事件清理', lambda ids: AppEvent.query.filter(AppEvent.created_at < DAY_START),
+     'ix_app_event_created_at'),
+]
+
+
+@pytest.fixture
+def term_data():
+    """10名教师各布置30次作业，200名学生提交其中一部分，每份提交两张图片，返回查询用的样本ID"""
+    db.session.execute(db.insert(Teacher), [
+        {'username': f'teacher{i}', 'password': 'x', 'subject': '数学'} for i in range(10)
+    ])
+    teacher_ids = db.session.scalars(db.select(Teacher.id)).all()
+    db.session.execute(db.insert(Homework), [
+        {'subject': '数学', 'teacher_id': teacher_id, 'title': f'作业{day}', 'created_at': DAY_START - timedelta(days=day)}
+        for teacher_id in teacher_ids for day in range(30)
+    ])
+    db.session.execute(db.insert(Student), [{'name': f'学生{i}', 'student_id': f'S{i:04d}'} for i in range(200)])
+    homework_ids = db.session.scalars(db.select(Homework.id).order_by(Homework.id)).all()
+    student_ids = db.session.scalars(db.select(Student.id)).all()
+    statuses = ['approved'] * 8 + ['rejected', 'reviewing']
+    db.session.execute(db.insert(HomeworkSubmission), [
+        {'student_id': student_id, 'homework_id': homework_id, 'ai_review_status': statuses[(i + j) % len(statuses)],
+         'submitted_at': DAY_START - timedelta(minutes=i + j), 'image_count': 2}
+        for i, homework_id in enumerate(homework_ids[::10]) for j, student_id in enumerate(student_ids)
+    ])
+    submission_ids = db.session.scalars(db.select(HomeworkSubmission.id)).all()
+    db.session.execute(db.insert(HomeworkImage), [
+        {'submission_id': submission_id, 'filename': f'{submission_id:06d}{k}.jpg', 'original_filename': 'camera.jpg',
+         'processing_status': 'ready'}
+        for submission_id in submission_ids for k in range(2)
+    ])
+    db.session.execute(db.insert(FileDeletionJob), [
+        {'filename': f'deleted{i}.jpg', 'next_attempt_at': DAY_END + timedelta(minutes=i)} for i in range(500)
+    ])
+    db.session.execute(db.insert(AppEvent), [
+        {'event_type': 'submission', 'data': '{}', 'created_at': DAY_END + timedelta(seconds=i)} for i in range(500)
+    ])
+    db.session.commit()
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql('ANALYZE')
+        connection.commit()
+    return {'teacher': teacher_ids[0], 'homework': homework_ids[0], 'student': student_ids[0], 'submission': submission_ids[0]}
+
+
+def query_plan(query):
+    """用当前数据库的EXPLAIN取得查询的执行计划文本"""
+    compiled = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    connection = db.session.connection()
+    if db.engine.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + compiled.string, params)
+        return '\n'.join(row[-1] for row in rows)
+    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    rows = connection.exec_driver_sql('EXPLAIN ' + compiled.string, params)
+    return '\n'.join(row[0] for row in rows)
+
+
+def test_hot_queries_use_indexes(term_data):
+    missing = []
+    for name, build_query, index in HOT_QUERIES:
+        plan = query_plan(build_query(term_data))
+        db.session.rollback()
+        if index not in plan:
+            missing.append(f'{name}未使用索引 {index}:\n{plan}')
+    assert not missing, '\n\n'.join(missing)
+
+    plan = query_plan(AIReviewJob.query.filter_by(submission_id=term_data['submission']))
+    db.session.rollback()
+    # 唯一约束自动创建的索引名称随数据库不同
+    assert 'INDEX' in plan.upper() and 'ai_review_job' in plan
@@ -0,0 +1,109 @@
+"""S3兼容对象存储：用moto模拟S3，检查上传、读取、删除、预签名URL重定向和后台删除"""
+import io
+import os
+from datetime import timedelta
+
+import pytest
+import requests
+from PIL import Image
+
+import app as homework_app
+from app import db, FileDeletionJob, get_china_time
+
+moto = pytest.importorskip('moto')
+
+BUCKET = 'homework-test'
+
+
+@pytest.fixture
+def s3_storage(monkeypatch, tmp_path):
+    """以模拟的S3存储桶作为图片存储，本地暂存文件和缩略图写入临时目录"""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setattr(homework_app, 'S3_ENDPOINT_URL', '')
+    monkeypatch.setattr(homework_app, 'S3_REGION', 'us-east-1')
+    monkeypatch.setattr(homework_app, 'S3_BUCKET', BUCKET)
+    monkeypatch.setattr(homework_app, 'UPLOAD_RAW_FOLDER', str(tmp_path))
+    monkeypatch.setattr(homework_app, 'UPLOAD_DERIVED_FOLDER', str(tmp_path))
+    with moto.mock_aws():
+        storage = homework_app.S3ImageStorage()
+        storage.client.create_bucket(Bucket=BUCKET)
+        monkeypatch.setattr(homework_app, 'image_storage', storage)
+        yield storage
+
+
+def store_jpeg(storage, filename, keep_local=False):
+    """把一张JPEG写入暂存路径后上传，返回文件内容"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (800, 600), 'white').save(buffer, 'JPEG')
+    path = storage.staging_path(filename)
+    with open(path, 'wb') as f:
+        f.write(buffer.getvalue())
+    storage.store(filename, path, keep_local=keep_local)
+    return buffer.getvalue()
+
+
+def test_store_open_and_delete(s3_storage):
+    content = store_jpeg(s3_storage, 'a.jpg')
+
+    head = s3_storage.client.head_object(Bucket=BUCKET, Key='uploads/a.jpg')
+    assert head['ContentType'] == 'image/jpeg'
+    assert 'immutable' in head['CacheControl']
+    assert s3_storage.exists('a.jpg')
+    with s3_storage.open('a.jpg') as f:
+        assert f.read() == content
+
+    s3_storage.delete('a.jpg')
+    assert not s3_storage.exists('a.jpg')
+    with pytest.raises(FileNotFoundError):
+        s3_storage.open('a.jpg')
+
+
+def test_staging_file_removed_after_upload(s3_storage):
+    store_jpeg(s3_storage, 'a.jpg')
+    assert not os.path.exists(s3_storage.staging_path('a.jpg'))
+
+
+def test_uploads_route_redirects_to_presigned_url(s3_storage, client):
+    content = store_jpeg(s3_storage, 'a.jpg')
+
+    response = client.get('/uploads/a.jpg')
+    assert response.status_code == 302
+    assert response.cache_control.private
+    location = response.headers['Location']
+    assert f'/{BUCKET}/uploads/a.jpg' in location or f'{BUCKET}.s3' in location
+    assert 'X-Amz-Signature=' in location
+    # 预签名URL可直接下载（moto拦截请求并校验存储桶和对象）
+    assert requests.get(location).content == content
+
+
+def test_thumbnail_generated_from_object(s3_storage, client):
+    store_jpeg(s3_storage, 'a.jpg')
+
+    response = client.get('/uploads/thumb/a.jpg')
+    assert response.status_code == 200
+    with Image.open(io.BytesIO(response.data)) as image:
+        assert max(image.size) == homework_app.IMAGE_DERIVATIVE_SIZES['thumb'][0]
+
+
+def test_background_deletion_removes_unreferenced_objects(s3_storage, make_submission):
+    submission = make_submission(image_count=1)
+    referenced = submission.images[0].filename
+    store_jpeg(s3_storage, referenced)
+    store_jpeg(s3_storage, 'orphan.jpg')
+    homework_app.enqueue_file_deletions([referenced, 'orphan.jpg'])
+    FileDeletionJob.query.update({'next_attempt_at': get_china_time() - timedelta(seconds=1)})
+    db.session.commit()
+
+    assert homework_app.process_file_deletions() == (2, 1)
+    assert s3_storage.exists(referenced)
+    assert not s3_storage.exists('orphan.jpg')
+
+
+def test_ai_url_mode_uses_presigned_url(s3_storage, make_submission, monkeypatch):
+    monkeypatch.setattr(homework_app, 'AI_IMAGE_MODE', 'url')
+    submission = make_submission(image_count=1)
+    store_jpeg(s3_storage, submission.images[0].filename)
+
+    [part] = homework_app.build_image_parts(submission.images)
+    assert 'X-Amz-Signature=' in part['image_url']['url']
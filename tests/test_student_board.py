@@ -0,0 +1,39 @@
+"""学生端看板缓存：版本号保存在数据库中，与数据变更在同一事务中递增"""
+import app as homework_app
+from app import db, Student
+
+
+def add_student(name, student_id):
+    db.session.add(Student(name=name, student_id=student_id))
+    homework_app.bump_data_version()
+    db.session.commit()
+
+
+def test_version_bumped_in_same_transaction():
+    version = homework_app.get_data_version()
+    add_student('张三', 'S0001')
+    assert homework_app.get_data_version() == version + 1
+
+    # 回滚的事务不递增版本号
+    db.session.add(Student(name='李四', student_id='S0002'))
+    homework_app.bump_data_version()
+    db.session.rollback()
+    db.session.commit()
+    assert homework_app.get_data_version() == version + 1
+
+
+def test_etag_and_cache_follow_shared_version(client, monkeypatch):
+    add_student('张三', 'S0001')
+    first = client.get('/api/students')
+    assert first.status_code == 200
+    etag = first.headers['ETag'].strip('"')
+    assert client.get('/api/students', headers={'If-None-Match': f'"{etag}"'}).status_code == 304
+
+    # 模拟其他进程写入：本进程缓存的看板不变，但数据库中的版本号已递增
+    cached = homework_app.student_board_cache['board']
+    add_student('李四', 'S0002')
+    monkeypatch.setitem(homework_app.student_board_cache, 'board', cached)
+
+    second = client.get('/api/students', headers={'If-None-Match': f'"{etag}"'})
+    assert second.status_code == 200
+    assert {student['name'] for student in second.get_json()} == {'张三', '李四'}